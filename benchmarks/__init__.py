@@ -0,0 +1 @@
+"""Offline benchmarks: a fake Canvas server and NotebookLM client for end-to-end syncs."""
@@ -0,0 +1,290 @@
+import json
+import multiprocessing
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+MAX_PAGE_SIZE = 100
+NEWEST_FILE_TIME = datetime(2024, 6, 1, tzinfo=timezone.utc)
+# File IDs are course_id * FILE_ID_STRIDE + index, so they never collide across courses.
+FILE_ID_STRIDE = 1_000_000
+# GraphQL timestamps carry the instance's UTC offset instead of the REST API's "Z".
+GRAPHQL_TIMEZONE = timezone(timedelta(hours=-6))
+
+
+class FakeCanvasConfig:
+    def __init__(
+        self,
+        courses=10,
+        files=1000,
+        file_size=4096,
+        latency=0.0,
+        rate_limit_capacity=700.0,
+        rate_limit_refill=10.0,
+        request_cost=1.0,
+    ):
+        """
+        Shape of the simulated Canvas instance.
+        :param files: Total files, spread evenly over the courses.
+        :param file_size: Bytes per file; every file has distinct content.
+        :param latency: Seconds added to every request.
+        :param rate_limit_capacity: Size of Canvas's leaky bucket (`X-Rate-Limit-Remaining`).
+        :param rate_limit_refill: Bucket units restored per second.
+        :param request_cost: Bucket units each request costs (`X-Request-Cost`); a request
+            that would empty the bucket is answered with 403 "Rate Limit Exceeded".
+        """
+        self.courses = courses
+        self.files = files
+        self.file_size = file_size
+        self.latency = latency
+        self.rate_limit_capacity = rate_limit_capacity
+        self.rate_limit_refill = rate_limit_refill
+        self.request_cost = request_cost
+
+    def files_in_course(self, course_id):
+        per_course, extra = divmod(self.files, self.courses)
+        return per_course + (1 if course_id <= extra else 0)
+
+
+class LeakyBucket:
+    def __init__(self, capacity, refill):
+        self.capacity = capacity
+        self.refill = refill
+        self.remaining = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, cost):
+        """
+        Charge a request. Returns the remaining budget, or None if the request is throttled.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.remaining = min(
+                self.capacity, self.remaining + (now - self._updated) * self.refill
+            )
+            self._updated = now
+            if self.remaining < cost:
+                return None
+            self.remaining -= cost
+            return self.remaining
+
+
+class FakeCanvasHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so the client's pooled connections are reused like against real Canvas.
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; with Nagle on, every response would wait
+    # out the client's delayed ACK (~40 ms) and the benchmark would measure that instead.
+    disable_nagle_algorithm = True
+    config: FakeCanvasConfig
+    bucket: LeakyBucket
+
+    def do_GET(self):
+        if self.config.latency:
+            time.sleep(self.config.latency)
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        path = url.path
+        remaining = None
+        # Like Canvas, only API calls draw on the rate-limit bucket; file downloads are
+        # served from file storage.
+        if path.startswith("/api/"):
+            remaining = self.bucket.take(self.config.request_cost)
+            if remaining is None:
+                self._send(403, b"403 Forbidden (Rate Limit Exceeded)", remaining=0)
+                return
+
+        if path == "/api/v1/users/self":
+            self._send_json({"id": 1, "name": "Benchmark User"}, remaining)
+        elif path == "/api/v1/users/1/courses":
+            self._send_page(url.path, query, self.config.courses, self._course, remaining)
+        elif match := re.fullmatch(r"/api/v1/courses/(\d+)", path):
+            course_id = int(match.group(1))
+            if 1 <= course_id <= self.config.courses:
+                self._send_json(self._course(course_id - 1), remaining)
+            else:
+                self._send_json({"errors": [{"message": "not found"}]}, remaining, status=404)
+        elif match := re.fullmatch(r"/api/v1/courses/(\d+)/files", path):
+            course_id = int(match.group(1))
+            count = self.config.files_in_course(course_id)
+            self._send_page(url.path, query, count, lambda i: self._file(course_id, i), remaining)
+        elif match := re.fullmatch(r"/api/v1/courses/(\d+)/folders", path):
+            folder = {"id": int(match.group(1)), "full_name": "course files"}
+            self._send_page(url.path, query, 1, lambda _: folder, remaining)
+        elif match := re.fullmatch(r"/files/(\d+)/download", path):
+            self._send(200, file_content(int(match.group(1)), self.config.file_size), remaining)
+        else:
+            self._send(404, b"not found", remaining)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        if urlsplit(self.path).path == "/api/graphql":
+            if self.config.latency:
+                time.sleep(self.config.latency)
+            remaining = self.bucket.take(self.config.request_cost)
+            if remaining is None:
+                self._send(403, b"403 Forbidden (Rate Limit Exceeded)", remaining=0)
+                return
+            self._send_json(self._graphql(json.loads(body)), remaining)
+            return
+        # Stand-in for NotebookLM's resumable upload endpoint (see FakeNotebookLMClient).
+        self._send(200, b"")
+
+    def _graphql(self, request):
+        """
+        Answer the two queries of canvas_graphql: `allCourses`, and aliased
+        `course(id: $idN) { filesConnection(...) }` fields whose cursors are offsets.
+        """
+        query, variables = request["query"], request.get("variables") or {}
+        if "allCourses" in query:
+            courses = [
+                {
+                    "_id": str(course["id"]),
+                    "name": course["name"],
+                    "courseCode": course["course_code"],
+                    "state": course["workflow_state"],
+                    "term": {"endAt": None},
+                }
+                for course in map(self._course, range(self.config.courses))
+            ]
+            return {"data": {"allCourses": courses}}
+        if "filesConnection" not in query:
+            return {"errors": [{"message": "Unsupported query"}]}
+        first = min(int(variables.get("first", MAX_PAGE_SIZE)), MAX_PAGE_SIZE)
+        data = {}
+        i = 0
+        while f"id{i}" in variables:
+            course_id = int(variables[f"id{i}"])
+            if not 1 <= course_id <= self.config.courses:
+                data[f"c{i}"] = None
+            else:
+                start = int(variables.get(f"after{i}") or 0)
+                end = min(start + first, self.config.files_in_course(course_id))
+                data[f"c{i}"] = {
+                    "filesConnection": {
+                        "nodes": [self._file_node(course_id, j) for j in range(start, end)],
+                        "pageInfo": {
+                            "hasNextPage": end < self.config.files_in_course(course_id),
+                            "endCursor": str(end),
+                        },
+                    }
+                }
+            i += 1
+        return {"data": data}
+
+    def _course(self, index):
+        course_id = index + 1
+        return {
+            "id": course_id,
+            "name": f"Benchmark Course {course_id}",
+            "course_code": f"BENCH{course_id}",
+            "workflow_state": "available",
+        }
+
+    def _file(self, course_id, index):
+        file_id = course_id * FILE_ID_STRIDE + index
+        updated_at = NEWEST_FILE_TIME - timedelta(minutes=index)
+        return {
+            "id": file_id,
+            "filename": f"lecture-{file_id}.pdf",
+            "display_name": f"lecture-{file_id}.pdf",
+            "url": f"http://{self.headers['Host']}/files/{file_id}/download",
+            "size": self.config.file_size,
+            "content-type": "application/pdf",
+            "updated_at": updated_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "folder_id": course_id,
+        }
+
+    def _file_node(self, course_id, index):
+        file = self._file(course_id, index)
+        updated_at = (NEWEST_FILE_TIME - timedelta(minutes=index)).astimezone(GRAPHQL_TIMEZONE)
+        return {
+            "_id": str(file["id"]),
+            "displayName": file["display_name"],
+            "contentType": file["content-type"],
+            "size": file["size"],
+            "url": file["url"],
+            "updatedAt": updated_at.isoformat(),
+        }
+
+    def _send_page(self, path, query, count, item, remaining):
+        page = int(query.get("page", ["1"])[0])
+        per_page = min(int(query.get("per_page", ["10"])[0]), MAX_PAGE_SIZE)
+        start = (page - 1) * per_page
+        items = [item(i) for i in range(start, min(start + per_page, count))]
+        link = None
+        if start + per_page < count:
+            link = f'<http://{self.headers["Host"]}{path}?page={page + 1}&per_page={per_page}>; rel="next"'
+        self._send_json(items, remaining, link=link)
+
+    def _send_json(self, payload, remaining, status=200, link=None):
+        self._send(status, json.dumps(payload).encode(), remaining, "application/json", link)
+
+    def _send(self, status, body, remaining=None, content_type="text/plain", link=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if remaining is not None:
+            self.send_header("X-Rate-Limit-Remaining", f"{remaining:.1f}")
+            self.send_header("X-Request-Cost", f"{self.config.request_cost:.1f}")
+        if link:
+            self.send_header("Link", link)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def file_content(file_id, size):
+    """
+    Deterministic, per-file distinct content, so deduplication does not skip uploads.
+    """
+    header = f"%PDF-fake file {file_id}\n".encode()
+    return (header * (size // len(header) + 1))[:size]
+
+
+def _serve(config, ready):
+    handler = type(
+        "ConfiguredHandler",
+        (FakeCanvasHandler,),
+        {
+            "config": config,
+            "bucket": LeakyBucket(config.rate_limit_capacity, config.rate_limit_refill),
+        },
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+class FakeCanvasServer:
+    def __init__(self, config=None):
+        """
+        A local stand-in for Canvas's REST and GraphQL APIs and file downloads.
+        Runs in its own process, so serving requests does not compete with the sync for
+        the GIL or show up in its memory usage. Use as a context manager; `url` is the
+        base URL to pass to CanvasClient.
+        """
+        self.config = config or FakeCanvasConfig()
+        self.url = None
+        self._process = None
+
+    def __enter__(self):
+        context = multiprocessing.get_context("spawn")
+        ready = context.Queue()
+        self._process = context.Process(target=_serve, args=(self.config, ready), daemon=True)
+        self._process.start()
+        self.url = f"http://127.0.0.1:{ready.get(timeout=30)}"
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
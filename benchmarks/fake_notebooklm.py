@@ -0,0 +1,89 @@
+import asyncio
+import itertools
+import time
+from types import SimpleNamespace
+
+import httpx
+
+
+class FakeNotebookLMClient:
+    def __init__(self, upload_url, processing_delay=0.0, latency=0.0):
+        """
+        Stand-in for notebooklm-py's NotebookLMClient, for NotebookLMClientWrapper.client.
+
+        Implements the calls the wrapper makes. Each uploaded file's body is posted to
+        `upload_url` (the fake Canvas server accepts it), so uploads cost a transfer as
+        they do against NotebookLM.
+        :param processing_delay: Seconds after upload until a source reports ready.
+        :param latency: Seconds added to every API call.
+        """
+        self.upload_url = upload_url
+        self.processing_delay = processing_delay
+        self.latency = latency
+        self.is_connected = False
+        self.http = None
+        self.notebooks = SimpleNamespace(create=self._create_notebook)
+        self.sources = FakeSourcesAPI(self)
+        self.calls = 0
+        self.uploads = 0
+        # notebook_id -> {source_id: registration time}
+        self.notebook_sources: dict = {}
+        self._ids = itertools.count(1)
+
+    async def __aenter__(self):
+        self.is_connected = True
+        self.http = httpx.AsyncClient(timeout=300.0)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.is_connected = False
+        await self.http.aclose()
+        self.http = None
+
+    async def refresh_auth(self):
+        pass
+
+    async def call(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def _create_notebook(self, title):
+        await self.call()
+        notebook_id = f"nb-{next(self._ids)}"
+        self.notebook_sources[notebook_id] = {}
+        return SimpleNamespace(id=notebook_id, title=title)
+
+    def register(self, notebook_id):
+        source_id = f"src-{next(self._ids)}"
+        self.notebook_sources.setdefault(notebook_id, {})[source_id] = time.monotonic()
+        self.uploads += 1
+        return source_id
+
+
+class FakeSourcesAPI:
+    def __init__(self, client):
+        self._client = client
+
+    async def add_file(self, notebook_id, file_path):
+        await self._client.call()
+        source_id = self._client.register(notebook_id)
+        with open(file_path, "rb") as f:
+            data = f.read()
+        response = await self._client.http.post(
+            f"{self._client.upload_url}/upload/{source_id}", content=data
+        )
+        response.raise_for_status()
+        return SimpleNamespace(id=source_id)
+
+    async def list(self, notebook_id):
+        await self._client.call()
+        ready_before = time.monotonic() - self._client.processing_delay
+        return [
+            SimpleNamespace(id=source_id, is_ready=registered <= ready_before, is_error=False)
+            for source_id, registered in self._client.notebook_sources.get(notebook_id, {}).items()
+        ]
+
+    async def delete(self, notebook_id, source_id):
+        await self._client.call()
+        self._client.notebook_sources.get(notebook_id, {}).pop(source_id, None)
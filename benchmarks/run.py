@@ -0,0 +1,191 @@
+"""
+Run `sync_courses` end to end against a fake Canvas server and a fake NotebookLM client.
+
+    uv run python -m benchmarks.run --courses 1000 --files 100000 --concurrency 8
+
+Options this script does not know are passed on to the sync, e.g. `--memory-threshold-mb 0`.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+from benchmarks.fake_canvas import FakeCanvasConfig, FakeCanvasServer
+from benchmarks.fake_notebooklm import FakeNotebookLMClient
+from main import build_canvas_client, setup_args, sync_courses
+from metrics import Metrics
+from notebook_client import NotebookLMClientWrapper
+from state_manager import StateManager
+
+DB_STAGES = ("state_db_read", "state_db_write", "state_db_commit")
+
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of this process so far, or None where it cannot be read.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+async def _sync_once(server_url, sync_args, notebook, db_path):
+    metrics = Metrics()
+    with StateManager(
+        db_path, flush_interval=sync_args.state_flush_interval, metrics=metrics
+    ) as sm:
+        canvas = build_canvas_client(server_url, "benchmark-token", sync_args, metrics=metrics)
+        wrapper = NotebookLMClientWrapper(auth_refresh_interval=0, metrics=metrics)
+        wrapper.client = notebook
+        uploads_before = notebook.uploads
+        started = time.perf_counter()
+        async with wrapper:
+            await sync_courses(canvas, sm, wrapper, sync_args)
+        seconds = time.perf_counter() - started
+    snapshot = metrics.snapshot()
+    files = notebook.uploads - uploads_before
+    return {
+        "seconds": round(seconds, 3),
+        "files_uploaded": files,
+        "files_per_second": round(files / seconds, 1) if seconds else None,
+        "files_listed": snapshot["counters"].get("file_listing_items", 0),
+        "db_operations": {
+            stage: snapshot["stages"].get(stage, {}).get("calls", 0) for stage in DB_STAGES
+        },
+        "canvas_rate_limiter": canvas.rate_limit_metrics(),
+        "graphql_fallbacks": snapshot["counters"].get("graphql_fallbacks", 0),
+        "stages": snapshot["stages"],
+    }
+
+
+def run_benchmark(config, sync_argv=(), runs=1, processing_delay=0.0, notebook_latency=0.0):
+    """
+    Sync the fake Canvas instance `runs` times against one state DB. The first run uploads
+    everything; later runs measure an incremental sync where nothing changed.
+    Returns a report dict.
+    """
+    sync_args = setup_args(["--yes", *sync_argv])
+    # The fake server is plain HTTP on localhost.
+    warnings.filterwarnings("ignore", "Canvas may respond unexpectedly")
+    report = {
+        "courses": config.courses,
+        "files": config.files,
+        "file_size": config.file_size,
+        "canvas_latency": config.latency,
+        "processing_delay": processing_delay,
+        "sync_args": list(sync_argv),
+        "runs": [],
+    }
+    with tempfile.TemporaryDirectory(prefix="canvas-bench-") as workdir:
+        sync_args.temp_dir = os.path.join(workdir, "downloads")
+        with FakeCanvasServer(config) as server:
+            notebook = FakeNotebookLMClient(
+                server.url, processing_delay=processing_delay, latency=notebook_latency
+            )
+            rss_before = peak_rss_bytes()
+            # Per-file log lines and client prints would dominate the timings.
+            logging.disable(logging.INFO)
+            try:
+                for _ in range(runs):
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        result = asyncio.run(
+                            _sync_once(
+                                server.url, sync_args, notebook, os.path.join(workdir, "state.db")
+                            )
+                        )
+                    report["runs"].append(result)
+            finally:
+                logging.disable(logging.NOTSET)
+            report["peak_rss_bytes"] = peak_rss_bytes()
+            report["peak_rss_before_bytes"] = rss_before
+    return report
+
+
+def describe(report):
+    lines = [f"{report['courses']} courses, {report['files']} files of {report['file_size']} bytes"]
+    for i, run in enumerate(report["runs"], start=1):
+        db = run["db_operations"]
+        lines.append(
+            f"run {i}: {run['seconds']:.2f}s, {run['files_uploaded']} uploaded "
+            f"({run['files_per_second']} files/s), {run['files_listed']} listed, "
+            f"DB {db['state_db_read']} reads / {db['state_db_write']} writes / "
+            f"{db['state_db_commit']} commits, "
+            f"Canvas API cost {run['canvas_rate_limiter']['total_request_cost']:g} "
+            f"({run['canvas_rate_limiter']['throttled']} throttled)"
+        )
+    if report["peak_rss_bytes"]:
+        lines.append(f"peak RSS: {report['peak_rss_bytes'] / (1024 * 1024):.1f} MB")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--courses", type=int, default=10)
+    parser.add_argument("--files", type=int, default=1000, help="Total files across all courses")
+    parser.add_argument("--file-size", type=int, default=4096, metavar="BYTES")
+    parser.add_argument(
+        "--canvas-latency-ms", type=float, default=0.0, help="Added to every Canvas request"
+    )
+    parser.add_argument(
+        "--rate-limit-refill",
+        type=float,
+        default=FakeCanvasConfig().rate_limit_refill,
+        help="Canvas rate-limit bucket units restored per second",
+    )
+    parser.add_argument(
+        "--request-cost", type=float, default=1.0, help="Rate-limit units per Canvas request"
+    )
+    parser.add_argument(
+        "--processing-delay",
+        type=float,
+        default=0.0,
+        metavar="SECONDS",
+        help="Time until an uploaded source is ready",
+    )
+    parser.add_argument(
+        "--notebook-latency-ms", type=float, default=0.0, help="Added to every NotebookLM call"
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=2,
+        help="Syncs against the same DB; runs after the first are incremental",
+    )
+    parser.add_argument("--json", metavar="PATH", help="Also write the full report as JSON")
+    args, sync_argv = parser.parse_known_args(argv)
+
+    config = FakeCanvasConfig(
+        courses=args.courses,
+        files=args.files,
+        file_size=args.file_size,
+        latency=args.canvas_latency_ms / 1000,
+        rate_limit_refill=args.rate_limit_refill,
+        request_cost=args.request_cost,
+    )
+    report = run_benchmark(
+        config,
+        sync_argv,
+        runs=args.runs,
+        processing_delay=args.processing_delay,
+        notebook_latency=args.notebook_latency_ms / 1000,
+    )
+    print(describe(report))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
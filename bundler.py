@@ -0,0 +1,133 @@
+import os
+
+KB = 1024
+DEFAULT_BUNDLE_BYTES = 512 * KB
+
+# Formats that still read well once concatenated into one Markdown document.
+TEXT_EXTENSIONS = frozenset(
+    {".txt", ".md", ".markdown", ".csv", ".tsv", ".tex", ".rst", ".json", ".xml", ".yaml", ".yml"}
+)
+TEXT_CONTENT_TYPES = frozenset(
+    {"application/json", "application/xml", "application/x-tex", "application/x-yaml"}
+)
+# HTML is text too, but its markup would end up in the combined document.
+MARKUP_EXTENSIONS = frozenset({".html", ".htm"})
+
+
+def is_text_like(file_name, content_type=None):
+    extension = os.path.splitext(file_name)[1].lower()
+    mime_type = (content_type or "").split(";")[0].strip().lower()
+    if extension in MARKUP_EXTENSIONS or mime_type == "text/html":
+        return False
+    return (
+        extension in TEXT_EXTENSIONS
+        or mime_type.startswith("text/")
+        or mime_type in TEXT_CONTENT_TYPES
+    )
+
+
+def bundle_id_for(course_id, folder_id, index):
+    return f"{course_id}/{folder_id}/{index}"
+
+
+class Bundle:
+    def __init__(
+        self,
+        bundle_id,
+        folder_id,
+        index,
+        size=0,
+        source_id=None,
+        notebook_id=None,
+        content_hash=None,
+    ):
+        """
+        One combined source document holding small files of a course folder.
+        :param size: Bytes of member content, used to keep within the bundle budget.
+        :param source_id: The NotebookLM source of the current document, if uploaded.
+        """
+        self.bundle_id = bundle_id
+        self.folder_id = folder_id
+        self.index = index
+        self.size = size
+        self.source_id = source_id
+        self.notebook_id = notebook_id
+        self.content_hash = content_hash
+
+    @classmethod
+    def from_id(cls, bundle_id):
+        _, folder_id, index = bundle_id.rsplit("/", 2)
+        return cls(bundle_id, folder_id, int(index))
+
+
+class SmallFileBundler:
+    def __init__(self, max_file_bytes, bundle_bytes=DEFAULT_BUNDLE_BYTES):
+        """
+        Rules for merging small text files of the same folder into combined sources.
+        :param max_file_bytes: Text files up to this size are bundled.
+        :param bundle_bytes: New members join a bundle only while it stays within this size.
+        """
+        self.max_file_bytes = max_file_bytes
+        self.bundle_bytes = bundle_bytes
+
+    def accepts(self, job):
+        return 0 < job.size <= self.max_file_bytes and is_text_like(job.file_name, job.content_type)
+
+    def compose(self, members):
+        """
+        Build the combined document from (file_id, file_name, updated_at, content) tuples.
+        Members are sorted by name, so the same content always gives the same bytes.
+        """
+        parts = []
+        for file_id, file_name, updated_at, content in sorted(members, key=lambda m: (m[1], m[0])):
+            text = content.decode("utf-8", errors="replace").strip()
+            header = f"Canvas file {file_id}" + (f", updated {updated_at}" if updated_at else "")
+            parts.append(f"# {file_name}\n\n_{header}_\n\n{text}\n")
+        return "\n".join(parts).encode()
+
+    def title(self, course_name, folder_name, index):
+        # Source titles come from the file name, so no path separators.
+        folder = (folder_name or "files").replace("/", " - ")
+        return f"{course_name} - {folder} (small files {index}).md"
+
+
+class CourseBundles:
+    def __init__(self, course_id, bundles, members, bundle_bytes=DEFAULT_BUNDLE_BYTES):
+        """
+        The bundles of one course during a sync.
+        :param bundles: Existing Bundle objects of the course.
+        :param members: Dict file_id -> bundle_id of files already in a bundle.
+        """
+        self.course_id = course_id
+        self.bundles = {bundle.bundle_id: bundle for bundle in bundles}
+        self.members = dict(members)
+        self.bundle_bytes = bundle_bytes
+
+    def get(self, bundle_id):
+        if bundle_id not in self.bundles:
+            self.bundles[bundle_id] = Bundle.from_id(bundle_id)
+        return self.bundles[bundle_id]
+
+    def assign(self, job, folder_id):
+        """
+        Pick the bundle for a new or changed small file.
+        A member stays in its bundle; a new file joins the first bundle of its folder with
+        room, or starts a new one.
+        Returns the bundle ID.
+        """
+        if job.file_id in self.members:
+            return self.members[job.file_id]
+        folder_id = str(folder_id)
+        folder_bundles = sorted(
+            (b for b in self.bundles.values() if b.folder_id == folder_id),
+            key=lambda b: b.index,
+        )
+        for bundle in folder_bundles:
+            if bundle.size + job.size <= self.bundle_bytes:
+                break
+        else:
+            index = folder_bundles[-1].index + 1 if folder_bundles else 1
+            bundle = self.get(bundle_id_for(self.course_id, folder_id, index))
+        bundle.size += job.size
+        self.members[job.file_id] = bundle.bundle_id
+        return bundle.bundle_id
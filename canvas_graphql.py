@@ -0,0 +1,163 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+import requests
+
+from metrics import Metrics
+
+# Courses whose files are listed by one query; each is an aliased field of the query.
+DEFAULT_GRAPHQL_BATCH_SIZE = 20
+# Files per course and page, the most Canvas returns for a connection.
+GRAPHQL_PAGE_SIZE = 100
+GRAPHQL_TIMEOUT = 120
+
+COURSES_QUERY = "query ActiveCourses { allCourses { _id name courseCode state term { endAt } } }"
+FILE_FIELDS = "_id displayName contentType size url updatedAt"
+
+
+class GraphQLError(Exception):
+    """
+    A GraphQL request failed, or its response did not have the expected shape.
+    """
+
+
+def files_query(count: int) -> str:
+    """
+    A query for one page of files of each of `count` courses, aliased c0..c{count-1}.
+    Variables: $first (page size), $id0.. (course IDs) and $after0.. (cursors).
+    """
+    variables = ", ".join(f"$id{i}: ID!, $after{i}: String" for i in range(count))
+    fields = " ".join(
+        f"c{i}: course(id: $id{i}) {{ filesConnection(first: $first, after: $after{i}) "
+        f"{{ nodes {{ {FILE_FIELDS} }} pageInfo {{ hasNextPage endCursor }} }} }}"
+        for i in range(count)
+    )
+    return f"query CourseFiles($first: Int!, {variables}) {{ {fields} }}"
+
+
+def utc_timestamp(value: Optional[str]) -> Optional[str]:
+    """
+    Normalize an ISO 8601 timestamp to the UTC "...Z" form the REST API uses, so stored
+    `updated_at` values and high-water marks compare equal across both backends.
+    """
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError as e:
+        raise GraphQLError(f"Unexpected timestamp {value!r}") from e
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class CanvasGraphQL:
+    def __init__(
+        self,
+        api_url: str,
+        api_key: str,
+        session: requests.Session,
+        batch_size: int = DEFAULT_GRAPHQL_BATCH_SIZE,
+        page_size: int = GRAPHQL_PAGE_SIZE,
+        metrics: Optional[Metrics] = None,
+    ):
+        """
+        Bulk course and file listings through Canvas's GraphQL endpoint, so the metadata
+        of many courses comes back in a few requests instead of one page per course.
+        :param session: The Canvas client's session, so queries share its connection pool,
+            retries and rate limiter.
+        :param batch_size: Courses whose files are fetched by one query.
+        :param page_size: Files per course and query.
+        """
+        self.url = f"{api_url.rstrip('/')}/api/graphql"
+        self.api_key = api_key
+        self.session = session
+        self.batch_size = batch_size
+        self.page_size = page_size
+        self.metrics = metrics or Metrics()
+
+    def query(self, query: str, variables: Optional[dict] = None) -> dict:
+        """
+        Run a query and return its `data`.
+        Raises GraphQLError on an HTTP error or if the response reports errors.
+        """
+        with self.metrics.time("graphql_query"):
+            response = self.session.post(
+                self.url,
+                json={"query": query, "variables": variables or {}},
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=GRAPHQL_TIMEOUT,
+            )
+        if response.status_code != 200:
+            raise GraphQLError(f"HTTP {response.status_code} from {self.url}")
+        try:
+            payload = response.json()
+        except ValueError as e:
+            raise GraphQLError(f"Invalid JSON from {self.url}") from e
+        if payload.get("errors"):
+            messages = "; ".join(str(e.get("message", e)) for e in payload["errors"])
+            raise GraphQLError(messages)
+        if not isinstance(payload.get("data"), dict):
+            raise GraphQLError(f"No data in the response from {self.url}")
+        return payload["data"]
+
+    def active_courses(self, now: Optional[datetime] = None) -> List[dict]:
+        """
+        Metadata dicts (REST field names) of the user's available courses whose term has
+        not ended, the GraphQL counterpart of listing courses with an active enrollment.
+        """
+        now = now or datetime.now(timezone.utc)
+        courses = self.query(COURSES_QUERY).get("allCourses")
+        if not isinstance(courses, list):
+            raise GraphQLError("allCourses is missing from the response")
+        active = []
+        for course in courses:
+            term_end = utc_timestamp((course.get("term") or {}).get("endAt"))
+            if course.get("state") != "available":
+                continue
+            if term_end is not None and term_end < now.strftime("%Y-%m-%dT%H:%M:%SZ"):
+                continue
+            active.append(
+                {
+                    "id": int(course["_id"]),
+                    "name": course.get("name"),
+                    "course_code": course.get("courseCode"),
+                    "workflow_state": course["state"],
+                }
+            )
+        return active
+
+    def course_files(self, course_ids: Iterable[Any]) -> Dict[str, List[dict]]:
+        """
+        List the files of several courses, `batch_size` courses per query.
+        Courses with more files than a page are asked for their next page in a later
+        query, after the first pages of the courses not listed yet.
+        Returns a dict: course ID (as a string) -> file nodes. Courses that GraphQL does
+        not return (e.g. not accessible) are left out.
+        """
+        cursors: Dict[str, Optional[str]] = {str(course_id): None for course_id in course_ids}
+        files: Dict[str, List[dict]] = {course_id: [] for course_id in cursors}
+        listed = {}
+        while cursors:
+            batch = list(cursors.items())[: self.batch_size]
+            variables: Dict[str, Any] = {"first": self.page_size}
+            for i, (course_id, cursor) in enumerate(batch):
+                variables[f"id{i}"] = course_id
+                variables[f"after{i}"] = cursor
+            data = self.query(files_query(len(batch)), variables)
+            for i, (course_id, _) in enumerate(batch):
+                connection = (data.get(f"c{i}") or {}).get("filesConnection")
+                if connection is None:
+                    del cursors[course_id]
+                    continue
+                files[course_id].extend(connection.get("nodes") or [])
+                page_info = connection.get("pageInfo") or {}
+                # Next pages queue up behind the courses not asked for yet.
+                del cursors[course_id]
+                if page_info.get("hasNextPage"):
+                    if not page_info.get("endCursor"):
+                        raise GraphQLError(f"No cursor for the next page of course {course_id}")
+                    cursors[course_id] = page_info["endCursor"]
+                else:
+                    listed[course_id] = files[course_id]
+        return listed
@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import random
+import signal
+import time
+
+from sync_engine import DEFAULT_COURSE_CACHE_TTL, CourseTarget, resolve_courses
+
+DEFAULT_POLL_INTERVAL = 15 * 60
+DEFAULT_MIN_POLL_INTERVAL = 5 * 60
+DEFAULT_MAX_POLL_INTERVAL = 4 * 60 * 60
+DEFAULT_JITTER = 0.1
+DEFAULT_SHUTDOWN_TIMEOUT = 30.0
+
+
+class PollScheduler:
+    def __init__(
+        self,
+        interval=DEFAULT_POLL_INTERVAL,
+        min_interval=DEFAULT_MIN_POLL_INTERVAL,
+        max_interval=DEFAULT_MAX_POLL_INTERVAL,
+        jitter=DEFAULT_JITTER,
+        speedup=0.5,
+        backoff=1.5,
+        rng=None,
+    ):
+        """
+        Per-course polling intervals that adapt to how often a course changes.
+
+        A course starts at `interval`. A poll that found changes multiplies its interval by
+        `speedup`, a poll that found nothing by `backoff`, within [min_interval, max_interval].
+        Each delay is spread by ±`jitter` (a fraction) so courses added together drift apart
+        instead of hitting Canvas in lockstep. Times are `time.monotonic()` seconds.
+        """
+        self.min_interval = max(1.0, min_interval)
+        self.max_interval = max(self.min_interval, max_interval)
+        self.interval = min(max(interval, self.min_interval), self.max_interval)
+        self.jitter = max(0.0, min(jitter, 1.0))
+        self.speedup = speedup
+        self.backoff = backoff
+        self._rng = rng or random.Random()
+        # course_id -> [interval, next_poll_at]
+        self._courses = {}
+
+    def __contains__(self, course_id):
+        return course_id in self._courses
+
+    def add(self, course_id, now):
+        """
+        Start polling a course; its first poll is due right away.
+        """
+        self._courses.setdefault(course_id, [self.interval, now])
+
+    def remove(self, course_id):
+        self._courses.pop(course_id, None)
+
+    def course_ids(self):
+        return set(self._courses)
+
+    def interval_of(self, course_id):
+        return self._courses[course_id][0]
+
+    def due(self, now):
+        """
+        Course IDs whose next poll is due, most overdue first.
+        """
+        due = [(at, cid) for cid, (_, at) in self._courses.items() if at <= now]
+        return [cid for _, cid in sorted(due)]
+
+    def seconds_until_next(self, now, exclude=()):
+        """
+        Seconds until the next poll is due (0 if one is overdue), or None without courses.
+        :param exclude: Course IDs to ignore, e.g. those whose poll is still running.
+        """
+        times = [at for cid, (_, at) in self._courses.items() if cid not in exclude]
+        if not times:
+            return None
+        return max(0.0, min(times) - now)
+
+    def record(self, course_id, changed, now):
+        """
+        Adapt a course's interval to the result of its poll and schedule the next one.
+        Returns the delay in seconds until that poll.
+        """
+        entry = self._courses.get(course_id)
+        if entry is None:
+            return None
+        factor = self.speedup if changed else self.backoff
+        entry[0] = min(max(entry[0] * factor, self.min_interval), self.max_interval)
+        delay = entry[0] * (1 + self._rng.uniform(-self.jitter, self.jitter))
+        entry[1] = now + delay
+        return delay
+
+
+class SyncDaemon:
+    def __init__(
+        self,
+        engine,
+        canvas_client,
+        state_manager,
+        scheduler=None,
+        course_cache_ttl=DEFAULT_COURSE_CACHE_TTL,
+        refresh_interval=None,
+        shutdown_timeout=DEFAULT_SHUTDOWN_TIMEOUT,
+        after_poll=None,
+    ):
+        """
+        Keep syncing the managed courses, each on its own adaptive schedule.
+
+        The Canvas and NotebookLM clients behind `engine` stay open for the whole process, so
+        a poll costs one filtered file listing instead of a fresh start with imports, auth
+        and course discovery. The list of managed courses is re-read every
+        `refresh_interval` seconds (default: the scheduler's minimum interval), so courses
+        added or deleted with other commands are picked up without a restart.
+        :param shutdown_timeout: Seconds in-flight course syncs get to finish after a stop
+            request before they are cancelled; the work queue resumes them on the next start.
+        :param after_poll: Called after every course poll, e.g. to export metrics.
+        """
+        self.engine = engine
+        self.canvas_client = canvas_client
+        self.state_manager = state_manager
+        self.scheduler = scheduler or PollScheduler()
+        self.course_cache_ttl = course_cache_ttl
+        self.refresh_interval = refresh_interval or self.scheduler.min_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.after_poll = after_poll
+        self.polls = 0
+
+        self._targets = {}
+        self._running = {}
+        self._stop = asyncio.Event()
+        self._last_refresh = None
+
+    def stop(self):
+        """
+        Ask the daemon to stop: no new polls start, in-flight ones get to finish.
+        """
+        if not self._stop.is_set():
+            logging.info("Stop requested; finishing in-flight course syncs.")
+        self._stop.set()
+
+    def install_signal_handlers(self):
+        """
+        Stop gracefully on SIGTERM (`docker stop`) and SIGINT.
+        """
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                # Not supported on this platform (e.g. Windows); Ctrl+C still interrupts.
+                pass
+
+    async def run(self):
+        logging.info("Daemon started.")
+        stop_wait = asyncio.create_task(self._stop.wait())
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                if self._last_refresh is None or now - self._last_refresh >= self.refresh_interval:
+                    await self._refresh_targets(now)
+                for course_id in self.scheduler.due(now):
+                    if course_id not in self._running:
+                        self._start_poll(course_id)
+
+                # A running course is rescheduled when its poll finishes, which wakes this loop.
+                timeout = self.scheduler.seconds_until_next(time.monotonic(), self._running)
+                refresh_in = self.refresh_interval - (time.monotonic() - self._last_refresh)
+                timeout = max(0.0, refresh_in if timeout is None else min(timeout, refresh_in))
+                await asyncio.wait(
+                    [stop_wait, *self._running.values()],
+                    timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+        finally:
+            stop_wait.cancel()
+            await self._drain()
+        logging.info(f"Daemon stopped after {self.polls} course polls.")
+        logging.info(f"Run summary: {self.engine.summary.describe()}")
+
+    async def _refresh_targets(self, now):
+        """
+        Start scheduling newly managed courses and drop deleted ones.
+        """
+        self._last_refresh = now
+        managed = {
+            str(course_id): (name, notebook_id)
+            for course_id, name, notebook_id in self.state_manager.get_all_managed_courses()
+            if notebook_id
+        }
+        for course_id in self.scheduler.course_ids() - managed.keys():
+            logging.info(f"Course {course_id} is no longer managed; stopping its polls.")
+            self.scheduler.remove(course_id)
+            self._targets.pop(course_id, None)
+
+        new_ids = [course_id for course_id in managed if course_id not in self.scheduler]
+        if not new_ids:
+            return
+        try:
+            courses = await resolve_courses(
+                self.canvas_client,
+                self.state_manager,
+                new_ids,
+                concurrency=self.engine.limits.listing,
+                cache_ttl=self.course_cache_ttl,
+            )
+        except Exception as e:
+            logging.error(f"Error resolving managed courses: {e}")
+            return
+        for course in courses:
+            course_id = str(course.id)
+            name, notebook_id = managed[course_id]
+            self._targets[course_id] = (course, getattr(course, "name", None) or name, notebook_id)
+            self.scheduler.add(course_id, now)
+        logging.info(f"Polling {len(self._targets)} managed courses.")
+
+    def _start_poll(self, course_id):
+        course, name, notebook_id = self._targets[course_id]
+        target = CourseTarget(course, name, notebook_id)
+        task = asyncio.create_task(self._poll(target))
+        self._running[course_id] = task
+        task.add_done_callback(lambda _: self._running.pop(course_id, None))
+
+    async def _poll(self, target):
+        try:
+            await self.engine.run([target])
+        except Exception as e:
+            logging.error(f"Error polling course {target.course_name}: {e}")
+            target.error = e
+        if target.error is not None:
+            # A course that keeps failing is polled less often, like a dormant one.
+            delay = self.scheduler.record(target.course_id, False, time.monotonic())
+            if delay is not None:
+                logging.info(
+                    f"Poll of {target.course_name} failed; next poll in {delay / 60:.1f} min"
+                )
+            return
+        self.polls += 1
+        if self.after_poll is not None:
+            try:
+                self.after_poll()
+            except Exception as e:
+                logging.warning(f"Could not export metrics: {e}")
+        # Files that keep failing are retried from the work queue; they are no activity.
+        changed = target.synced_files > 0
+        delay = self.scheduler.record(target.course_id, changed, time.monotonic())
+        if delay is not None:
+            logging.info(
+                f"Polled {target.course_name}: {target.synced_files} synced, "
+                f"{target.failed_files} failed; next poll in {delay / 60:.1f} min"
+            )
+
+    async def _drain(self):
+        running = list(self._running.values())
+        if not running:
+            return
+        _, pending = await asyncio.wait(running, timeout=self.shutdown_timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logging.warning(
+                f"Cancelled {len(pending)} course syncs at shutdown; they resume on the next start."
+            )
+            await asyncio.gather(*pending, return_exceptions=True)
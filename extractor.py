@@ -0,0 +1,149 @@
+import asyncio
+import importlib.util
+import io
+import multiprocessing
+import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+KB = 1024
+# Below this size uploading the original costs about as much as extracting it.
+DEFAULT_MIN_EXTRACT_BYTES = 256 * KB
+# Guards against archives that inflate to far more than their download size.
+MAX_XML_BYTES = 64 * 1024 * 1024
+
+WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+DRAWING_NS = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+OOXML_EXTENSIONS = frozenset({".docx", ".pptx"})
+# PDF text needs the optional `pypdf` package; without it PDFs are uploaded as they are.
+PDF_EXTENSIONS = frozenset({".pdf"})
+# A PDF with less text than this per page is treated as scanned and left to NotebookLM.
+MIN_PDF_CHARS_PER_PAGE = 100
+
+
+def extracted_name(file_name):
+    """
+    Source title of a file's extracted text, e.g. "lecture.pptx" -> "lecture.pptx.md".
+    """
+    return f"{file_name}.md"
+
+
+def extract_text(file_name, data=None, path=None):
+    """
+    Extract the text of a DOCX, PPTX or PDF document, from `data` or the file at `path`.
+    Runs in a worker process of TextExtractor.
+    Returns UTF-8 Markdown, or None if the document has no usable text.
+    """
+    extension = os.path.splitext(file_name)[1].lower()
+    source = io.BytesIO(data) if data is not None else path
+    if extension == ".docx":
+        text = _docx_text(source)
+    elif extension == ".pptx":
+        text = _pptx_text(source)
+    elif extension in PDF_EXTENSIONS:
+        text = _pdf_text(source)
+    else:
+        return None
+    return text.encode() if text and text.strip() else None
+
+
+def _read_xml(archive, name):
+    info = archive.getinfo(name)
+    if info.file_size > MAX_XML_BYTES:
+        raise ValueError(f"{name} is too large to extract ({info.file_size} bytes)")
+    return ElementTree.fromstring(archive.read(info))
+
+
+def _paragraphs(root, paragraph_tag, text_tag):
+    for paragraph in root.iter(paragraph_tag):
+        text = "".join(node.text or "" for node in paragraph.iter(text_tag)).strip()
+        if text:
+            yield text
+
+
+def _docx_text(source):
+    with zipfile.ZipFile(source) as archive:
+        root = _read_xml(archive, "word/document.xml")
+    return "\n\n".join(_paragraphs(root, f"{WORD_NS}p", f"{WORD_NS}t"))
+
+
+def _slide_number(name):
+    return int(re.search(r"(\d+)\.xml$", name).group(1))
+
+
+def _pptx_text(source):
+    parts = []
+    with zipfile.ZipFile(source) as archive:
+        names = set(archive.namelist())
+        slides = sorted(
+            (n for n in names if re.fullmatch(r"ppt/slides/slide\d+\.xml", n)), key=_slide_number
+        )
+        for name in slides:
+            number = _slide_number(name)
+            lines = list(_paragraphs(_read_xml(archive, name), f"{DRAWING_NS}p", f"{DRAWING_NS}t"))
+            notes_name = f"ppt/notesSlides/notesSlide{number}.xml"
+            if notes_name in names:
+                notes = _paragraphs(
+                    _read_xml(archive, notes_name), f"{DRAWING_NS}p", f"{DRAWING_NS}t"
+                )
+                # Notes slides repeat the slide number as a text box.
+                lines += [f"Notes: {line}" for line in notes if line != str(number)]
+            parts.append("\n\n".join([f"## Slide {number}", *lines]))
+    return "\n\n".join(parts)
+
+
+def _pdf_text(source):
+    from pypdf import PdfReader
+
+    reader = PdfReader(source)
+    pages = [page.extract_text() or "" for page in reader.pages]
+    if sum(len(page.strip()) for page in pages) < MIN_PDF_CHARS_PER_PAGE * len(pages):
+        return None
+    return "\n\n".join(f"## Page {i}\n\n{page.strip()}" for i, page in enumerate(pages, start=1))
+
+
+class TextExtractor:
+    def __init__(self, workers=None, min_bytes=DEFAULT_MIN_EXTRACT_BYTES):
+        """
+        Extracts the text of Office documents and PDFs in a pool of worker processes, so
+        parsing never blocks the event loop and uses more than one core.
+        :param workers: Worker processes (default: one per CPU).
+        :param min_bytes: Smaller files are uploaded as they are.
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.min_bytes = min_bytes
+        self.extensions = OOXML_EXTENSIONS
+        if importlib.util.find_spec("pypdf") is not None:
+            self.extensions = self.extensions | PDF_EXTENSIONS
+        self._pool = None
+
+    def accepts(self, job):
+        extension = os.path.splitext(job.file_name)[1].lower()
+        return extension in self.extensions and job.size >= self.min_bytes
+
+    async def extract(self, job):
+        """
+        Extract the text of a downloaded job (from `job.data` or `job.local_path`).
+        Returns the text, or None if there is none or it is not smaller than the file.
+        """
+        if self._pool is None:
+            # fork would copy the event loop and the client threads of a running sync.
+            method = (
+                "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            )
+            self._pool = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context(method)
+            )
+        text = await asyncio.get_running_loop().run_in_executor(
+            self._pool, extract_text, job.file_name, job.data, job.local_path
+        )
+        if text is None or len(text) >= job.size:
+            return None
+        return text
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+
+# Media files are not useful as NotebookLM sources, so they are never downloaded.
+DEFAULT_EXCLUDED_EXTENSIONS = frozenset(
+    {
+        ".3g2",
+        ".3gp",
+        ".aac",
+        ".aiff",
+        ".amr",
+        ".au",
+        ".avi",
+        ".cda",
+        ".flac",
+        ".flv",
+        ".m4a",
+        ".m4b",
+        ".m4p",
+        ".m4r",
+        ".m4v",
+        ".mid",
+        ".midi",
+        ".mkv",
+        ".mov",
+        ".mp3",
+        ".mp4",
+        ".ogg",
+        ".opus",
+        ".rmi",
+        ".wav",
+        ".webm",
+        ".wma",
+        ".wmv",
+    }
+)
+DEFAULT_EXCLUDED_CONTENT_TYPES = frozenset({"audio", "video"})
+
+
+def _split(values):
+    """
+    Flatten repeated and comma-separated CLI values into a list of stripped, lowercase items.
+    """
+    items = []
+    for value in values or ():
+        items.extend(part.strip().lower() for part in value.split(",") if part.strip())
+    return items
+
+
+def _extension(value):
+    return value if value.startswith(".") else f".{value}"
+
+
+def _folder(value):
+    return value.strip("/").lower()
+
+
+class FileFilter:
+    def __init__(
+        self,
+        include_extensions=None,
+        exclude_extensions=DEFAULT_EXCLUDED_EXTENSIONS,
+        include_content_types=None,
+        exclude_content_types=DEFAULT_EXCLUDED_CONTENT_TYPES,
+        min_size=None,
+        max_size=None,
+        include_folders=None,
+        exclude_folders=None,
+        updated_after=None,
+        updated_before=None,
+    ):
+        """
+        Include/exclude rules deciding which Canvas files are synced.
+
+        Content-type rules are sent to Canvas with the listing request, so excluded files
+        are never listed. The rest is compiled up front into sets, so checking a file is a
+        handful of O(1) lookups no matter how many rules there are.
+        :param include_extensions: If set, only files with one of these extensions.
+        :param exclude_extensions: Files with these extensions are skipped.
+        :param include_content_types: If set, only these MIME types. A bare type such as
+            "image" matches every subtype.
+        :param exclude_content_types: MIME types (or bare types) that are skipped.
+        :param min_size: Skip files smaller than this many bytes.
+        :param max_size: Skip files larger than this many bytes.
+        :param include_folders: If set, only files in these folders or their subfolders.
+        :param exclude_folders: Files in these folders or their subfolders are skipped.
+            Folders are paths such as "Lectures/Week 1", with or without the
+            "course files" root.
+        :param updated_after: Skip files last updated before this ISO 8601 timestamp.
+        :param updated_before: Skip files last updated after this ISO 8601 timestamp.
+        """
+        self.include_extensions = frozenset(_extension(e.lower()) for e in include_extensions or ())
+        self.exclude_extensions = frozenset(_extension(e.lower()) for e in exclude_extensions or ())
+        self.include_content_types = frozenset(t.lower() for t in include_content_types or ())
+        self.exclude_content_types = frozenset(t.lower() for t in exclude_content_types or ())
+        self.min_size = min_size
+        self.max_size = max_size
+        self.include_folders = tuple(_folder(f) for f in include_folders or ())
+        self.exclude_folders = tuple(_folder(f) for f in exclude_folders or ())
+        self.updated_after = updated_after
+        self.updated_before = updated_before
+
+    @classmethod
+    def from_args(cls, args):
+        """
+        Build a filter from parsed CLI args. Extra exclusions add to the default media rules.
+        """
+
+        def megabytes(name):
+            value = getattr(args, name, None)
+            return value * 1024 * 1024 if value is not None else None
+
+        exclude_extensions = set(_split(getattr(args, "exclude_extensions", None)))
+        exclude_content_types = set(_split(getattr(args, "exclude_content_types", None)))
+        if not getattr(args, "include_media", False):
+            exclude_extensions |= DEFAULT_EXCLUDED_EXTENSIONS
+            exclude_content_types |= DEFAULT_EXCLUDED_CONTENT_TYPES
+        return cls(
+            include_extensions=_split(getattr(args, "include_extensions", None)),
+            exclude_extensions=exclude_extensions,
+            include_content_types=_split(getattr(args, "include_content_types", None)),
+            exclude_content_types=exclude_content_types,
+            min_size=megabytes("min_size_mb"),
+            max_size=megabytes("max_size_mb"),
+            include_folders=_split(getattr(args, "include_folders", None)),
+            exclude_folders=_split(getattr(args, "exclude_folders", None)),
+            updated_after=getattr(args, "updated_after", None),
+            updated_before=getattr(args, "updated_before", None),
+        )
+
+    def signature(self):
+        """
+        A short digest of every rule. Files skipped by one set of rules may be older than
+        the high-water mark that run saves, so a mark is only reused under the same rules.
+        """
+        rules = [
+            sorted(self.include_extensions),
+            sorted(self.exclude_extensions),
+            sorted(self.include_content_types),
+            sorted(self.exclude_content_types),
+            self.min_size,
+            self.max_size,
+            list(self.include_folders),
+            list(self.exclude_folders),
+            self.updated_after,
+            self.updated_before,
+        ]
+        return hashlib.sha256(json.dumps(rules).encode()).hexdigest()[:16]
+
+    @property
+    def uses_folders(self):
+        return bool(self.include_folders or self.exclude_folders)
+
+    def api_params(self):
+        """
+        Listing parameters that let Canvas apply the content-type rules itself.
+        Canvas matches "type/subtype" pairs as well as bare types.
+        """
+        params = {}
+        if self.include_content_types:
+            params["content_types"] = sorted(self.include_content_types)
+        if self.exclude_content_types:
+            params["exclude_content_types"] = sorted(self.exclude_content_types)
+        return params
+
+    def skipped_folder_ids(self, folders):
+        """
+        Resolve the folder rules against a course's folders.
+        :param folders: A dict: folder_id -> full folder path (e.g. "course files/Lectures").
+        :return: The set of folder IDs whose files are skipped.
+        """
+        skipped = set()
+        for folder_id, full_name in folders.items():
+            paths = self._folder_paths(full_name)
+            if self.include_folders and not any(
+                self._is_within(path, rule) for path in paths for rule in self.include_folders
+            ):
+                skipped.add(folder_id)
+            elif any(
+                self._is_within(path, rule) for path in paths for rule in self.exclude_folders
+            ):
+                skipped.add(folder_id)
+        return skipped
+
+    @staticmethod
+    def _folder_paths(full_name):
+        path = _folder(full_name or "")
+        # Rules may leave out the "course files" root folder.
+        _, _, relative = path.partition("/")
+        return (path, relative) if relative else (path,)
+
+    @staticmethod
+    def _is_within(path, rule):
+        return path == rule or path.startswith(f"{rule}/")
+
+    def rejection(self, file, skipped_folder_ids=frozenset()):
+        """
+        Check a listed file against every client-side rule.
+        :return: Why the file is skipped, or None if it should be synced.
+        """
+        name = (getattr(file, "filename", None) or "").lower()
+        extension = os.path.splitext(name)[1]
+        if extension in self.exclude_extensions:
+            return f"excluded extension {extension}"
+        if self.include_extensions and extension not in self.include_extensions:
+            return f"extension {extension or '(none)'} not included"
+
+        content_type = (getattr(file, "content_type", None) or "").lower()
+        if content_type:
+            major = content_type.partition("/")[0]
+            if content_type in self.exclude_content_types or major in self.exclude_content_types:
+                return f"excluded content type {content_type}"
+            if (
+                self.include_content_types
+                and content_type not in self.include_content_types
+                and major not in self.include_content_types
+            ):
+                return f"content type {content_type} not included"
+
+        size = getattr(file, "size", None)
+        if size is not None:
+            if self.min_size is not None and size < self.min_size:
+                return f"smaller than {self.min_size} bytes"
+            if self.max_size is not None and size > self.max_size:
+                return f"larger than {self.max_size} bytes"
+
+        if getattr(file, "folder_id", None) in skipped_folder_ids:
+            return "excluded folder"
+
+        updated_at = getattr(file, "updated_at", None)
+        if updated_at:
+            if self.updated_after and updated_at < self.updated_after:
+                return f"updated before {self.updated_after}"
+            if self.updated_before and updated_at > self.updated_before:
+                return f"updated after {self.updated_before}"
+        return None
@@ -1,28 +1,59 @@
 import argparse
 import asyncio
+import json
 import logging
 import os
 import sys
 
 from dotenv import load_dotenv
 
-from canvas_client import CanvasClient
-from notebook_client import NotebookLMClientWrapper
-from state_manager import StateManager
-
-# Configure Logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[logging.FileHandler("canvas_sync.log"), logging.StreamHandler(sys.stdout)],
+from bundler import DEFAULT_BUNDLE_BYTES, KB, SmallFileBundler
+from metrics import Metrics, MetricsReporter
+from planner import (
+    DEFAULT_MAX_SOURCES_PER_NOTEBOOK,
+    DEFAULT_UPLOAD_ORDER,
+    UPLOAD_ORDERS,
+    plan_report,
+)
+from state_manager import (
+    DEFAULT_FLUSH_INTERVAL,
+    DEFAULT_MAX_ATTEMPTS,
+    DEFAULT_RETRY_BACKOFF,
+    StateManager,
 )
 
-# Load environment variables from .env file
-load_dotenv()
+# canvas_client, notebook_client, sync_engine and daemon pull in canvasapi, requests and
+# notebooklm (with its Playwright machinery). They are imported where a sync starts, so
+# utility commands such as --list-managed-courses only pay for argparse and SQLite.
+
+DEFAULT_CANVAS_URL = "https://canvas.instructure.com"
+LOG_FILE = "canvas_sync.log"
+
+
+def setup_logging(log_file=LOG_FILE):
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[logging.FileHandler(log_file), logging.StreamHandler(sys.stdout)],
+    )
+
+
+def _minutes_to_seconds(minutes, default_seconds):
+    return default_seconds if minutes is None else minutes * 60
 
-# Configuration
-CANVAS_URL = os.environ.get("CANVAS_URL", "https://canvas.instructure.com")
-CANVAS_KEY = os.environ.get("CANVAS_KEY", "")
+
+def _positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive integer, got {value}")
+    return number
+
+
+def _non_negative_int(value):
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"expected a non-negative integer, got {value}")
+    return number
 
 
 def setup_args(argv=None):
@@ -52,6 +83,354 @@ def setup_args(argv=None):
     parser.add_argument(
         "--delete-all", action="store_true", help="Delete all managed courses from local DB"
     )
+    parser.add_argument(
+        "--full-rescan",
+        action="store_true",
+        help="List every Canvas file instead of only files updated since the last full sync",
+    )
+    parser.add_argument(
+        "--course-cache-hours",
+        type=_non_negative_int,
+        metavar="HOURS",
+        help="Reuse cached Canvas course metadata for managed syncs for this long; 0 disables (default: 24)",
+    )
+    parser.add_argument(
+        "--include-extensions",
+        action="append",
+        metavar="LIST",
+        help="Only sync files with these extensions, e.g. pdf,docx (comma-separated, repeatable)",
+    )
+    parser.add_argument(
+        "--exclude-extensions",
+        action="append",
+        metavar="LIST",
+        help="Also skip files with these extensions (comma-separated, repeatable)",
+    )
+    parser.add_argument(
+        "--include-content-types",
+        action="append",
+        metavar="LIST",
+        help="Only sync these MIME types; a bare type such as image matches all subtypes (comma-separated, repeatable)",
+    )
+    parser.add_argument(
+        "--exclude-content-types",
+        action="append",
+        metavar="LIST",
+        help="Also skip these MIME types (Canvas leaves them out of the listing) (comma-separated, repeatable)",
+    )
+    parser.add_argument(
+        "--include-folders",
+        action="append",
+        metavar="LIST",
+        help="Only sync files in these folders and their subfolders, e.g. Lectures (comma-separated, repeatable)",
+    )
+    parser.add_argument(
+        "--exclude-folders",
+        action="append",
+        metavar="LIST",
+        help="Skip files in these folders and their subfolders (comma-separated, repeatable)",
+    )
+    parser.add_argument(
+        "--include-media",
+        action="store_true",
+        help="Do not skip audio and video files, which are skipped by default",
+    )
+    parser.add_argument(
+        "--min-size-mb", type=float, metavar="MB", help="Skip files smaller than this"
+    )
+    parser.add_argument(
+        "--max-size-mb", type=float, metavar="MB", help="Skip files larger than this"
+    )
+    parser.add_argument(
+        "--updated-after",
+        metavar="DATE",
+        help="Skip files last updated before this ISO 8601 date; also ends the listing early",
+    )
+    parser.add_argument(
+        "--updated-before", metavar="DATE", help="Skip files last updated after this ISO 8601 date"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=_positive_int,
+        default=1,
+        metavar="N",
+        help="Number of courses and files to process at the same time (default: 1)",
+    )
+    parser.add_argument(
+        "--listing-concurrency",
+        type=_positive_int,
+        metavar="N",
+        help="Max in-flight Canvas file listings (default: --concurrency)",
+    )
+    parser.add_argument(
+        "--download-concurrency",
+        type=_positive_int,
+        metavar="N",
+        help="Max in-flight Canvas downloads (default: --concurrency)",
+    )
+    parser.add_argument(
+        "--upload-concurrency",
+        type=_positive_int,
+        metavar="N",
+        help="Max in-flight NotebookLM uploads (default: --concurrency)",
+    )
+    parser.add_argument(
+        "--queue-depth",
+        type=_positive_int,
+        metavar="N",
+        help="Files buffered between the download, upload and processing stages (default: 4)",
+    )
+    parser.add_argument(
+        "--wait-batch-size",
+        type=_positive_int,
+        metavar="N",
+        help="Max uploaded sources per course polled together for processing (default: 50)",
+    )
+    parser.add_argument(
+        "--max-temp-disk-mb",
+        type=_positive_int,
+        metavar="MB",
+        help="Max disk used by downloaded files waiting for upload (default: 1024)",
+    )
+    parser.add_argument(
+        "--http-pool-size",
+        type=_positive_int,
+        metavar="N",
+        help="Pooled keep-alive connections to Canvas (default: max(10, concurrency limits))",
+    )
+    parser.add_argument(
+        "--http-retries",
+        type=_non_negative_int,
+        metavar="N",
+        help="Retries with jittered exponential backoff for transient Canvas HTTP errors (default: 5)",
+    )
+    parser.add_argument(
+        "--canvas-max-inflight",
+        type=_positive_int,
+        metavar="N",
+        help="Upper bound for the adaptive limit on in-flight Canvas requests (default: 16)",
+    )
+    parser.add_argument(
+        "--canvas-listing",
+        choices=("rest", "graphql"),
+        default="rest",
+        help="List courses and files through the REST API or in batched GraphQL queries; "
+        "GraphQL falls back to REST on any error (default: rest)",
+    )
+    parser.add_argument(
+        "--download-chunk-kb",
+        type=_positive_int,
+        default=1024,
+        metavar="KB",
+        help="Chunk size used when streaming Canvas downloads (default: 1024)",
+    )
+    parser.add_argument(
+        "--memory-threshold-mb",
+        type=_non_negative_int,
+        metavar="MB",
+        help="Download files up to this size into memory; they only touch --temp-dir briefly "
+        "for the upload. 0 disables (default: 16)",
+    )
+    parser.add_argument(
+        "--max-memory-mb",
+        type=_positive_int,
+        metavar="MB",
+        help="Max memory held by in-memory transfers at once (default: 256)",
+    )
+    parser.add_argument(
+        "--temp-dir",
+        metavar="PATH",
+        help="Directory for larger files spilled to disk and for staging in-memory uploads "
+        "(default: ./temp_downloads)",
+    )
+    parser.add_argument(
+        "--no-resume-downloads",
+        action="store_true",
+        help="Restart interrupted downloads of large files from zero instead of resuming them",
+    )
+    parser.add_argument(
+        "--upload-order",
+        choices=UPLOAD_ORDERS,
+        default=DEFAULT_UPLOAD_ORDER,
+        help="Upload new files newest first as Canvas lists them, or smallest first once a "
+        "course's listing is complete (default: newest)",
+    )
+    parser.add_argument(
+        "--max-sources-per-notebook",
+        type=_non_negative_int,
+        default=DEFAULT_MAX_SOURCES_PER_NOTEBOOK,
+        metavar="N",
+        help="NotebookLM's source limit; larger courses continue in extra notebooks named "
+        "'<course> (part 2)' and so on. 0 disables (default: 50)",
+    )
+    parser.add_argument(
+        "--bundle-small-files",
+        type=_non_negative_int,
+        default=0,
+        metavar="KB",
+        help="Merge text files up to this size from the same Canvas folder into combined "
+        "sources, saving notebook source slots and uploads. 0 disables (default: 0)",
+    )
+    parser.add_argument(
+        "--bundle-size-kb",
+        type=_positive_int,
+        default=DEFAULT_BUNDLE_BYTES // KB,
+        metavar="KB",
+        help="Size budget of one combined source (default: 512)",
+    )
+    parser.add_argument(
+        "--extract-text",
+        action="store_true",
+        help="Upload the text of DOCX and PPTX files (and PDFs, with pypdf installed) "
+        "instead of the documents, when it is smaller",
+    )
+    parser.add_argument(
+        "--extract-workers",
+        type=_positive_int,
+        default=None,
+        metavar="N",
+        help="Worker processes for --extract-text (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--extract-min-kb",
+        type=_non_negative_int,
+        default=None,
+        metavar="KB",
+        help="Smaller documents are uploaded as they are (default: 256)",
+    )
+    parser.add_argument(
+        "--plan",
+        nargs="?",
+        const="-",
+        metavar="PATH",
+        help="Only plan the sync: write the files that would be uploaded, their order and "
+        "notebooks, and byte and time estimates as JSON to PATH (default: stdout)",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=_positive_int,
+        default=DEFAULT_MAX_ATTEMPTS,
+        metavar="N",
+        help="Attempts per file version before a failing file is given up (default: 5)",
+    )
+    parser.add_argument(
+        "--retry-backoff-minutes",
+        type=float,
+        default=DEFAULT_RETRY_BACKOFF / 60,
+        metavar="MINUTES",
+        help="Delay before a failed file is retried, doubled after every failure (default: 5)",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="Retry failed and given-up files now instead of waiting for their backoff",
+    )
+    parser.add_argument(
+        "--auth-refresh-minutes",
+        type=float,
+        metavar="MINUTES",
+        help="How often NotebookLM auth is refreshed in the background; 0 disables (default: 20)",
+    )
+    parser.add_argument(
+        "--state-db",
+        default="state.db",
+        metavar="PATH",
+        help="State database; its -wal/-shm files live next to it (default: state.db)",
+    )
+    parser.add_argument(
+        "--state-flush-interval",
+        type=float,
+        default=DEFAULT_FLUSH_INTERVAL,
+        metavar="SECONDS",
+        help="How often batched state DB writes are committed; 0 commits every write (default: 1.0)",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        metavar="PATH",
+        help="Write per-stage timings and counters as a JSON report at the end of each sync",
+    )
+    parser.add_argument(
+        "--metrics-textfile",
+        metavar="PATH",
+        help="Write the same metrics in Prometheus text format, e.g. for node_exporter's textfile collector",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=_positive_int,
+        metavar="PORT",
+        help="Serve the metrics over HTTP at /metrics (Prometheus) and /metrics.json",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Stay running and keep syncing the managed courses, each on its own adaptive schedule",
+    )
+    parser.add_argument(
+        "--poll-minutes",
+        type=float,
+        metavar="MINUTES",
+        help="Daemon: initial polling interval of each course; worker: time between the "
+        "syncs of a tenant (default: 15)",
+    )
+    parser.add_argument(
+        "--min-poll-minutes",
+        type=float,
+        metavar="MINUTES",
+        help="Daemon: shortest interval for courses that change often (default: 5)",
+    )
+    parser.add_argument(
+        "--max-poll-minutes",
+        type=float,
+        metavar="MINUTES",
+        help="Daemon: longest interval for dormant courses (default: 240)",
+    )
+    parser.add_argument(
+        "--notebooklm-storage",
+        metavar="PATH",
+        help="NotebookLM login state to use (default: the notebooklm library's default "
+        "location); with --add-tenant, the tenant's login state",
+    )
+    parser.add_argument(
+        "--tenants-db",
+        metavar="PATH",
+        help="Registry of tenants and worker leases shared by all workers (default: tenants.db)",
+    )
+    parser.add_argument(
+        "--add-tenant",
+        metavar="ID",
+        help="Register a tenant, or update it, with CANVAS_URL/CANVAS_KEY from the environment "
+        "and --notebooklm-storage",
+    )
+    parser.add_argument(
+        "--tenant-state-db",
+        metavar="PATH",
+        help="With --add-tenant: the tenant's state DB (default: tenants/<ID>/state.db)",
+    )
+    parser.add_argument("--remove-tenant", metavar="ID", help="Unregister a tenant")
+    parser.add_argument("--list-tenants", action="store_true", help="List registered tenants")
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="Stay running and sync the registered tenants, sharing them with any other "
+        "workers on the same --tenants-db through expiring leases",
+    )
+    parser.add_argument(
+        "--worker-id", metavar="ID", help="Name of this worker (default: <hostname>-<pid>)"
+    )
+    parser.add_argument(
+        "--worker-tenants",
+        type=_positive_int,
+        default=1,
+        metavar="N",
+        help="Tenants this worker syncs at the same time (default: 1)",
+    )
+    parser.add_argument(
+        "--lease-minutes",
+        type=float,
+        metavar="MINUTES",
+        help="Worker: a tenant whose worker stops renewing its lease this long is taken over "
+        "by another worker (default: 5)",
+    )
     parser.add_argument(
         "--interactive",
         action="store_true",
@@ -60,7 +439,143 @@ def setup_args(argv=None):
     return parser.parse_args(argv)
 
 
-async def sync_courses(canvas_client, state_manager, notebook_client, args):
+async def _prepare_course(course, state_manager, notebook_client, args):
+    """
+    Confirm a course with the user and resolve (or create) its notebook.
+    Returns a CourseTarget, or None if the course should be skipped.
+    """
+    course_id = str(course.id)
+    course_name = getattr(course, "name", f"Course {course_id}")
+
+    # Interactive Confirmation for Course
+    if not args.yes:
+        print(f"\nFound Course: {course_name} (ID: {course_id})")
+        choice = input("Sync this course? [Y/n]: ").strip().lower()
+        if choice == "n":
+            logging.info(f"Skipping course: {course_name}")
+            return None
+
+    from sync_engine import CourseTarget
+
+    logging.info(f"Processing Course: {course_name}")
+
+    # Check/Create Notebook
+    nb_id = state_manager.get_course_notebook_id(course_id)
+    if not nb_id:
+        # Confirm Creation
+        if not args.yes:
+            choice = (
+                input(f"Notebook for '{course_name}' does not exist. Create it? [Y/n]: ")
+                .strip()
+                .lower()
+            )
+            if choice == "n":
+                logging.info(f"Skipping notebook creation for: {course_name}")
+                return None
+
+        try:
+            nb_id = await notebook_client.create_notebook(course_name)
+            state_manager.set_course_notebook_id(course_id, nb_id, course_name)
+            logging.info(f"Created Notebook: {course_name}")
+        except Exception as e:
+            logging.error(f"Failed to create notebook for {course_name}: {e}")
+            return None
+    else:
+        logging.info(f"Using existing Notebook ID: {nb_id}")
+
+    return CourseTarget(course, course_name, nb_id)
+
+
+def build_canvas_client(canvas_url, canvas_key, args, metrics=None):
+    from canvas_client import (
+        DEFAULT_MAX_INFLIGHT,
+        DEFAULT_MAX_RETRIES,
+        DEFAULT_POOL_SIZE,
+        CanvasClient,
+    )
+
+    return CanvasClient(
+        canvas_url,
+        canvas_key,
+        pool_size=args.http_pool_size
+        or max(
+            DEFAULT_POOL_SIZE,
+            args.concurrency,
+            args.listing_concurrency or 0,
+            args.download_concurrency or 0,
+        ),
+        max_retries=DEFAULT_MAX_RETRIES if args.http_retries is None else args.http_retries,
+        chunk_size=args.download_chunk_kb * 1024,
+        max_inflight=args.canvas_max_inflight or DEFAULT_MAX_INFLIGHT,
+        metrics=metrics,
+        listing_backend=args.canvas_listing,
+    )
+
+
+def build_notebook_client(args, metrics=None, storage_path=None):
+    from notebook_client import DEFAULT_AUTH_REFRESH_INTERVAL, NotebookLMClientWrapper
+
+    return NotebookLMClientWrapper(
+        auth_refresh_interval=_minutes_to_seconds(
+            args.auth_refresh_minutes, DEFAULT_AUTH_REFRESH_INTERVAL
+        ),
+        metrics=metrics,
+        storage_path=storage_path or getattr(args, "notebooklm_storage", None),
+    )
+
+
+def build_engine(canvas_client, state_manager, notebook_client, args):
+    from file_filter import FileFilter
+    from sync_engine import SyncEngine, SyncLimits
+
+    return SyncEngine(
+        canvas_client,
+        state_manager,
+        notebook_client,
+        limits=SyncLimits.from_args(args),
+        temp_dir=getattr(args, "temp_dir", None),
+        full_rescan=getattr(args, "full_rescan", False),
+        file_filter=FileFilter.from_args(args),
+        resume_downloads=not getattr(args, "no_resume_downloads", False),
+        max_attempts=getattr(args, "max_attempts", DEFAULT_MAX_ATTEMPTS),
+        retry_backoff=getattr(args, "retry_backoff_minutes", DEFAULT_RETRY_BACKOFF / 60) * 60,
+        metrics=state_manager.metrics,
+        upload_order=getattr(args, "upload_order", DEFAULT_UPLOAD_ORDER),
+        max_sources_per_notebook=getattr(
+            args, "max_sources_per_notebook", DEFAULT_MAX_SOURCES_PER_NOTEBOOK
+        ),
+        bundler=build_bundler(args),
+        extractor=build_extractor(args),
+    )
+
+
+def build_extractor(args):
+    """
+    Returns the TextExtractor for `--extract-text`, or None if extraction is off.
+    """
+    if not getattr(args, "extract_text", False):
+        return None
+    from extractor import DEFAULT_MIN_EXTRACT_BYTES, KB, TextExtractor
+
+    min_kb = getattr(args, "extract_min_kb", None)
+    return TextExtractor(
+        workers=getattr(args, "extract_workers", None),
+        min_bytes=DEFAULT_MIN_EXTRACT_BYTES if min_kb is None else min_kb * KB,
+    )
+
+
+def build_bundler(args):
+    """
+    Returns the SmallFileBundler for `--bundle-small-files`, or None if bundling is off.
+    """
+    max_kb = getattr(args, "bundle_small_files", 0)
+    if not max_kb:
+        return None
+    bundle_kb = getattr(args, "bundle_size_kb", DEFAULT_BUNDLE_BYTES // KB)
+    return SmallFileBundler(max_kb * KB, bundle_kb * KB)
+
+
+async def sync_courses(canvas_client, state_manager, notebook_client, args, reporter=None):
     """
     Main Logic to sync courses.
     """
@@ -85,151 +600,156 @@ async def sync_courses(canvas_client, state_manager, notebook_client, args):
                 logging.info("Managed course sync cancelled.")
                 return
 
-        managed_ids = [c[0] for c in managed_courses]
-
-        # We still need to fetch the course objects from Canvas to get the file list
-        # This is slightly inefficient if we have to fetch *all* to find them,
-        # but canvas_client.get_active_courses() is usually the best way to get 'current' stuff.
-        # Alternatively, we could fetch by ID if API supports it, but loop is safer for now.
-        all_active = canvas_client.get_active_courses()
-        courses_to_process = [c for c in all_active if str(c.id) in managed_ids]
+        courses_to_process = await _resolve_managed_courses(
+            canvas_client, state_manager, managed_courses, args
+        )
     else:
         logging.info("Mode: Sync All Active Courses")
-        courses_to_process = canvas_client.get_active_courses()
 
-    # 2. Iterate
-    for course in courses_to_process:
-        try:
-            course_id = str(course.id)
-            course_name = getattr(course, "name", f"Course {course_id}")
-
-            # Interactive Confirmation for Course
-            if not args.yes:
-                print(f"\nFound Course: {course_name} (ID: {course_id})")
-                choice = input("Sync this course? [Y/n]: ").strip().lower()
-                if choice == "n":
-                    logging.info(f"Skipping course: {course_name}")
-                    continue
-
-            logging.info(f"Processing Course: {course_name}")
-
-            # 3. Check/Create Notebook
-            nb_id = state_manager.get_course_notebook_id(course_id)
-            if not nb_id:
-                # Confirm Creation
-                if not args.yes:
-                    choice = (
-                        input(f"Notebook for '{course_name}' does not exist. Create it? [Y/n]: ")
-                        .strip()
-                        .lower()
-                    )
-                    if choice == "n":
-                        logging.info(f"Skipping notebook creation for: {course_name}")
-                        continue
-
-                try:
-                    nb_id = await notebook_client.create_notebook(course_name)
-                    state_manager.set_course_notebook_id(course_id, nb_id, course_name)
-                    logging.info(f"Created Notebook: {course_name}")
-                except Exception as e:
-                    logging.error(f"Failed to create notebook for {course_name}: {e}")
-                    continue
-            else:
-                logging.info(f"Using existing Notebook ID: {nb_id}")
-
-            # 4. Process Files
-            files = canvas_client.get_course_files(course.id)
-            for file in files:
-                file_id = str(file.id)
-                file_name = getattr(file, "filename", f"file_{file_id}")
-
-                # Filter logic can go here (extensions etc.)
-                if file_name.endswith(
-                    (
-                        ".mp3",
-                        ".mp4",
-                        ".mov",
-                        ".avi",
-                        ".wmv",
-                        ".flv",
-                        ".mkv",
-                        ".webm",
-                        ".ogg",
-                        ".wav",
-                        ".aac",
-                        ".m4a",
-                        ".wma",
-                        ".flac",
-                        ".opus",
-                        ".amr",
-                        ".aiff",
-                        ".au",
-                        ".mid",
-                        ".midi",
-                        ".rmi",
-                        ".cda",
-                        ".m4b",
-                        ".m4p",
-                        ".m4r",
-                        ".m4v",
-                        ".3gp",
-                        ".3g2",
-                        ".avi",
-                        ".wmv",
-                        ".flv",
-                        ".mkv",
-                        ".webm",
-                        ".ogg",
-                        ".wav",
-                        ".aac",
-                        ".m4a",
-                        ".wma",
-                        ".flac",
-                        ".opus",
-                        ".amr",
-                        ".aiff",
-                        ".au",
-                        ".mid",
-                        ".midi",
-                        ".rmi",
-                        ".cda",
-                        ".m4b",
-                        ".m4p",
-                        ".m4r",
-                        ".m4v",
-                        ".3gp",
-                        ".3g2",
-                    )
-                ):
-                    logging.info(f"Skipping file: {file_name}")
-                    continue
-
-                if not state_manager.is_file_processed(file_id):
-                    logging.info(f"New file found: {file_name}")
-
-                    # Ensure download dir exists
-                    download_dir = os.path.join(os.getcwd(), "temp_downloads", f"{course_id}")
-                    local_path = os.path.join(download_dir, file_name)
-
-                    try:
-                        download_url = getattr(file, "url", None)
-                        if download_url:
-                            canvas_client.download_file(download_url, local_path)
-                            await notebook_client.upload_source(nb_id, local_path)
-                            state_manager.mark_file_processed(file_id, course_id, file_name)
-                            logging.info(f"Successfully processed {file_name}")
-                    except Exception as e:
-                        logging.error(f"Error processing file {file_name}: {e}")
-                    finally:
-                        if os.path.exists(local_path):
-                            os.remove(local_path)
-                else:
-                    logging.debug(f"File already processed: {file_name}")
+    # 2. Confirm each course and make sure it has a notebook
+    targets = []
 
+    async def add_target(course):
+        try:
+            target = await _prepare_course(course, state_manager, notebook_client, args)
+            if target:
+                targets.append(target)
         except Exception as e:
             logging.error(f"Error processing course object: {e}")
 
+    if args.sync_managed_courses:
+        for course in courses_to_process:
+            await add_target(course)
+    else:
+        # Courses are confirmed as each page arrives instead of after the full listing.
+        try:
+            async for course in canvas_client.stream_active_courses():
+                await add_target(course)
+        except Exception as e:
+            logging.error(f"Error fetching courses: {e}")
+
+    if getattr(args, "retry_failed", False):
+        requeued = state_manager.retry_failed_jobs()
+        logging.info(f"Requeued {requeued} failed files.")
+
+    # 3. Process files, several courses and files at a time when --concurrency is set
+    engine = build_engine(canvas_client, state_manager, notebook_client, args)
+    try:
+        await engine.run(targets)
+    finally:
+        engine.close()
+
     logging.info("Sync Complete.")
+    logging.info(f"Run summary: {engine.summary.describe()}")
+    logging.info(f"Stage timings: {state_manager.metrics.describe()}")
+    logging.info(f"Canvas rate limiter: {canvas_client.rate_limit_metrics()}")
+    logging.info(f"NotebookLM session: {notebook_client.session_metrics()}")
+    if reporter is not None:
+        reporter.add_section("summary", engine.summary.snapshot)
+        reporter.write()
+
+
+async def _resolve_managed_courses(canvas_client, state_manager, managed_courses, args):
+    """
+    Fetch just the managed courses by ID (or from the local cache) rather than
+    paging through every active enrollment to find them.
+    """
+    from sync_engine import DEFAULT_COURSE_CACHE_TTL, SyncLimits, resolve_courses
+
+    cache_hours = getattr(args, "course_cache_hours", None)
+    return await resolve_courses(
+        canvas_client,
+        state_manager,
+        [c[0] for c in managed_courses],
+        concurrency=SyncLimits.from_args(args).listing,
+        cache_ttl=DEFAULT_COURSE_CACHE_TTL if cache_hours is None else cache_hours * 3600,
+    )
+
+
+async def plan_courses(canvas_client, state_manager, args):
+    """
+    Write what a sync with these args would do as JSON to `args.plan` ("-" for stdout),
+    without creating notebooks, queueing, downloading or uploading anything.
+    """
+    from sync_engine import CourseTarget
+
+    if args.sync_managed_courses:
+        managed_courses = state_manager.get_all_managed_courses()
+        courses = await _resolve_managed_courses(
+            canvas_client, state_manager, managed_courses, args
+        )
+    else:
+        courses = [course async for course in canvas_client.stream_active_courses()]
+
+    targets = []
+    for course in courses:
+        course_id = str(course.id)
+        targets.append(
+            CourseTarget(
+                course,
+                getattr(course, "name", f"Course {course_id}"),
+                state_manager.get_course_notebook_id(course_id),
+            )
+        )
+    logging.info(f"Planning sync of {len(targets)} courses...")
+    engine = build_engine(canvas_client, state_manager, None, args)
+    report = plan_report(
+        await engine.plan(targets),
+        engine.upload_order,
+        engine.max_sources_per_notebook,
+        transfers=min(engine.limits.downloads, engine.limits.uploads),
+        uploads=engine.limits.uploads,
+    )
+    if args.plan == "-":
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.plan, "w") as f:
+            json.dump(report, f, indent=2)
+        logging.info(
+            f"Plan written to {args.plan}: {report['upload_files']} files, "
+            f"{report['upload_bytes']} bytes, about {report['estimated_seconds']}s"
+        )
+    return report
+
+
+async def run_daemon(canvas_client, state_manager, notebook_client, args, reporter=None):
+    """
+    Keep syncing the managed courses until SIGTERM/SIGINT, reusing one set of clients.
+    """
+    from daemon import (
+        DEFAULT_MAX_POLL_INTERVAL,
+        DEFAULT_MIN_POLL_INTERVAL,
+        DEFAULT_POLL_INTERVAL,
+        PollScheduler,
+        SyncDaemon,
+    )
+    from sync_engine import DEFAULT_COURSE_CACHE_TTL
+
+    if getattr(args, "retry_failed", False):
+        requeued = state_manager.retry_failed_jobs()
+        logging.info(f"Requeued {requeued} failed files.")
+
+    cache_hours = getattr(args, "course_cache_hours", None)
+    engine = build_engine(canvas_client, state_manager, notebook_client, args)
+    if reporter is not None:
+        reporter.add_section("summary", engine.summary.snapshot)
+    daemon = SyncDaemon(
+        engine,
+        canvas_client,
+        state_manager,
+        scheduler=PollScheduler(
+            interval=_minutes_to_seconds(args.poll_minutes, DEFAULT_POLL_INTERVAL),
+            min_interval=_minutes_to_seconds(args.min_poll_minutes, DEFAULT_MIN_POLL_INTERVAL),
+            max_interval=_minutes_to_seconds(args.max_poll_minutes, DEFAULT_MAX_POLL_INTERVAL),
+        ),
+        course_cache_ttl=DEFAULT_COURSE_CACHE_TTL if cache_hours is None else cache_hours * 3600,
+        after_poll=reporter.write if reporter is not None else None,
+    )
+    daemon.install_signal_handlers()
+    try:
+        await daemon.run()
+    finally:
+        engine.close()
 
 
 def list_managed_courses(state_manager):
@@ -361,10 +881,22 @@ async def delete_courses_flow(state_manager):
 
 async def async_main(argv=None):
     args = setup_args(argv)
+    # Tenant commands use the shared registry and each tenant's own state DB.
+    if args.add_tenant or args.remove_tenant or args.list_tenants or args.worker:
+        await run_tenant_commands(args)
+        return
 
     # Initialize modules
-    state_manager = StateManager()
+    # One registry for every component, so a report covers the whole run.
+    metrics = Metrics()
+    os.makedirs(os.path.dirname(args.state_db) or ".", exist_ok=True)
+    with StateManager(
+        args.state_db, flush_interval=args.state_flush_interval, metrics=metrics
+    ) as state_manager:
+        await run_commands(args, state_manager)
+
 
+async def run_commands(args, state_manager):
     if args.delete_target and args.delete_all:
         logging.error("Use either --delete or --delete-all, not both.")
         return
@@ -388,58 +920,186 @@ async def async_main(argv=None):
         and not has_direct_utility_action
         and not args.interactive
         and not args.sync_managed_courses
+        and not args.daemon
+    )
+    has_sync_flag = (
+        args.sync_managed_courses or wants_headless_sync_all or args.daemon or bool(args.plan)
     )
-    has_sync_flag = args.sync_managed_courses or wants_headless_sync_all
 
     # If only list/delete actions were requested, exit after performing them.
     if has_direct_utility_action and not has_sync_flag and not args.interactive:
         return
 
-    if not CANVAS_KEY:
+    canvas_key = os.environ.get("CANVAS_KEY", "")
+    if not canvas_key:
         logging.error("CANVAS_KEY not set. Please set CANVAS_URL and CANVAS_KEY env vars.")
         return
 
-    canvas_client = CanvasClient(CANVAS_URL, CANVAS_KEY)
-    notebook_client = NotebookLMClientWrapper()
+    canvas_client = build_canvas_client(
+        os.environ.get("CANVAS_URL", DEFAULT_CANVAS_URL),
+        canvas_key,
+        args,
+        metrics=state_manager.metrics,
+    )
+    if args.plan:
+        # Planning only talks to Canvas.
+        await plan_courses(canvas_client, state_manager, args)
+        return
+
+    notebook_client = build_notebook_client(args, metrics=state_manager.metrics)
+
+    reporter = MetricsReporter(
+        state_manager.metrics, json_path=args.metrics_json, textfile_path=args.metrics_textfile
+    )
+    reporter.add_section("canvas_rate_limiter", canvas_client.rate_limit_metrics)
+    reporter.add_section("notebooklm_session", notebook_client.session_metrics)
+    if args.metrics_port:
+        reporter.serve(args.metrics_port)
+        logging.info(f"Serving metrics on port {args.metrics_port} at /metrics")
 
     # Check/Force Interactive Mode if no args
     # If non-interactive sync flags are passed, skip the menu unless --interactive is set.
     # Default behavior: If no args, show menu.
     show_menu = args.interactive or (not has_direct_utility_action and not has_sync_flag)
 
-    if show_menu:
-        while True:
-            print("\n=== Canvas to NotebookLM Main Menu ===")
-            print("1. Sync All Active Courses")
-            print("2. Update Managed Courses Only")
-            print("3. Delete Courses from DB")
-            print("4. Exit")
-
-            choice = input("Select an option: ").strip()
-
-            if choice == "1":
-                # Sync All
-                # We reuse the args object but force flags
-                args.sync_managed_courses = False
-                # User can still be prompted inside sync unless they passed -y to the script originally
-                await sync_courses(canvas_client, state_manager, notebook_client, args)
-            elif choice == "2":
-                # Sync managed only
-                args.sync_managed_courses = True
-                await sync_courses(canvas_client, state_manager, notebook_client, args)
-            elif choice == "3":
-                await delete_courses_flow(state_manager)
-            elif choice == "4":
-                print("Exiting.")
-                break
+    # One NotebookLM session is opened lazily and reused by every sync started below.
+    try:
+        async with notebook_client:
+            if args.daemon:
+                await run_daemon(canvas_client, state_manager, notebook_client, args, reporter)
+            elif show_menu:
+                await run_menu(args, canvas_client, state_manager, notebook_client, reporter)
             else:
-                print("Invalid option.")
-    else:
-        # Headless / Direct Mode
-        await sync_courses(canvas_client, state_manager, notebook_client, args)
+                # Headless / Direct Mode
+                await sync_courses(canvas_client, state_manager, notebook_client, args, reporter)
+    finally:
+        reporter.close()
+
+
+async def run_tenant_commands(args):
+    from tenants import DEFAULT_TENANTS_DB, Tenant, TenantRegistry
+
+    with TenantRegistry(args.tenants_db or DEFAULT_TENANTS_DB) as registry:
+        if args.add_tenant:
+            canvas_key = os.environ.get("CANVAS_KEY", "")
+            if not canvas_key:
+                logging.error("CANVAS_KEY not set. Set it to the tenant's Canvas token.")
+                return
+            tenant = Tenant(
+                args.add_tenant,
+                os.environ.get("CANVAS_URL", DEFAULT_CANVAS_URL),
+                canvas_key,
+                notebooklm_storage=args.notebooklm_storage,
+                state_db=args.tenant_state_db,
+            )
+            try:
+                registry.add_tenant(tenant)
+            except ValueError as e:
+                logging.error(str(e))
+                return
+            print(f"Registered tenant '{tenant.tenant_id}' (state DB: {tenant.state_db}).")
+        if args.remove_tenant:
+            if registry.remove_tenant(args.remove_tenant):
+                print(f"Removed tenant '{args.remove_tenant}'; its state DB is kept.")
+            else:
+                print(f"No tenant '{args.remove_tenant}'.")
+        if args.list_tenants:
+            list_tenants(registry)
+        if args.worker:
+            await run_worker(registry, args)
+
+
+def list_tenants(registry):
+    tenants = registry.get_tenants()
+    if not tenants:
+        print("No tenants registered.")
+        return
+    print("\n--- Tenants ---")
+    for tenant in tenants:
+        print(
+            f"{tenant.tenant_id}: {tenant.canvas_url}, state DB {tenant.state_db}, "
+            f"NotebookLM login {tenant.notebooklm_storage or 'default'}, "
+            f"last sync {tenant.last_synced_at or 'never'}"
+            + (f" (error: {tenant.last_error})" if tenant.last_error else "")
+        )
+
+
+async def run_worker(registry, args):
+    from tenants import DEFAULT_LEASE_SECONDS, DEFAULT_TENANT_INTERVAL, TenantWorker
+
+    async def sync(tenant):
+        await sync_tenant(tenant, args)
+
+    worker = TenantWorker(
+        registry,
+        sync,
+        worker_id=args.worker_id,
+        max_tenants=args.worker_tenants,
+        lease_seconds=_minutes_to_seconds(args.lease_minutes, DEFAULT_LEASE_SECONDS),
+        interval=_minutes_to_seconds(args.poll_minutes, DEFAULT_TENANT_INTERVAL),
+    )
+    worker.install_signal_handlers()
+    await worker.run()
+
+
+async def sync_tenant(tenant, args):
+    """
+    Sync one tenant's courses with their own state DB, Canvas token and NotebookLM login.
+    """
+    tenant_args = argparse.Namespace(**vars(args))
+    # Workers run unattended: new courses get notebooks without asking.
+    tenant_args.yes = True
+    os.makedirs(os.path.dirname(tenant.state_db) or ".", exist_ok=True)
+    metrics = Metrics()
+    with (
+        StateManager(
+            tenant.state_db, flush_interval=args.state_flush_interval, metrics=metrics
+        ) as state_manager,
+        build_canvas_client(
+            tenant.canvas_url, tenant.canvas_key, args, metrics=metrics
+        ) as canvas_client,
+    ):
+        # A worker syncs many tenants; each sync's connection pool is closed with it.
+        notebook_client = build_notebook_client(
+            args, metrics=metrics, storage_path=tenant.notebooklm_storage
+        )
+        async with notebook_client:
+            await sync_courses(canvas_client, state_manager, notebook_client, tenant_args)
+
+
+async def run_menu(args, canvas_client, state_manager, notebook_client, reporter=None):
+    while True:
+        print("\n=== Canvas to NotebookLM Main Menu ===")
+        print("1. Sync All Active Courses")
+        print("2. Update Managed Courses Only")
+        print("3. Delete Courses from DB")
+        print("4. Exit")
+
+        choice = input("Select an option: ").strip()
+
+        if choice == "1":
+            # Sync All
+            # We reuse the args object but force flags
+            args.sync_managed_courses = False
+            # User can still be prompted inside sync unless they passed -y to the script originally
+            await sync_courses(canvas_client, state_manager, notebook_client, args, reporter)
+        elif choice == "2":
+            # Sync managed only
+            args.sync_managed_courses = True
+            await sync_courses(canvas_client, state_manager, notebook_client, args, reporter)
+        elif choice == "3":
+            await delete_courses_flow(state_manager)
+        elif choice == "4":
+            print("Exiting.")
+            break
+        else:
+            print("Invalid option.")
 
 
 def cli():
+    setup_logging()
+    # Load environment variables from .env file
+    load_dotenv()
     try:
         asyncio.run(async_main())
     except KeyboardInterrupt:
@@ -0,0 +1,275 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+PROMETHEUS_PREFIX = "canvas_sync"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class StageStats:
+    def __init__(self):
+        """
+        Totals for one stage: how often it ran, how long it took and how many bytes it moved.
+        """
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.bytes = 0
+
+    def snapshot(self):
+        snapshot = {
+            "calls": self.calls,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 6),
+            "max_seconds": round(self.max_seconds, 6),
+            "bytes": self.bytes,
+        }
+        if self.calls:
+            snapshot["avg_seconds"] = round(self.seconds / self.calls, 6)
+        if self.bytes and self.seconds:
+            snapshot["bytes_per_second"] = round(self.bytes / self.seconds, 1)
+        return snapshot
+
+
+class Metrics:
+    def __init__(self):
+        """
+        Per-stage timers and plain counters for a sync run.
+        Thread-safe, since Canvas calls and state DB writes run in worker threads.
+        """
+        self.started = time.time()
+        self._stages = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time(self, stage, nbytes=0):
+        """
+        Time the enclosed block as one call of `stage`; an exception counts as an error.
+        """
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - started, nbytes, error)
+
+    def record(self, stage, seconds, nbytes=0, error=False):
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = StageStats()
+            stats.calls += 1
+            stats.errors += error
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.bytes += nbytes
+
+    def add_bytes(self, stage, nbytes):
+        """
+        Count bytes for a stage without counting a call, e.g. per streamed chunk.
+        """
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = StageStats()
+            stats.bytes += nbytes
+
+    def count(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def timed_iter(self, stage, iterable):
+        """
+        Yield from `iterable`, timing only the waits for the next item (e.g. page fetches)
+        and not the consumer's work between items. The whole iteration is one call.
+        """
+        iterator = iter(iterable)
+        seconds = 0.0
+        error = False
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - started
+                self.count(f"{stage}_items")
+                yield item
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.record(stage, seconds, error=error)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self.started, 3),
+                "stages": {name: stats.snapshot() for name, stats in sorted(self._stages.items())},
+                "counters": dict(sorted(self._counters.items())),
+            }
+
+    def describe(self):
+        """
+        One-line summary of where the time went, slowest stage first.
+        """
+        with self._lock:
+            stages = sorted(self._stages.items(), key=lambda item: -item[1].seconds)
+            parts = []
+            for name, stats in stages:
+                part = f"{name} {stats.seconds:.1f}s/{stats.calls}"
+                if stats.bytes and stats.seconds:
+                    part += f" ({stats.bytes / stats.seconds / (1024 * 1024):.1f} MB/s)"
+                parts.append(part)
+            return ", ".join(parts)
+
+
+class MetricsReporter:
+    def __init__(self, metrics, json_path=None, textfile_path=None):
+        """
+        Export metrics as a JSON report and/or a Prometheus textfile
+        (for node_exporter's textfile collector), or serve them over HTTP.
+        Other components add their own counters as named sections (see `add_section`).
+        """
+        self.metrics = metrics
+        self.json_path = json_path
+        self.textfile_path = textfile_path
+        self._sections = {}
+        self._server = None
+
+    def add_section(self, name, snapshot):
+        """
+        Include `snapshot()` (a dict of numbers) in every report under `name`.
+        """
+        self._sections[name] = snapshot
+
+    def report(self):
+        report = {"generated_at": datetime.now().isoformat(timespec="seconds")}
+        report.update(self.metrics.snapshot())
+        for name, snapshot in self._sections.items():
+            report[name] = snapshot()
+        return report
+
+    def write(self):
+        """
+        Write the configured report files. Files are replaced atomically, so a scraper
+        never reads a half-written report.
+        """
+        if not self.json_path and not self.textfile_path:
+            return
+        report = self.report()
+        if self.json_path:
+            _write_atomic(self.json_path, json.dumps(report, indent=2) + "\n")
+        if self.textfile_path:
+            _write_atomic(self.textfile_path, to_prometheus(report))
+
+    def serve(self, port, host=""):
+        """
+        Serve the metrics in Prometheus text format at /metrics (and as JSON at
+        /metrics.json) from a background thread.
+        """
+        # Imported here: http.server is slow to import and only needed with --metrics-port.
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        reporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics.json":
+                    body = json.dumps(reporter.report()).encode()
+                    content_type = "application/json"
+                elif self.path in ("/", "/metrics"):
+                    body = to_prometheus(reporter.report()).encode()
+                    content_type = PROMETHEUS_CONTENT_TYPE
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(
+            target=self._server.serve_forever, name="metrics-http", daemon=True
+        ).start()
+        return self._server.server_address[1]
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def to_prometheus(report, prefix=PROMETHEUS_PREFIX):
+    """
+    Render a report in the Prometheus text exposition format.
+    Stages become `{prefix}_stage_*{stage="..."}` series; every other numeric value becomes
+    a gauge named after its section and key, e.g. `canvas_sync_summary_uploaded`.
+    """
+    lines = []
+    stages = report.get("stages", {})
+    for field, kind, help_text in (
+        ("calls", "counter", "Completed calls of each stage."),
+        ("errors", "counter", "Calls of each stage that raised."),
+        ("seconds", "counter", "Total seconds spent in each stage."),
+        ("max_seconds", "gauge", "Slowest single call of each stage."),
+        ("bytes", "counter", "Bytes moved by each stage."),
+    ):
+        name = f"{prefix}_stage_{field}" + ("_total" if kind == "counter" else "")
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for stage, stats in stages.items():
+            lines.append(f'{name}{{stage="{stage}"}} {stats[field]}')
+
+    def gauges(path, value):
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            name = _metric_name(f"{prefix}_{'_'.join(path)}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        elif isinstance(value, dict):
+            for key, item in value.items():
+                gauges(path + [str(key)], item)
+
+    for section, value in report.items():
+        if section != "stages":
+            gauges([section], value)
+    return "\n".join(lines) + "\n"
+
+
+def _metric_name(name):
+    return "".join(c if c.isalnum() or c == "_" else "_" for c in name)
+
+
+def _write_atomic(path, text):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        # mkstemp creates the file as 0600; node_exporter and other readers need to read it.
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
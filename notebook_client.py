@@ -1,28 +1,308 @@
+import asyncio
 import logging
-from typing import Optional
+import os
+import tempfile
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
 
+# httpx is a dependency of notebooklm-py; its errors tell a dropped session apart.
+import httpx
 from notebooklm import NotebookLMClient
+from notebooklm.exceptions import (
+    NetworkError,
+    SourceNotFoundError,
+    SourceProcessingError,
+    SourceTimeoutError,
+)
+
+from metrics import Metrics
+
+T = TypeVar("T")
+
+
+# Errors that mean the HTTP session itself is gone rather than the request being rejected.
+RECONNECT_ERRORS = (httpx.TransportError, NetworkError)
+# Of those, the errors raised before a request reached the server. Anything later (a read
+# timeout, a dropped response) may have taken effect, so only idempotent calls are resent.
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+DEFAULT_AUTH_REFRESH_INTERVAL = 20 * 60
+SOURCE_WAIT_TIMEOUT = 120.0
+
+SOURCE_PROCESSING = "processing"
+SOURCE_READY = "ready"
+SOURCE_FAILED = "failed"
+SOURCE_TIMED_OUT = "timed_out"
+
+
+class SessionStats:
+    def __init__(self):
+        """
+        Counters showing how well the long-lived NotebookLM session is reused.
+        """
+        self.opens = 0
+        self.setup_seconds = 0.0
+        self.calls = 0
+        self.reconnects = 0
+        self.auth_refreshes = 0
+        self.auth_refresh_failures = 0
+
+    def snapshot(self):
+        return {
+            "opens": self.opens,
+            "setup_seconds": round(self.setup_seconds, 3),
+            "calls": self.calls,
+            "reused_calls": max(0, self.calls - self.opens),
+            "reconnects": self.reconnects,
+            "auth_refreshes": self.auth_refreshes,
+            "auth_refresh_failures": self.auth_refresh_failures,
+        }
+
+
+class SourceResult:
+    def __init__(
+        self,
+        source_id: Optional[str],
+        state: str,
+        error: Optional[Exception] = None,
+        file_path: Optional[str] = None,
+    ):
+        """
+        Outcome of uploading and processing one source.
+        :param state: SOURCE_READY, SOURCE_FAILED (upload or processing failed) or
+            SOURCE_TIMED_OUT (still processing when the wait gave up).
+        """
+        self.source_id = source_id
+        self.state = state
+        self.error = error
+        self.file_path = file_path
+
+    @property
+    def ok(self) -> bool:
+        return self.state == SOURCE_READY
+
+
+class SourceBatch:
+    def __init__(
+        self,
+        notebook_client: "NotebookLMClientWrapper",
+        notebook_id: str,
+        timeout: float = SOURCE_WAIT_TIMEOUT,
+        initial_interval: float = 1.0,
+        max_interval: float = 10.0,
+        backoff_factor: float = 1.5,
+    ):
+        """
+        Sources of one notebook that are polled together until each finishes processing.
+
+        Every poll is a single notebook listing, however many sources are pending, and
+        sources can be added between polls, so a stream of uploads shares one polling loop.
+        Each source has its own `timeout`, counted from when it was added.
+        """
+        self.notebook_client = notebook_client
+        self.notebook_id = notebook_id
+        self.timeout = timeout
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self._deadlines: dict = {}
+        self._interval = initial_interval
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def add(self, source_id: str):
+        self._deadlines[source_id] = time.monotonic() + self.timeout
+        # Poll promptly again, new sources are often small and ready quickly.
+        self._interval = self.initial_interval
+
+    async def poll(self) -> list:
+        """
+        Check every pending source once.
+        :return: A SourceResult for each source that finished (or timed out) since the last poll.
+        """
+        if not self._deadlines:
+            return []
+        try:
+            states = await self.notebook_client.get_source_states(self.notebook_id)
+        except Exception as e:
+            # Transient; pending sources are checked again on the next poll.
+            logging.warning(f"Error checking source processing status: {e}")
+            states = None
+
+        now = time.monotonic()
+        finished = []
+        for source_id, deadline in list(self._deadlines.items()):
+            state = states.get(source_id) if states is not None else SOURCE_PROCESSING
+            if state == SOURCE_READY:
+                finished.append(SourceResult(source_id, SOURCE_READY))
+            elif state == SOURCE_FAILED:
+                finished.append(
+                    SourceResult(source_id, SOURCE_FAILED, SourceProcessingError(source_id))
+                )
+            elif state is None:
+                finished.append(
+                    SourceResult(source_id, SOURCE_FAILED, SourceNotFoundError(source_id))
+                )
+            elif now >= deadline:
+                finished.append(
+                    SourceResult(
+                        source_id, SOURCE_TIMED_OUT, SourceTimeoutError(source_id, self.timeout)
+                    )
+                )
+            else:
+                continue
+            del self._deadlines[source_id]
+        return finished
+
+    async def sleep(self):
+        """
+        Wait before the next poll, backing off while nothing new is added.
+        """
+        await asyncio.sleep(self._interval)
+        self._interval = min(self._interval * self.backoff_factor, self.max_interval)
+
+    async def results(self) -> AsyncIterator[SourceResult]:
+        """
+        Poll until every pending source has finished, yielding each result as it arrives.
+        """
+        while self._deadlines:
+            for result in await self.poll():
+                yield result
+            if self._deadlines:
+                await self.sleep()
 
 
 class NotebookLMClientWrapper:  # Renamed to avoid confusion with the library class
-    def __init__(self, headless: bool = True):
+    def __init__(
+        self,
+        headless: bool = True,
+        auth_refresh_interval: float = DEFAULT_AUTH_REFRESH_INTERVAL,
+        metrics: Optional[Metrics] = None,
+        storage_path: Optional[str] = None,
+    ):
         """
         Initialize the NotebookLM Client Wrapper.
+
+        The client session is opened on first use and then kept open for every later
+        notebook creation and upload until `close()` is called. While open, auth tokens
+        are refreshed in the background every `auth_refresh_interval` seconds, and a call
+        that fails because the connection dropped is retried once on a fresh session.
+        Upload, processing-poll and session-open timings go to `metrics`.
+        `storage_path` is the login state to use (default: the library's default location),
+        so several accounts can be served from one machine.
         """
         self.headless = headless
+        self.storage_path = storage_path
+        self.auth_refresh_interval = auth_refresh_interval
         self.client: Optional[NotebookLMClient] = None
+        self.stats = SessionStats()
+        self.metrics = metrics or Metrics()
+        self._session_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        # Bumped on every (re)open, so concurrent callers that hit the same dropped
+        # session trigger only one reconnect.
+        self._generation = 0
+
+    async def __aenter__(self) -> "NotebookLMClientWrapper":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
 
     async def _get_client(self) -> NotebookLMClient:
         if not self.client:
             try:
-                # Try to load from default storage path
-                self.client = await NotebookLMClient.from_storage()
+                # Try to load from the storage path (or the library's default)
+                self.client = await NotebookLMClient.from_storage(self.storage_path)
             except Exception as e:
                 logging.error(f"Error loading NotebookLM client from storage: {e}")
                 print("Please run the login script first or ensure you have authenticated.")
                 raise e
         return self.client
 
+    async def _ensure_open(self) -> NotebookLMClient:
+        async with self._session_lock:
+            client = await self._get_client()
+            if not client.is_connected:
+                started = time.perf_counter()
+                with self.metrics.time("notebooklm_session_open"):
+                    await client.__aenter__()
+                self.stats.opens += 1
+                self._generation += 1
+                self.stats.setup_seconds += time.perf_counter() - started
+                if self.auth_refresh_interval > 0 and self._refresh_task is None:
+                    self._refresh_task = asyncio.create_task(self._refresh_auth_periodically())
+            return client
+
+    async def _call(
+        self, operation: Callable[[NotebookLMClient], Awaitable[T]], idempotent: bool = True
+    ) -> T:
+        """
+        Run `operation` on the shared open client, reconnecting once if the session dropped.
+        :param idempotent: False for calls that create something (notebooks, sources). They
+            are only sent again if the error shows the request never reached NotebookLM;
+            otherwise the error is raised after reconnecting, so a call that did succeed
+            is not repeated.
+        """
+        client = await self._ensure_open()
+        generation = self._generation
+        self.stats.calls += 1
+        try:
+            return await operation(client)
+        except RECONNECT_ERRORS as e:
+            if await self._disconnect(generation):
+                logging.warning(f"NotebookLM session dropped ({e}), reconnecting...")
+                self.stats.reconnects += 1
+            if not idempotent and not _request_not_sent(e):
+                raise
+            client = await self._ensure_open()
+            return await operation(client)
+
+    async def _refresh_auth_periodically(self):
+        while True:
+            await asyncio.sleep(self.auth_refresh_interval)
+            if not self.client or not self.client.is_connected:
+                continue
+            try:
+                await self.client.refresh_auth()
+                self.stats.auth_refreshes += 1
+            except Exception as e:
+                # Not fatal: the library also refreshes on demand when a call hits an auth error.
+                self.stats.auth_refresh_failures += 1
+                logging.warning(f"Background NotebookLM auth refresh failed: {e}")
+
+    async def _disconnect(self, generation: Optional[int] = None) -> bool:
+        """
+        Close the current session; with `generation`, only if no one has reopened it since.
+        :return: True if a session was closed.
+        """
+        async with self._session_lock:
+            if generation is not None and generation != self._generation:
+                return False
+            if self.client and self.client.is_connected:
+                await self.client.__aexit__(None, None, None)
+                return True
+            return False
+
+    async def close(self):
+        """
+        Close the long-lived session and stop the background auth refresh.
+        """
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        await self._disconnect()
+
+    def session_metrics(self) -> dict:
+        """
+        Session setup time and reuse counts, to confirm per-file overhead is gone.
+        """
+        return self.stats.snapshot()
+
     async def login(self):
         """
         Perform login to Google/NotebookLM.
@@ -42,31 +322,143 @@ class NotebookLMClientWrapper:  # Renamed to avoid confusion with the library cl
         :return: The ID of the created notebook.
         """
         logging.info(f"Creating notebook: {title}")
-        client = await self._get_client()
-        async with client:
-            notebook = await client.notebooks.create(title=title)
-            return notebook.id
+        with self.metrics.time("notebook_create"):
+            notebook = await self._call(
+                lambda client: client.notebooks.create(title=title), idempotent=False
+            )
+        return notebook.id
 
     async def upload_source(self, notebook_id: str, file_path: str):
         """
-        Upload a file to the specified notebook.
+        Upload a file to the specified notebook and wait for it to be processed.
+        """
+        source_id = await self.add_source(notebook_id, file_path)
+        if source_id:
+            await self.wait_for_source(notebook_id, source_id)
+        else:
+            logging.warning("Could not determine source ID to wait for processing.")
+
+    async def add_source(self, notebook_id: str, file_path: str) -> Optional[str]:
+        """
+        Upload a file to the specified notebook without waiting for processing.
+        :return: The ID of the new source, if the API returned one.
         """
         logging.info(f"Uploading {file_path} to notebook {notebook_id}...")
-        client = await self._get_client()
-        async with client:
-            # add_file returns the Source object or ID?
-            # Looking at library code (via inspection earlier): SourceAPI.add_file returns 'Source' object usually.
-            # verify call: await client.sources.add_file(notebook_id, file_path)
-            source = await client.sources.add_file(notebook_id, file_path)
+        # SourceAPI.add_file returns a Source object; we only need its ID.
+        with self.metrics.time("upload", nbytes=_file_size(file_path)):
+            source = await self._call(
+                lambda client: client.sources.add_file(notebook_id, file_path), idempotent=False
+            )
+        return getattr(source, "id", None)
 
-            # If add_file returns a Source object, we can get its ID.
-            source_id = getattr(source, "id", None)
+    async def add_source_bytes(
+        self, notebook_id: str, file_name: str, data: bytes, temp_dir: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        Upload in-memory file content to the specified notebook.
+        The library only uploads from a path, so the content is written to a short-lived
+        file named `file_name` (the source title) for the upload.
+        :param temp_dir: Where that file goes; the system temp directory by default.
+        :return: The ID of the new source, if the API returned one.
+        """
+        logging.info(f"Uploading {file_name} ({len(data)} bytes) to notebook {notebook_id}...")
+        with self.metrics.time("upload", nbytes=len(data)):
+            with tempfile.TemporaryDirectory(prefix="upload-", dir=temp_dir) as upload_dir:
+                path = os.path.join(upload_dir, file_name)
+                await asyncio.to_thread(_write_file, path, data)
+                source = await self._call(
+                    lambda client: client.sources.add_file(notebook_id, path), idempotent=False
+                )
+        return getattr(source, "id", None)
 
+    async def upload_sources(self, notebook_id: str, file_paths: list) -> list:
+        """
+        Upload several files to the specified notebook, then wait for all of them together.
+        :return: A SourceResult per file, in the order of `file_paths`.
+        """
+        results = []
+        batch = SourceBatch(self, notebook_id)
+        for file_path in file_paths:
+            try:
+                source_id = await self.add_source(notebook_id, file_path)
+            except Exception as e:
+                results.append(SourceResult(None, SOURCE_FAILED, e, file_path))
+                continue
             if source_id:
-                # Wait for processing
-                try:
-                    await client.sources.wait_for_sources(notebook_id, source_ids=[source_id])
-                except Exception as e:
-                    logging.warning(f"Error waiting for source processing: {e}")
+                batch.add(source_id)
+                results.append(SourceResult(source_id, SOURCE_PROCESSING, file_path=file_path))
             else:
                 logging.warning("Could not determine source ID to wait for processing.")
+                results.append(SourceResult(None, SOURCE_READY, file_path=file_path))
+
+        by_source_id: dict = {result.source_id: result for result in results if result.source_id}
+        async for finished in batch.results():
+            result = by_source_id[finished.source_id]
+            result.state = finished.state
+            result.error = finished.error
+        return results
+
+    async def wait_for_sources(
+        self, notebook_id: str, source_ids: list, timeout: float = SOURCE_WAIT_TIMEOUT
+    ) -> list:
+        """
+        Wait until NotebookLM has finished processing several sources, polling them together.
+        :return: A SourceResult per source, in the order of `source_ids`.
+        """
+        batch = SourceBatch(self, notebook_id, timeout=timeout)
+        for source_id in source_ids:
+            batch.add(source_id)
+        results = {result.source_id: result async for result in batch.results()}
+        return [results[source_id] for source_id in source_ids]
+
+    async def wait_for_source(self, notebook_id: str, source_id: str):
+        """
+        Wait until NotebookLM has finished processing an uploaded source.
+        Processing errors are logged rather than raised, the upload itself already succeeded.
+        """
+        (result,) = await self.wait_for_sources(notebook_id, [source_id])
+        if not result.ok:
+            logging.warning(f"Error waiting for source processing: {result.error}")
+
+    async def get_source_states(self, notebook_id: str) -> dict:
+        """
+        Fetch the processing state of every source in a notebook with one listing.
+        :return: A dict: source_id -> SOURCE_PROCESSING, SOURCE_READY or SOURCE_FAILED
+        """
+        with self.metrics.time("source_poll"):
+            sources = await self._call(lambda client: client.sources.list(notebook_id))
+        states = {}
+        for source in sources:
+            if source.is_ready:
+                states[source.id] = SOURCE_READY
+            elif source.is_error:
+                states[source.id] = SOURCE_FAILED
+            else:
+                states[source.id] = SOURCE_PROCESSING
+        return states
+
+    async def delete_source(self, notebook_id: str, source_id: str):
+        """
+        Remove a source from the specified notebook.
+        """
+        logging.info(f"Deleting source {source_id} from notebook {notebook_id}...")
+        with self.metrics.time("source_delete"):
+            await self._call(lambda client: client.sources.delete(notebook_id, source_id))
+
+
+def _request_not_sent(error: BaseException) -> bool:
+    # The library wraps httpx errors of its RPC calls.
+    cause = error.original_error if isinstance(error, NetworkError) else error
+    return isinstance(cause, NOT_SENT_ERRORS)
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _write_file(path: str, data: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
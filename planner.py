@@ -0,0 +1,172 @@
+MB = 1024 * 1024
+
+# "newest" is Canvas's listing order, so uploads can start while the listing is still
+# loading; "smallest" waits for the whole listing of a course and sorts it.
+UPLOAD_ORDERS = ("newest", "smallest")
+DEFAULT_UPLOAD_ORDER = "newest"
+# NotebookLM's source limit per notebook on the free plan; paid plans allow more.
+DEFAULT_MAX_SOURCES_PER_NOTEBOOK = 50
+# Rough rates behind `--plan` estimates, per download/upload slot.
+ESTIMATED_BYTES_PER_SECOND = 5 * MB
+ESTIMATED_SECONDS_PER_FILE = 4.0
+
+
+def order_jobs(jobs, order=DEFAULT_UPLOAD_ORDER):
+    """
+    Put planned jobs in upload order.
+    "newest" keeps the listing order (Canvas lists newest first). "smallest" uploads small
+    files first and, among files of the same size, newer ones first, so most of a course
+    is usable in NotebookLM early and a large file cannot hold up the rest.
+    """
+    if order not in UPLOAD_ORDERS:
+        raise ValueError(f"Unknown upload order: {order}")
+    if order == "newest":
+        return list(jobs)
+    # Both sorts are stable: sort by recency first, then by size.
+    by_recency = sorted(jobs, key=lambda job: job.updated_at or "", reverse=True)
+    return sorted(by_recency, key=lambda job: job.size)
+
+
+def shard_title(course_name, shard_index):
+    """
+    Title of an extra notebook of a course; shard 0 is the course's own notebook.
+    """
+    return f"{course_name} (part {shard_index + 1})"
+
+
+class NotebookShards:
+    def __init__(
+        self, notebook_ids, source_counts=None, max_sources=DEFAULT_MAX_SOURCES_PER_NOTEBOOK
+    ):
+        """
+        The notebooks of one course, in shard order, and how many sources each holds.
+        A course with more files than fit into one notebook is spread over several, each
+        filled up before the next is used. `max_sources` of 0 means no limit.
+        """
+        self.notebook_ids = list(notebook_ids)
+        self.max_sources = max_sources
+        counts = source_counts or {}
+        self.sources = {
+            notebook_id: counts.get(notebook_id, 0) for notebook_id in self.notebook_ids
+        }
+
+    def __len__(self):
+        return len(self.notebook_ids)
+
+    def has_room(self, notebook_id):
+        return not self.max_sources or self.sources[notebook_id] < self.max_sources
+
+    def reserve(self, preferred=None):
+        """
+        Take a source slot, in `preferred` if that notebook has room, otherwise in the
+        first one that has.
+        Returns the notebook ID, or None if every notebook is full and a shard must be added.
+        """
+        candidates = self.notebook_ids
+        if preferred in self.sources:
+            candidates = [preferred, *candidates]
+        for notebook_id in candidates:
+            if self.has_room(notebook_id):
+                self.take(notebook_id)
+                return notebook_id
+        return None
+
+    def take(self, notebook_id):
+        """
+        Count a source that is already in a notebook, whether or not it has room.
+        """
+        self.sources[notebook_id] = self.sources.get(notebook_id, 0) + 1
+
+    def release(self, notebook_id):
+        """
+        Give back the slot of a source that failed or was removed.
+        """
+        if self.sources.get(notebook_id, 0) > 0:
+            self.sources[notebook_id] -= 1
+
+    def add(self, notebook_id):
+        self.notebook_ids.append(notebook_id)
+        self.sources[notebook_id] = 0
+
+
+def estimate_seconds(files, nbytes, transfers=1, uploads=1):
+    """
+    Rough duration of syncing `files` files of `nbytes` bytes in total, with `transfers`
+    downloads/uploads moving bytes at the same time and `uploads` NotebookLM calls in flight.
+    """
+    transfer_seconds = nbytes / ESTIMATED_BYTES_PER_SECOND / max(1, transfers)
+    return transfer_seconds + files * ESTIMATED_SECONDS_PER_FILE / max(1, uploads)
+
+
+def plan_course(target, jobs, files, shards, order=DEFAULT_UPLOAD_ORDER, transfers=1, uploads=1):
+    """
+    Plan the uploads of one course without changing anything: put the jobs in upload
+    order and assign each to a notebook the way a sync would, adding shards as notebooks
+    fill up.
+    :param files: Counts of the course's listed files by outcome (new, changed, ...).
+    :param shards: The course's NotebookShards; used up by the simulation.
+    Returns a JSON-serializable dict.
+    """
+    notebooks = [
+        {"notebook_id": notebook_id, "sources": shards.sources[notebook_id]}
+        for notebook_id in shards.notebook_ids
+    ]
+    new_notebooks = 0
+    uploads_planned = []
+    for job in order_jobs(jobs, order):
+        notebook_id = shards.reserve(job.replaces_notebook_id)
+        if notebook_id is None:
+            notebook_id = f"new notebook {new_notebooks + 1}"
+            new_notebooks += 1
+            shards.add(notebook_id)
+            shards.take(notebook_id)
+        if job.replaces_source_id:
+            # The old version's source is removed once the new one is processed.
+            shards.release(job.replaces_notebook_id)
+        uploads_planned.append(
+            {
+                "file_id": job.file_id,
+                "file_name": job.file_name,
+                "size": job.size,
+                "updated_at": job.updated_at,
+                "notebook": notebook_id,
+            }
+        )
+    upload_bytes = sum(job.size for job in jobs)
+    return {
+        "course_id": target.course_id,
+        "course_name": target.course_name,
+        "notebooks": notebooks,
+        "new_notebooks": new_notebooks,
+        "files": files,
+        "upload_files": len(jobs),
+        "upload_bytes": upload_bytes,
+        "estimated_seconds": round(estimate_seconds(len(jobs), upload_bytes, transfers, uploads)),
+        "uploads": uploads_planned,
+    }
+
+
+def plan_report(course_plans, order, max_sources, transfers=1, uploads=1):
+    """
+    Combine the plans of several courses (see plan_course) into the `--plan` report.
+    Courses share the download and upload slots, so the total is estimated from the
+    combined bytes and files rather than summed per course.
+    """
+    files = sum(plan["upload_files"] for plan in course_plans)
+    nbytes = sum(plan["upload_bytes"] for plan in course_plans)
+    return {
+        "upload_order": order,
+        "max_sources_per_notebook": max_sources,
+        "estimate_assumptions": {
+            "bytes_per_second": ESTIMATED_BYTES_PER_SECOND,
+            "seconds_per_file": ESTIMATED_SECONDS_PER_FILE,
+            "transfers": transfers,
+            "uploads": uploads,
+        },
+        "courses": len(course_plans),
+        "upload_files": files,
+        "upload_bytes": nbytes,
+        "new_notebooks": sum(plan["new_notebooks"] for plan in course_plans),
+        "estimated_seconds": round(estimate_seconds(files, nbytes, transfers, uploads)),
+        "course_plans": list(course_plans),
+    }
@@ -0,0 +1,153 @@
+import threading
+import time
+
+import requests
+
+RATE_LIMIT_REMAINING_HEADER = "X-Rate-Limit-Remaining"
+REQUEST_COST_HEADER = "X-Request-Cost"
+
+
+class AdaptiveConcurrencyLimiter:
+    def __init__(
+        self,
+        initial_limit=4,
+        min_limit=1,
+        max_limit=16,
+        low_water=100.0,
+        high_water=300.0,
+        cooldown=1.0,
+    ):
+        """
+        AIMD limit on in-flight Canvas requests, driven by Canvas rate-limit headers.
+
+        Canvas throttles each token with a leaky bucket and reports what is left in
+        `X-Rate-Limit-Remaining`. While the bucket stays above `high_water` the limit grows
+        by about one request per round trip; when it drops below `low_water`, or Canvas
+        answers 403 "Rate Limit Exceeded", the limit is halved (at most once per `cooldown`
+        seconds, so one burst of low readings does not collapse it to the minimum).
+        Thread-safe, since Canvas calls run in worker threads.
+        """
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.low_water = low_water
+        self.high_water = high_water
+        self.cooldown = cooldown
+
+        self.limit = float(min(max(initial_limit, min_limit), self.max_limit))
+        self.in_flight = 0
+        self.remaining = None
+        self.last_cost = None
+        self.total_cost = 0.0
+        self.requests = 0
+        self.throttled = 0
+        self.increases = 0
+        self.decreases = 0
+
+        self._condition = threading.Condition()
+        self._last_decrease = 0.0
+
+    def acquire(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def observe(self, response):
+        """
+        Feed a Canvas response into the controller.
+        :return: True if Canvas rejected the request for exceeding the rate limit.
+        """
+        remaining = _header_float(response.headers, RATE_LIMIT_REMAINING_HEADER)
+        cost = _header_float(response.headers, REQUEST_COST_HEADER)
+        throttled = response.status_code == 403 and (
+            "Rate Limit Exceeded" in response.text or (remaining is not None and remaining <= 0)
+        )
+
+        with self._condition:
+            self.requests += 1
+            if cost is not None:
+                self.last_cost = cost
+                self.total_cost += cost
+            if remaining is not None:
+                self.remaining = remaining
+
+            if throttled:
+                self.throttled += 1
+                self._decrease()
+            elif remaining is not None and remaining < self.low_water:
+                self._decrease()
+            elif remaining is not None and remaining > self.high_water:
+                self._increase()
+            self._condition.notify_all()
+        return throttled
+
+    def _increase(self):
+        if self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.increases += 1
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit / 2)
+        self.decreases += 1
+
+    def snapshot(self):
+        """
+        Current controller state, for logging and metrics.
+        """
+        with self._condition:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "rate_limit_remaining": self.remaining,
+                "last_request_cost": self.last_cost,
+                "total_request_cost": round(self.total_cost, 3),
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "increases": self.increases,
+                "decreases": self.decreases,
+            }
+
+
+class RateLimitedSession(requests.Session):
+    def __init__(self, limiter, max_throttle_retries=5, throttle_backoff=2.0):
+        """
+        A requests session whose requests are admitted by an AdaptiveConcurrencyLimiter.
+        Requests rejected with 403 "Rate Limit Exceeded" are retried after a backoff.
+        """
+        super().__init__()
+        self.limiter = limiter
+        self.max_throttle_retries = max_throttle_retries
+        self.throttle_backoff = throttle_backoff
+
+    def request(self, method, url, *args, **kwargs):
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            finally:
+                self.limiter.release()
+
+            if not self.limiter.observe(response) or attempt >= self.max_throttle_retries:
+                return response
+            response.close()
+            time.sleep(self.throttle_backoff * (2**attempt))
+            attempt += 1
+
+
+def _header_float(headers, name):
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
@@ -1,136 +1,954 @@
+import json
 import sqlite3
+import threading
+import time
 from datetime import datetime
 
+from metrics import Metrics
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_MAX_PENDING_WRITES = 500
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_BACKOFF = 5 * 60
+MAX_RETRY_BACKOFF = 24 * 60 * 60
+
+# States of a file in the work queue (`file_jobs.status`).
+JOB_PENDING = "pending"
+JOB_DOWNLOADING = "downloading"
+JOB_UPLOADING = "uploading"
+JOB_FAILED = "failed"
+JOB_UPLOADED = "uploaded"
+
+FILE_JOB_COLUMNS = (
+    "file_id, file_name, download_url, size, canvas_updated_at, content_type, "
+    "replaces_source_id, replaces_notebook_id, source_id, notebook_id, content_hash, bundle_id"
+)
+
 
 class StateManager:
-    def __init__(self, db_path="state.db"):
+    def __init__(
+        self,
+        db_path="state.db",
+        flush_interval=DEFAULT_FLUSH_INTERVAL,
+        max_pending_writes=DEFAULT_MAX_PENDING_WRITES,
+        metrics=None,
+    ):
         """
         Initialize the State Manager with a SQLite database.
+
+        The connection stays open for the lifetime of the manager and runs in WAL mode.
+        Per-file writes are grouped into one transaction that is committed every
+        `flush_interval` seconds (or after `max_pending_writes` writes); a flush interval
+        of 0 commits every write immediately. All methods are safe to call from several
+        threads or asyncio tasks. Call `close()` (or use the manager as a context manager)
+        to commit outstanding writes.
+        Statement and commit timings (including waits for the connection lock) go to `metrics`.
         """
         self.db_path = db_path
+        self.metrics = metrics or Metrics()
+        self.flush_interval = flush_interval
+        self.max_pending_writes = max_pending_writes
+
+        self._lock = threading.RLock()
+        self._pending_writes = 0
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL makes NORMAL durable against application crashes; only an OS crash can
+        # lose the last committed transactions.
+        self._conn.execute("PRAGMA synchronous=NORMAL")
         self._init_db()
 
+        self._stop_flusher = threading.Event()
+        self._flusher = None
+        if flush_interval > 0:
+            self._flusher = threading.Thread(
+                target=self._flush_periodically, name="state-flusher", daemon=True
+            )
+            self._flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def _init_db(self):
         """
         Initialize the database schema.
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._lock:
+            cursor = self._conn.cursor()
+
+            # Courses table
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS courses (
+                    course_id TEXT PRIMARY KEY,
+                    course_name TEXT,
+                    notebook_lm_id TEXT,
+                    last_synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
 
-        # Courses table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS courses (
-                course_id TEXT PRIMARY KEY,
-                course_name TEXT,
-                notebook_lm_id TEXT,
-                last_synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            # Files table
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    file_id TEXT PRIMARY KEY,
+                    course_id TEXT,
+                    file_name TEXT,
+                    upload_status TEXT DEFAULT 'pending',
+                    last_updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY(course_id) REFERENCES courses(course_id)
+                )
+            """)
+            # Durable work queue: one row per file version that needs syncing
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS file_jobs (
+                    file_id TEXT PRIMARY KEY,
+                    course_id TEXT,
+                    file_name TEXT,
+                    download_url TEXT,
+                    size INTEGER,
+                    canvas_updated_at TEXT,
+                    content_type TEXT,
+                    replaces_source_id TEXT,
+                    source_id TEXT,
+                    content_hash TEXT,
+                    status TEXT DEFAULT 'pending',
+                    attempts INTEGER DEFAULT 0,
+                    next_attempt_at REAL,
+                    last_error TEXT,
+                    updated_at TIMESTAMP
+                )
+            """)
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_file_jobs_course ON file_jobs(course_id, status)"
             )
-        """)
 
-        # Files table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS files (
-                file_id TEXT PRIMARY KEY,
-                course_id TEXT,
-                file_name TEXT,
-                upload_status TEXT DEFAULT 'pending',
-                last_updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(course_id) REFERENCES courses(course_id)
+            # Resume points of interrupted downloads
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS partial_downloads (
+                    file_id TEXT PRIMARY KEY,
+                    course_id TEXT,
+                    path TEXT,
+                    bytes_received INTEGER DEFAULT 0,
+                    etag TEXT,
+                    last_modified TEXT,
+                    updated_at TIMESTAMP
+                )
+            """)
+            self._add_missing_columns(
+                "courses",
+                {
+                    "files_high_water_mark": "TEXT",
+                    # FileFilter.signature() of the run that saved the mark; marks from
+                    # before it was recorded match no rules and are relisted once.
+                    "files_high_water_filter": "TEXT",
+                    "canvas_metadata": "TEXT",
+                    "canvas_metadata_cached_at": "REAL",
+                    # Extra notebooks of a course over the per-notebook source limit are
+                    # rows of their own, pointing at the course they belong to.
+                    "shard_of": "TEXT",
+                    "shard_index": "INTEGER",
+                },
+            )
+            self._add_missing_columns(
+                "file_jobs",
+                {"replaces_notebook_id": "TEXT", "notebook_id": "TEXT", "bundle_id": "TEXT"},
             )
-        """)
 
-        conn.commit()
-        conn.close()
+            # Combined sources of small text files (see bundler.py)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS bundles (
+                    bundle_id TEXT PRIMARY KEY,
+                    course_id TEXT,
+                    folder_id TEXT,
+                    bundle_index INTEGER,
+                    title TEXT,
+                    source_id TEXT,
+                    notebook_id TEXT,
+                    content_hash TEXT,
+                    updated_at TIMESTAMP
+                )
+            """)
+            # Which bundle each file is in, with the text it contributed so a bundle
+            # can be rebuilt when one member changes without downloading the others
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS bundle_members (
+                    file_id TEXT PRIMARY KEY,
+                    bundle_id TEXT,
+                    course_id TEXT,
+                    file_name TEXT,
+                    canvas_updated_at TEXT,
+                    content BLOB
+                )
+            """)
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_bundle_members_bundle ON bundle_members(bundle_id)"
+            )
+            # Text extracted from documents (see extractor.py), by content hash; a NULL
+            # text means the original is uploaded because extraction did not pay off
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS extracted_texts (
+                    content_hash TEXT PRIMARY KEY,
+                    original_size INTEGER,
+                    text BLOB,
+                    created_at TIMESTAMP
+                )
+            """)
+            self._add_missing_columns(
+                "files",
+                {
+                    "canvas_updated_at": "TEXT",
+                    "size": "INTEGER",
+                    "content_type": "TEXT",
+                    "source_id": "TEXT",
+                    "notebook_id": "TEXT",
+                    "content_hash": "TEXT",
+                },
+            )
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_files_course ON files(course_id)")
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_files_content_hash ON files(content_hash, notebook_id)"
+            )
+            # is_source_shared runs before every source deletion
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_files_source ON files(source_id)")
+
+            self._conn.commit()
+
+    def _add_missing_columns(self, table, columns):
+        """
+        Add columns introduced after a database was first created.
+        """
+        existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+        for name, column_type in columns.items():
+            if name not in existing:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+    def _flush_periodically(self):
+        while not self._stop_flusher.wait(self.flush_interval):
+            self.flush()
+
+    def _write(self, sql, params=(), batched=True):
+        """
+        Execute a write statement.
+        Batched writes join the open transaction; others commit it right away.
+        :return: The number of rows changed.
+        """
+        with self.metrics.time("state_db_write"), self._lock:
+            changed = self._conn.execute(sql, params).rowcount
+            self._pending_writes += 1
+            if (
+                not batched
+                or self.flush_interval <= 0
+                or self._pending_writes >= self.max_pending_writes
+            ):
+                self.flush()
+            return changed
+
+    def _query(self, sql, params=()):
+        # Reads use the same connection, so they also see writes that are not committed yet.
+        with self.metrics.time("state_db_read"), self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def flush(self):
+        """
+        Commit all pending writes.
+        """
+        with self._lock:
+            if self._pending_writes:
+                with self.metrics.time("state_db_commit"):
+                    self._conn.commit()
+                self._pending_writes = 0
+
+    def close(self):
+        """
+        Commit pending writes, fold the WAL back into the database file and close the
+        connection, so the database file alone holds the state afterwards.
+        """
+        self._stop_flusher.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        with self._lock:
+            if self._conn is None:
+                return
+            self.flush()
+            try:
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.OperationalError:
+                # Another connection holds the database; the last one to close checkpoints.
+                pass
+            self._conn.close()
+            self._conn = None
 
     def get_course_notebook_id(self, course_id):
         """
         Retrieve the NotebookLM ID for a given course.
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT notebook_lm_id FROM courses WHERE course_id = ?", (course_id,))
-        result = cursor.fetchone()
-        conn.close()
-        return result[0] if result else None
+        rows = self._query("SELECT notebook_lm_id FROM courses WHERE course_id = ?", (course_id,))
+        return rows[0][0] if rows else None
 
     def set_course_notebook_id(self, course_id, notebook_id, course_name=None):
         """
         Save or update the NotebookLM ID for a course.
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
+        self._write(
             """
             INSERT INTO courses (course_id, notebook_lm_id, course_name, last_synced_at)
             VALUES (?, ?, ?, ?)
-            ON CONFLICT(course_id) DO UPDATE SET 
+            ON CONFLICT(course_id) DO UPDATE SET
                 notebook_lm_id=excluded.notebook_lm_id,
                 course_name=coalesce(excluded.course_name, courses.course_name),
                 last_synced_at=excluded.last_synced_at
         """,
             (course_id, notebook_id, course_name, datetime.now().isoformat(timespec="seconds")),
+            batched=False,
         )
-        conn.commit()
-        conn.close()
 
     def get_all_managed_courses(self):
         """
-        Retrieve all courses currently managed in the database.
+        Retrieve all courses currently managed in the database (not their extra shards).
         Returns a list of tuples: (course_id, course_name, notebook_lm_id)
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT course_id, course_name, notebook_lm_id FROM courses")
-        results = cursor.fetchall()
-        conn.close()
-        return results
+        return self._query(
+            "SELECT course_id, course_name, notebook_lm_id FROM courses WHERE shard_of IS NULL"
+        )
+
+    def get_course_shards(self, course_id):
+        """
+        Retrieve the extra notebooks of a course that outgrew one notebook.
+        Returns a list of tuples (shard_index, notebook_lm_id), in shard order.
+        """
+        return self._query(
+            """
+            SELECT shard_index, notebook_lm_id FROM courses
+            WHERE shard_of = ? ORDER BY shard_index
+        """,
+            (course_id,),
+        )
+
+    def add_course_shard(self, course_id, shard_index, notebook_id, course_name=None):
+        """
+        Record an extra notebook of a course; shard 0 is the course's own notebook.
+        """
+        self._write(
+            """
+            INSERT OR REPLACE INTO courses (
+                course_id, course_name, notebook_lm_id, last_synced_at, shard_of, shard_index
+            )
+            VALUES (?, ?, ?, ?, ?, ?)
+        """,
+            (
+                f"{course_id}#{shard_index}",
+                course_name,
+                notebook_id,
+                _now(),
+                course_id,
+                shard_index,
+            ),
+            batched=False,
+        )
+
+    def count_notebook_sources(self, course_id, notebook_id):
+        """
+        Count the NotebookLM sources this tool has added to each notebook of a course.
+        Files deduplicated onto one source count once; rows from before notebooks were
+        recorded count towards the course's own notebook `notebook_id`.
+        Returns a dict: notebook_id -> number of sources
+        """
+        rows = self._query(
+            """
+            SELECT coalesce(notebook_id, ?) AS notebook, COUNT(DISTINCT coalesce(source_id, file_id))
+            FROM files
+            WHERE course_id = ? AND upload_status = 'uploaded'
+            GROUP BY notebook
+        """,
+            (notebook_id, course_id),
+        )
+        return dict(rows)
 
     def delete_course(self, course_id):
         """
         Remove a course and its associated files from the database.
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        try:
-            # Delete associated files first (foreign key constraint usually handles this but good to be explicit/safe)
-            cursor.execute("DELETE FROM files WHERE course_id = ?", (course_id,))
-            cursor.execute("DELETE FROM courses WHERE course_id = ?", (course_id,))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Error deleting course {course_id}: {e}")
-            return False
-        finally:
-            conn.close()
+        with self._lock:
+            # Commit batched writes first so a failed delete cannot roll them back.
+            self.flush()
+            try:
+                # Delete associated files first (foreign key constraint usually handles this but good to be explicit/safe)
+                self._conn.execute("DELETE FROM files WHERE course_id = ?", (course_id,))
+                self._conn.execute(
+                    "DELETE FROM partial_downloads WHERE course_id = ?", (course_id,)
+                )
+                self._conn.execute("DELETE FROM file_jobs WHERE course_id = ?", (course_id,))
+                self._conn.execute("DELETE FROM bundles WHERE course_id = ?", (course_id,))
+                self._conn.execute("DELETE FROM bundle_members WHERE course_id = ?", (course_id,))
+                self._conn.execute(
+                    "DELETE FROM courses WHERE course_id = ? OR shard_of = ?",
+                    (course_id, course_id),
+                )
+                self._conn.commit()
+                return True
+            except Exception as e:
+                self._conn.rollback()
+                print(f"Error deleting course {course_id}: {e}")
+                return False
 
     def is_file_processed(self, file_id):
         """
         Check if a file has already been successfully uploaded.
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
+        rows = self._query(
             "SELECT 1 FROM files WHERE file_id = ? AND upload_status = 'uploaded'", (file_id,)
         )
-        result = cursor.fetchone()
-        conn.close()
-        return result is not None
+        return bool(rows)
+
+    def get_processed_file_versions(self, course_id):
+        """
+        Load the stored Canvas metadata of every uploaded file of a course in a single query.
+        Returns a dict: file_id -> (canvas_updated_at, size, source_id, notebook_id)
+        """
+        rows = self._query(
+            """
+            SELECT file_id, canvas_updated_at, size, source_id, notebook_id FROM files
+            WHERE course_id = ? AND upload_status = 'uploaded'
+        """,
+            (course_id,),
+        )
+        return {row[0]: tuple(row[1:]) for row in rows}
 
-    def mark_file_processed(self, file_id, course_id, file_name):
+    def mark_file_processed(
+        self,
+        file_id,
+        course_id,
+        file_name,
+        updated_at=None,
+        size=None,
+        content_type=None,
+        source_id=None,
+        notebook_id=None,
+        content_hash=None,
+    ):
         """
-        Mark a file as uploaded.
+        Mark a file as uploaded, recording the Canvas version that was uploaded.
+        The write is committed with the next batch (see `flush_interval`).
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
+        self._write(
             """
-            INSERT INTO files (file_id, course_id, file_name, upload_status, last_updated_at)
-            VALUES (?, ?, ?, 'uploaded', ?)
-            ON CONFLICT(file_id) DO UPDATE SET 
+            INSERT INTO files (
+                file_id, course_id, file_name, upload_status, last_updated_at,
+                canvas_updated_at, size, content_type, source_id, notebook_id, content_hash
+            )
+            VALUES (?, ?, ?, 'uploaded', ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(file_id) DO UPDATE SET
+                file_name=excluded.file_name,
                 upload_status='uploaded',
-                last_updated_at=excluded.last_updated_at
+                last_updated_at=excluded.last_updated_at,
+                canvas_updated_at=excluded.canvas_updated_at,
+                size=excluded.size,
+                content_type=excluded.content_type,
+                source_id=excluded.source_id,
+                notebook_id=excluded.notebook_id,
+                content_hash=excluded.content_hash
+        """,
+            (
+                file_id,
+                course_id,
+                file_name,
+                datetime.now().isoformat(timespec="seconds"),
+                updated_at,
+                size,
+                content_type,
+                source_id,
+                notebook_id,
+                content_hash,
+            ),
+        )
+
+    def find_source_by_content_hash(self, notebook_id, content_hash):
+        """
+        Find a NotebookLM source in a notebook that already holds content with this SHA-256.
+        Returns the source ID, or None.
+        """
+        rows = self._query(
+            """
+            SELECT source_id FROM files
+            WHERE content_hash = ? AND notebook_id = ? AND upload_status = 'uploaded'
+                AND source_id IS NOT NULL
+            LIMIT 1
+        """,
+            (content_hash, notebook_id),
+        )
+        return rows[0][0] if rows else None
+
+    def is_source_shared(self, source_id, file_id=None):
+        """
+        Check if any file (other than `file_id`) still relies on a NotebookLM source.
+        """
+        sql = "SELECT 1 FROM files WHERE source_id = ?"
+        params: tuple = (source_id,)
+        if file_id is not None:
+            sql += " AND file_id != ?"
+            params += (file_id,)
+        return bool(self._query(sql + " LIMIT 1", params))
+
+    def get_course_high_water_mark(self, course_id, filter_signature=None):
+        """
+        Retrieve the newest Canvas `updated_at` of a course that was fully synced.
+        :param filter_signature: If given, a mark saved under other file rules is ignored.
+        """
+        rows = self._query(
+            "SELECT files_high_water_mark, files_high_water_filter FROM courses WHERE course_id = ?",
+            (course_id,),
+        )
+        if not rows:
+            return None
+        mark, saved_signature = rows[0]
+        if filter_signature is not None and saved_signature != filter_signature:
+            return None
+        return mark
+
+    def set_course_high_water_mark(self, course_id, updated_at, filter_signature=None):
+        """
+        Save the newest Canvas `updated_at` seen in a course whose files all synced,
+        with the signature of the file rules the listing was checked against.
+        """
+        self._write(
+            """
+            UPDATE courses SET files_high_water_mark = ?, files_high_water_filter = ?
+            WHERE course_id = ?
         """,
-            (file_id, course_id, file_name, datetime.now().isoformat(timespec="seconds")),
+            (updated_at, filter_signature, course_id),
+            batched=False,
+        )
+
+    def get_cached_course_metadata(self, course_id, max_age):
+        """
+        Retrieve the cached Canvas metadata of a course if it is younger than `max_age` seconds.
+        Returns a dict, or None if nothing is cached or the entry is stale.
+        """
+        rows = self._query(
+            "SELECT canvas_metadata, canvas_metadata_cached_at FROM courses WHERE course_id = ?",
+            (course_id,),
         )
-        conn.commit()
-        conn.close()
+        if not rows or rows[0][0] is None or rows[0][1] is None:
+            return None
+        metadata, cached_at = rows[0]
+        if time.time() - cached_at > max_age:
+            return None
+        return json.loads(metadata)
+
+    def set_cached_course_metadata(self, course_id, metadata):
+        """
+        Cache the Canvas metadata of a managed course.
+        """
+        self._write(
+            """
+            UPDATE courses SET canvas_metadata = ?, canvas_metadata_cached_at = ?
+            WHERE course_id = ?
+        """,
+            (json.dumps(metadata), time.time(), course_id),
+        )
+
+    def get_partial_download(self, file_id):
+        """
+        Retrieve the resume point of an interrupted download.
+        Returns a tuple (path, bytes_received, etag, last_modified), or None.
+        """
+        rows = self._query(
+            """
+            SELECT path, bytes_received, etag, last_modified FROM partial_downloads
+            WHERE file_id = ?
+        """,
+            (file_id,),
+        )
+        return rows[0] if rows else None
+
+    def save_partial_download(
+        self, file_id, course_id, path, bytes_received, etag=None, last_modified=None
+    ):
+        """
+        Record how far a download got and which ETag/Last-Modified its bytes belong to.
+        The write is committed with the next batch (see `flush_interval`).
+        """
+        self._write(
+            """
+            INSERT INTO partial_downloads (
+                file_id, course_id, path, bytes_received, etag, last_modified, updated_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(file_id) DO UPDATE SET
+                course_id=excluded.course_id,
+                path=excluded.path,
+                bytes_received=excluded.bytes_received,
+                etag=excluded.etag,
+                last_modified=excluded.last_modified,
+                updated_at=excluded.updated_at
+        """,
+            (
+                file_id,
+                course_id,
+                path,
+                bytes_received,
+                etag,
+                last_modified,
+                datetime.now().isoformat(timespec="seconds"),
+            ),
+        )
+
+    def delete_partial_download(self, file_id):
+        """
+        Forget the resume point of a download that completed or was abandoned.
+        """
+        self._write("DELETE FROM partial_downloads WHERE file_id = ?", (file_id,))
+
+    def queue_file_job(
+        self,
+        file_id,
+        course_id,
+        file_name,
+        download_url,
+        size=None,
+        updated_at=None,
+        content_type=None,
+        replaces_source_id=None,
+        replaces_notebook_id=None,
+        bundle_id=None,
+    ):
+        """
+        Add a file version to the work queue and claim it for this run if it is due.
+        A new Canvas version replaces any earlier job of the file and starts with a fresh
+        attempt count; the same version keeps its attempts and retry time.
+        Returns True if the job was claimed (moved to 'downloading').
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._query(
+                "SELECT status, canvas_updated_at, size FROM file_jobs WHERE file_id = ?",
+                (file_id,),
+            )
+            if rows and rows[0][0] != JOB_UPLOADED and rows[0][1:] == (updated_at, size):
+                return self._claim_file_job(file_id, now)
+            self._write(
+                """
+                INSERT OR REPLACE INTO file_jobs (
+                    file_id, course_id, file_name, download_url, size, canvas_updated_at,
+                    content_type, replaces_source_id, replaces_notebook_id, bundle_id, status,
+                    attempts, updated_at
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?)
+            """,
+                (
+                    file_id,
+                    course_id,
+                    file_name,
+                    download_url,
+                    size,
+                    updated_at,
+                    content_type,
+                    replaces_source_id,
+                    replaces_notebook_id,
+                    bundle_id,
+                    JOB_DOWNLOADING,
+                    _now(),
+                ),
+            )
+            return True
+
+    def _claim_file_job(self, file_id, now):
+        changed = self._write(
+            """
+            UPDATE file_jobs SET status = ?, updated_at = ?
+            WHERE file_id = ?
+                AND (status = ? OR (status = ? AND next_attempt_at <= ?))
+        """,
+            (JOB_DOWNLOADING, _now(), file_id, JOB_PENDING, JOB_FAILED, now),
+        )
+        return changed == 1
+
+    def claim_due_jobs(self, course_id):
+        """
+        Claim the queued work of a course that is due, at the start of its sync.
+
+        Jobs a crashed run left in 'downloading', or in 'uploading' before NotebookLM
+        returned a source, go back to the queue. Jobs that already have a source resume
+        at the processing wait instead of being uploaded again.
+        Returns rows of FILE_JOB_COLUMNS; rows with a source_id still need their wait.
+        """
+        now = time.time()
+        with self._lock:
+            self._write(
+                """
+                UPDATE file_jobs SET status = ?
+                WHERE course_id = ?
+                    AND (status = ? OR (status = ? AND source_id IS NULL))
+            """,
+                (JOB_PENDING, course_id, JOB_DOWNLOADING, JOB_UPLOADING),
+            )
+            rows = self._query(
+                f"""
+                SELECT {FILE_JOB_COLUMNS} FROM file_jobs
+                WHERE course_id = ?
+                    AND (status IN (?, ?) OR (status = ? AND next_attempt_at <= ?))
+            """,
+                (course_id, JOB_PENDING, JOB_UPLOADING, JOB_FAILED, now),
+            )
+            self._write(
+                """
+                UPDATE file_jobs SET status = ?, updated_at = ?
+                WHERE course_id = ?
+                    AND (status = ? OR (status = ? AND next_attempt_at <= ?))
+            """,
+                (JOB_DOWNLOADING, _now(), course_id, JOB_PENDING, JOB_FAILED, now),
+            )
+            return rows
+
+    def set_file_job_status(
+        self,
+        file_id,
+        updated_at,
+        size,
+        status,
+        source_id=None,
+        content_hash=None,
+        notebook_id=None,
+    ):
+        """
+        Move a claimed job to a new state, e.g. 'uploading' once its download finished.
+        Ignored if the job has since been replaced by a newer version of the file.
+        """
+        self._write(
+            """
+            UPDATE file_jobs
+            SET status = ?, source_id = coalesce(?, source_id),
+                content_hash = coalesce(?, content_hash),
+                notebook_id = coalesce(?, notebook_id), updated_at = ?
+            WHERE file_id = ? AND canvas_updated_at IS ? AND size IS ?
+        """,
+            (status, source_id, content_hash, notebook_id, _now(), file_id, updated_at, size),
+        )
+
+    def complete_file_job(self, file_id, updated_at, size):
+        """
+        Mark a job as uploaded. Ignored if a newer version of the file has been queued.
+        """
+        self._write(
+            """
+            UPDATE file_jobs
+            SET status = ?, next_attempt_at = NULL, last_error = NULL, updated_at = ?
+            WHERE file_id = ? AND canvas_updated_at IS ? AND size IS ?
+        """,
+            (JOB_UPLOADED, _now(), file_id, updated_at, size),
+        )
+
+    def fail_file_job(
+        self,
+        file_id,
+        updated_at,
+        size,
+        error,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+        backoff=DEFAULT_RETRY_BACKOFF,
+    ):
+        """
+        Record a failed attempt and schedule the next one with exponential backoff.
+        After `max_attempts` the job is given up (no next attempt) until the file changes
+        in Canvas or `retry_failed_jobs` is called.
+        Returns the time of the next attempt (Unix time), or None if the job was given up.
+        """
+        with self._lock:
+            rows = self._query(
+                """
+                SELECT attempts FROM file_jobs
+                WHERE file_id = ? AND canvas_updated_at IS ? AND size IS ?
+            """,
+                (file_id, updated_at, size),
+            )
+            if not rows:
+                return None
+            attempts = (rows[0][0] or 0) + 1
+            next_attempt_at = None
+            if attempts < max_attempts:
+                next_attempt_at = time.time() + min(
+                    MAX_RETRY_BACKOFF, backoff * 2 ** (attempts - 1)
+                )
+            self._write(
+                """
+                UPDATE file_jobs
+                SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?,
+                    source_id = NULL, notebook_id = NULL, updated_at = ?
+                WHERE file_id = ?
+            """,
+                (JOB_FAILED, attempts, next_attempt_at, str(error), _now(), file_id),
+            )
+            return next_attempt_at
+
+    def retry_failed_jobs(self, course_id=None):
+        """
+        Make every failed job (optionally of one course) due again with a fresh attempt count.
+        Returns the number of jobs requeued.
+        """
+        sql = (
+            "UPDATE file_jobs SET status = ?, attempts = 0, next_attempt_at = NULL WHERE status = ?"
+        )
+        params: tuple = (JOB_PENDING, JOB_FAILED)
+        if course_id is not None:
+            sql += " AND course_id = ?"
+            params += (course_id,)
+        return self._write(sql, params, batched=False)
+
+    def get_file_job(self, file_id):
+        """
+        Retrieve the queue state of a file.
+        Returns a tuple (status, attempts, next_attempt_at, last_error), or None.
+        """
+        rows = self._query(
+            "SELECT status, attempts, next_attempt_at, last_error FROM file_jobs WHERE file_id = ?",
+            (file_id,),
+        )
+        return rows[0] if rows else None
+
+    def get_course_bundles(self, course_id):
+        """
+        Retrieve the bundles of a course.
+        Returns rows (bundle_id, folder_id, bundle_index, member bytes, source_id,
+        notebook_id, content_hash).
+        """
+        return self._query(
+            """
+            SELECT b.bundle_id, b.folder_id, b.bundle_index,
+                coalesce((SELECT SUM(length(m.content)) FROM bundle_members m
+                    WHERE m.bundle_id = b.bundle_id), 0),
+                b.source_id, b.notebook_id, b.content_hash
+            FROM bundles b WHERE b.course_id = ?
+        """,
+            (course_id,),
+        )
+
+    def get_bundle_membership(self, course_id):
+        """
+        Map every bundled file of a course to its bundle.
+        Returns a dict: file_id -> bundle_id
+        """
+        rows = self._query(
+            "SELECT file_id, bundle_id FROM bundle_members WHERE course_id = ?", (course_id,)
+        )
+        return dict(rows)
+
+    def get_bundle_members(self, bundle_id):
+        """
+        Returns rows (file_id, file_name, canvas_updated_at, content) of a bundle's members.
+        """
+        return self._query(
+            """
+            SELECT file_id, file_name, canvas_updated_at, content FROM bundle_members
+            WHERE bundle_id = ?
+        """,
+            (bundle_id,),
+        )
+
+    def remove_bundle_member(self, file_id):
+        """
+        Take a file out of its bundle, e.g. once it is no longer small enough.
+        Returns the bundle it was in, or None.
+        """
+        with self._lock:
+            rows = self._query("SELECT bundle_id FROM bundle_members WHERE file_id = ?", (file_id,))
+            if not rows:
+                return None
+            self._write("DELETE FROM bundle_members WHERE file_id = ?", (file_id,))
+            return rows[0][0]
+
+    def save_bundle(
+        self,
+        bundle_id,
+        course_id,
+        folder_id,
+        bundle_index,
+        title,
+        source_id,
+        notebook_id,
+        content_hash,
+        members,
+    ):
+        """
+        Record a rebuilt bundle: its source, and its members as (file_id, file_name,
+        canvas_updated_at, content) tuples. Files already recorded as uploaded members
+        are pointed at the new source. A `title` of None keeps the stored title.
+        """
+        with self._lock:
+            self._write(
+                """
+                INSERT OR REPLACE INTO bundles (
+                    bundle_id, course_id, folder_id, bundle_index, title, source_id,
+                    notebook_id, content_hash, updated_at
+                )
+                VALUES (
+                    ?, ?, ?, ?, COALESCE(?, (SELECT title FROM bundles WHERE bundle_id = ?)),
+                    ?, ?, ?, ?
+                )
+            """,
+                (
+                    bundle_id,
+                    course_id,
+                    folder_id,
+                    bundle_index,
+                    title,
+                    bundle_id,
+                    source_id,
+                    notebook_id,
+                    content_hash,
+                    _now(),
+                ),
+            )
+            self._write("DELETE FROM bundle_members WHERE bundle_id = ?", (bundle_id,))
+            for file_id, file_name, updated_at, content in members:
+                self._write(
+                    """
+                    INSERT OR REPLACE INTO bundle_members (
+                        file_id, bundle_id, course_id, file_name, canvas_updated_at, content
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                    (file_id, bundle_id, course_id, file_name, updated_at, content),
+                )
+            self._write(
+                """
+                UPDATE files SET source_id = ?, notebook_id = ?
+                WHERE file_id IN (SELECT file_id FROM bundle_members WHERE bundle_id = ?)
+            """,
+                (source_id, notebook_id, bundle_id),
+                batched=False,
+            )
+
+    def delete_bundle(self, bundle_id):
+        """
+        Forget a bundle whose last member left it.
+        """
+        with self._lock:
+            self._write("DELETE FROM bundle_members WHERE bundle_id = ?", (bundle_id,))
+            self._write("DELETE FROM bundles WHERE bundle_id = ?", (bundle_id,), batched=False)
+
+    def get_extracted_text(self, content_hash):
+        """
+        Look up the cached extraction of a file's content.
+        Returns a tuple (text,) where text is None if the original is to be uploaded, or
+        None if the content was never extracted.
+        """
+        rows = self._query(
+            "SELECT text FROM extracted_texts WHERE content_hash = ?", (content_hash,)
+        )
+        return rows[0] if rows else None
+
+    def save_extracted_text(self, content_hash, original_size, text):
+        self._write(
+            """
+            INSERT OR REPLACE INTO extracted_texts (content_hash, original_size, text, created_at)
+            VALUES (?, ?, ?, ?)
+        """,
+            (content_hash, original_size, text, _now()),
+        )
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
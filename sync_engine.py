@@ -0,0 +1,1308 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from bundler import Bundle, CourseBundles
+from canvas_client import DownloadProgress
+from extractor import extracted_name
+from file_filter import FileFilter
+from metrics import Metrics
+from notebook_client import SOURCE_FAILED, SOURCE_TIMED_OUT, SourceBatch
+from planner import (
+    DEFAULT_MAX_SOURCES_PER_NOTEBOOK,
+    DEFAULT_UPLOAD_ORDER,
+    NotebookShards,
+    order_jobs,
+    plan_course,
+    shard_title,
+)
+from state_manager import (
+    DEFAULT_MAX_ATTEMPTS,
+    DEFAULT_RETRY_BACKOFF,
+    JOB_UPLOADING,
+)
+
+MB = 1024 * 1024
+DEFAULT_QUEUE_DEPTH = 4
+DEFAULT_TEMP_DISK_BYTES = 1024 * MB
+DEFAULT_MEMORY_THRESHOLD_BYTES = 16 * MB
+DEFAULT_MEMORY_BYTES = 256 * MB
+DEFAULT_WAIT_BATCH_SIZE = 50
+DEFAULT_COURSE_CACHE_TTL = 24 * 60 * 60
+# Headroom kept free on the temp filesystem when spilling large files.
+MIN_FREE_DISK_BYTES = 64 * MB
+
+
+async def resolve_courses(
+    canvas_client, state_manager, course_ids, concurrency=1, cache_ttl=DEFAULT_COURSE_CACHE_TTL
+):
+    """
+    Resolve courses directly by ID instead of listing every enrollment.
+    Metadata cached within `cache_ttl` seconds is used as is; the rest is fetched with up to
+    `concurrency` parallel Canvas requests and cached. Courses that no longer exist, are not
+    accessible or have concluded are left out.
+    Returns the courses in the order of `course_ids`.
+    """
+    slots = asyncio.Semaphore(max(1, concurrency))
+
+    async def resolve(course_id):
+        metadata = None
+        if cache_ttl > 0:
+            metadata = state_manager.get_cached_course_metadata(course_id, cache_ttl)
+        if metadata is not None:
+            course = canvas_client.course_from_metadata(metadata)
+        else:
+            async with slots:
+                course = await asyncio.to_thread(canvas_client.get_course, course_id)
+            if course is None:
+                return None
+            state_manager.set_cached_course_metadata(
+                course_id, canvas_client.course_metadata(course)
+            )
+        if not canvas_client.is_course_active(course):
+            logging.info(f"Skipping course {course_id}: it is no longer active in Canvas.")
+            return None
+        return course
+
+    courses = await asyncio.gather(*(resolve(course_id) for course_id in course_ids))
+    return [course for course in courses if course is not None]
+
+
+class SyncLimits:
+    def __init__(
+        self,
+        courses=1,
+        listing=1,
+        downloads=1,
+        uploads=1,
+        queue_depth=DEFAULT_QUEUE_DEPTH,
+        temp_disk_bytes=DEFAULT_TEMP_DISK_BYTES,
+        memory_threshold_bytes=DEFAULT_MEMORY_THRESHOLD_BYTES,
+        memory_bytes=DEFAULT_MEMORY_BYTES,
+        wait_batch_size=DEFAULT_WAIT_BATCH_SIZE,
+    ):
+        """
+        Concurrency limits for a sync run.
+        :param courses: Number of courses processed at the same time.
+        :param listing: Number of in-flight Canvas file listings.
+        :param downloads: Number of in-flight Canvas downloads.
+        :param uploads: Number of in-flight NotebookLM uploads.
+        :param queue_depth: Per-course capacity of the queues between pipeline stages.
+        :param temp_disk_bytes: Max bytes of downloaded-but-not-yet-uploaded temp files.
+        :param memory_threshold_bytes: Files up to this size are transferred in memory
+            instead of through a temp file; 0 always uses temp files.
+        :param memory_bytes: Max bytes of in-memory transfers held at once.
+        :param wait_batch_size: Max sources per course awaiting processing at once; they
+            are polled together, so this is also the size of a processing-wait batch.
+        """
+        self.courses = max(1, courses)
+        self.listing = max(1, listing)
+        self.downloads = max(1, downloads)
+        self.uploads = max(1, uploads)
+        self.queue_depth = max(1, queue_depth)
+        self.temp_disk_bytes = max(1, temp_disk_bytes)
+        self.memory_threshold_bytes = max(0, memory_threshold_bytes)
+        self.memory_bytes = max(1, memory_bytes)
+        self.wait_batch_size = max(1, wait_batch_size)
+
+    @classmethod
+    def from_args(cls, args):
+        """
+        Build limits from parsed CLI args. Stage-specific flags fall back to --concurrency.
+        """
+        concurrency = getattr(args, "concurrency", None) or 1
+
+        def megabytes(name, default):
+            value = getattr(args, name, None)
+            return value * MB if value is not None else default
+
+        return cls(
+            courses=concurrency,
+            listing=getattr(args, "listing_concurrency", None) or concurrency,
+            downloads=getattr(args, "download_concurrency", None) or concurrency,
+            uploads=getattr(args, "upload_concurrency", None) or concurrency,
+            queue_depth=getattr(args, "queue_depth", None) or DEFAULT_QUEUE_DEPTH,
+            temp_disk_bytes=megabytes("max_temp_disk_mb", DEFAULT_TEMP_DISK_BYTES),
+            memory_threshold_bytes=megabytes("memory_threshold_mb", DEFAULT_MEMORY_THRESHOLD_BYTES),
+            memory_bytes=megabytes("max_memory_mb", DEFAULT_MEMORY_BYTES),
+            wait_batch_size=getattr(args, "wait_batch_size", None) or DEFAULT_WAIT_BATCH_SIZE,
+        )
+
+
+class ByteBudget:
+    def __init__(self, limit):
+        """
+        An async counting limit on bytes instead of slots.
+        """
+        self.limit = limit
+        self.used = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, size):
+        async with self._condition:
+            # A file larger than the whole budget may still run, but only on its own.
+            await self._condition.wait_for(lambda: self.used == 0 or self.used + size <= self.limit)
+            self.used += size
+
+    async def charge(self, size):
+        """
+        Count bytes against the budget without waiting for room, for holders that must
+        not block; later acquirers wait until they are released.
+        """
+        async with self._condition:
+            self.used += size
+
+    async def release(self, size):
+        async with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+class SyncSummary:
+    def __init__(self):
+        """
+        Per-run counters, logged at the end of a sync.
+        """
+        self.uploaded = 0
+        self.replaced = 0
+        self.deduplicated = 0
+        self.unchanged = 0
+        self.skipped = 0
+        self.failed = 0
+        self.deferred = 0
+        self.recovered = 0
+        self.bundled = 0
+        self.extracted = 0
+        self.extraction_bytes_saved = 0
+
+    def describe(self):
+        return (
+            f"{self.uploaded} uploaded ({self.replaced} replacing changed files), "
+            f"{self.bundled} in bundles of small files, "
+            f"{self.extracted} as extracted text ({self.extraction_bytes_saved} bytes saved), "
+            f"{self.deduplicated} dedup hits, {self.unchanged} unchanged, "
+            f"{self.skipped} skipped, {self.failed} failed, "
+            f"{self.deferred} waiting to retry, {self.recovered} resumed from an earlier run"
+        )
+
+    def snapshot(self):
+        return dict(vars(self))
+
+
+class FileJob:
+    def __init__(
+        self,
+        file_id,
+        file_name,
+        download_url,
+        size=0,
+        updated_at=None,
+        content_type=None,
+        replaces_source_id=None,
+        replaces_notebook_id=None,
+        bundle_id=None,
+    ):
+        """
+        A single Canvas file moving through the download → upload → processing stages.
+        :param replaces_source_id: NotebookLM source of an older version of this file,
+            removed once the new version has been processed.
+        :param replaces_notebook_id: Notebook (shard) holding that older source.
+        :param bundle_id: The bundle of small files this file goes into instead of
+            becoming a source of its own.
+        """
+        self.file_id = file_id
+        self.file_name = file_name
+        self.download_url = download_url
+        self.size = size
+        self.updated_at = updated_at
+        self.content_type = content_type
+        self.replaces_source_id = replaces_source_id
+        self.replaces_notebook_id = replaces_notebook_id
+        self.bundle_id = bundle_id
+        self.source_id = None
+        # The notebook (shard) the file is uploaded to, assigned at upload time.
+        self.notebook_id = None
+        self.content_hash = None
+        # Downloaded content: `data` for in-memory transfers, otherwise a file in `temp_dir`.
+        self.data = None
+        self.temp_dir = None
+        self.local_path = None
+        # Extracted text, uploaded instead of the downloaded content when set.
+        self.extracted = None
+        # Resolved with (notebook_id, source_id) once this job's upload is processed, or
+        # None if it fails; set while it is the run's upload of its content.
+        self.uploaded = None
+        # Resume point of a spilled download, when downloads are resumable.
+        self.progress = None
+        self.budget = None
+        # When the processing wait started (time.perf_counter()).
+        self.waiting_since = None
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        Rebuild a job from a `file_jobs` row (see FILE_JOB_COLUMNS).
+        """
+        (
+            file_id,
+            file_name,
+            download_url,
+            size,
+            updated_at,
+            content_type,
+            replaces,
+            replaces_notebook_id,
+            source_id,
+            notebook_id,
+            content_hash,
+            bundle_id,
+        ) = row
+        job = cls(
+            file_id,
+            file_name,
+            download_url,
+            size=size or 0,
+            updated_at=updated_at,
+            content_type=content_type,
+            replaces_source_id=replaces,
+            replaces_notebook_id=replaces_notebook_id,
+            bundle_id=bundle_id,
+        )
+        job.source_id = source_id
+        job.notebook_id = notebook_id
+        job.content_hash = content_hash
+        return job
+
+
+class CourseTarget:
+    def __init__(self, course, course_name, notebook_id):
+        """
+        A course selected for sync, with its resolved NotebookLM notebook.
+        """
+        self.course = course
+        self.course_id = str(course.id)
+        self.course_name = course_name
+        self.notebook_id = notebook_id
+        self.synced_files = 0
+        self.failed_files = 0
+        # Why the sync of the course itself failed (e.g. its listing), after it is logged.
+        self.error = None
+        # All notebooks of the course (see NotebookShards), loaded when its sync starts.
+        self.shards = None
+        self.shard_lock = None
+        self.folder_names = None
+
+
+class SyncEngine:
+    def __init__(
+        self,
+        canvas_client,
+        state_manager,
+        notebook_client,
+        limits=None,
+        temp_dir=None,
+        full_rescan=False,
+        file_filter=None,
+        resume_downloads=True,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+        retry_backoff=DEFAULT_RETRY_BACKOFF,
+        metrics=None,
+        upload_order=DEFAULT_UPLOAD_ORDER,
+        max_sources_per_notebook=DEFAULT_MAX_SOURCES_PER_NOTEBOOK,
+        bundler=None,
+        extractor=None,
+    ):
+        """
+        Process the files of several courses concurrently within bounded worker pools.
+        :param temp_dir: Directory for large files that do not fit the in-memory threshold.
+        :param full_rescan: List every file of each course instead of stopping at the
+            course's `updated_at` high-water mark.
+        :param file_filter: Rules for which files to sync (default: skip audio and video).
+        :param resume_downloads: Keep interrupted downloads of spilled files and continue
+            them with HTTP range requests on the next attempt or run.
+        :param max_attempts: Attempts per file version before it is given up.
+        :param retry_backoff: Delay in seconds before the first retry of a failed file;
+            doubled after every further failure.
+        :param metrics: Receives per-course, budget-wait and processing-wait timings.
+        :param upload_order: Order in which each course's new files are uploaded
+            (see planner.order_jobs).
+        :param max_sources_per_notebook: NotebookLM's source limit; a course with more
+            files continues in extra notebooks. 0 disables sharding.
+        :param bundler: A SmallFileBundler to merge small text files of a folder into
+            shared sources; None uploads every file on its own.
+        :param extractor: A TextExtractor whose text output is uploaded instead of the
+            documents it can read; None uploads every file as downloaded.
+        """
+        self.canvas_client = canvas_client
+        self.state_manager = state_manager
+        self.notebook_client = notebook_client
+        self.limits = limits or SyncLimits()
+        self.temp_dir = temp_dir or os.path.join(os.getcwd(), "temp_downloads")
+        self.full_rescan = full_rescan
+        self.file_filter = file_filter or FileFilter()
+        self.resume_downloads = resume_downloads
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.summary = SyncSummary()
+        self.metrics = metrics or Metrics()
+        self.upload_order = upload_order
+        self.max_sources_per_notebook = max_sources_per_notebook
+        self.bundler = bundler
+        self.extractor = extractor
+
+        self._course_slots = asyncio.Semaphore(self.limits.courses)
+        self._listing_slots = asyncio.Semaphore(self.limits.listing)
+        self._download_slots = asyncio.Semaphore(self.limits.downloads)
+        self._upload_slots = asyncio.Semaphore(self.limits.uploads)
+        self._temp_disk = ByteBudget(self.limits.temp_disk_bytes)
+        self._memory = ByteBudget(self.limits.memory_bytes)
+        # course ID -> task of the bulk listing that covers the course, if any.
+        self._prefetches: dict = {}
+        # (course ID, content hash) -> future of the upload of that content in this run.
+        self._uploads: dict = {}
+
+    async def run(self, targets):
+        """
+        Sync every target course, at most `limits.courses` at a time.
+        """
+        self._start_prefetches(targets)
+        try:
+            await asyncio.gather(*(self._run_course(target) for target in targets))
+        finally:
+            await self._finish_prefetches()
+
+    def close(self):
+        """
+        Stop the text extraction worker processes, if any were started.
+        """
+        if self.extractor is not None:
+            self.extractor.shutdown()
+
+    async def _run_course(self, target):
+        async with self._course_slots:
+            try:
+                with self.metrics.time("course_sync"):
+                    await self.sync_course(target)
+            except Exception as e:
+                target.error = e
+                logging.error(f"Error processing course {target.course_name}: {e}")
+
+    async def sync_course(self, target):
+        """
+        Sync all new and changed files of a single course.
+
+        Files flow through stages connected by queues, so downloads start while later pages
+        of the listing are still loading, and one file can be downloading while another
+        uploads and a third is being processed by NotebookLM:
+        listing → job queue → download workers → upload queue → upload workers →
+        processing queue → processing waiter.
+        Every course runs the same number of workers per stage, so the FIFO stage semaphores
+        interleave courses instead of letting one large course queue all of its files first.
+
+        Work goes through the durable queue in the state DB: queued work from earlier runs
+        (retries that are due, and jobs a crash interrupted) is picked up first, and every
+        listed file is queued before it is worked on.
+
+        With an upload order other than the listing's, jobs are held back until the
+        listing is complete and then queued in that order. Small files that go into
+        bundles are collected per bundle instead, and each touched bundle is rebuilt
+        once the listing is complete.
+        """
+        since, listing_since = self._listing_bounds(target)
+        # One query for the whole course instead of one lookup per file.
+        processed = self.state_manager.get_processed_file_versions(target.course_id)
+        target.shards = self._load_shards(target)
+        target.shard_lock = asyncio.Lock()
+        bundles = self._load_bundles(target)
+        # bundle_id -> jobs of new and changed members
+        bundle_jobs: dict = {}
+
+        # Unbounded: jobs are small, and a listing that never waits on downloads frees
+        # its listing slot for the next course as soon as Canvas has returned every page.
+        jobs: asyncio.Queue = asyncio.Queue()
+        recovered_uploads = []
+        # A newer version of one of these files, if listed, is queued in the DB and picked
+        # up next run; the in-flight job's status updates skip the replaced row.
+        in_flight = set()
+        for row in self.state_manager.claim_due_jobs(target.course_id):
+            job = FileJob.from_row(row)
+            in_flight.add(job.file_id)
+            self.summary.recovered += 1
+            if job.bundle_id and bundles is not None:
+                bundle_jobs.setdefault(job.bundle_id, []).append(job)
+            elif job.source_id:
+                # The source is in its notebook already, just not recorded as processed.
+                target.shards.take(job.notebook_id or target.notebook_id)
+                recovered_uploads.append(job)
+            else:
+                jobs.put_nowait(job)
+        newest = since
+        listing_complete = False
+        streamed = self.upload_order == DEFAULT_UPLOAD_ORDER
+        held_back = []
+        listing_done = asyncio.Event()
+
+        async def listing_stage():
+            nonlocal newest, listing_complete
+            try:
+                async with self._listing_slots:
+                    async for file, skipped_folders in self._list_files(target, listing_since):
+                        updated_at = getattr(file, "updated_at", None)
+                        if updated_at and (newest is None or updated_at > newest):
+                            newest = updated_at
+                        job = self._plan_file(target, file, processed, skipped_folders)
+                        if job and bundles is not None:
+                            self._route_to_bundle(bundles, job, file, bundle_jobs)
+                        if job and self._queue_job(target, job) and job.file_id not in in_flight:
+                            if job.bundle_id:
+                                bundle_jobs.setdefault(job.bundle_id, []).append(job)
+                            elif streamed:
+                                jobs.put_nowait(job)
+                            else:
+                                held_back.append(job)
+                listing_complete = True
+            except Exception as e:
+                target.error = e
+                logging.error(f"Error listing files for course {target.course_name}: {e}")
+            finally:
+                # Jobs claimed before a listing error are still worked on.
+                for job in order_jobs(held_back, self.upload_order):
+                    jobs.put_nowait(job)
+                for _ in range(self.limits.downloads):
+                    jobs.put_nowait(None)
+                listing_done.set()
+
+        async def bundle_stage():
+            # Each bundle is rebuilt once, after all of its members have been listed.
+            await listing_done.wait()
+            await asyncio.gather(
+                *(
+                    self._sync_bundle(target, bundles, bundle_id, members)
+                    for bundle_id, members in bundle_jobs.items()
+                )
+            )
+
+        await asyncio.gather(
+            listing_stage(), self._run_pipeline(target, jobs, recovered_uploads), bundle_stage()
+        )
+
+        # Failed files stay in the work queue, so only an unfinished listing (which may
+        # have missed files) holds the mark back.
+        if listing_complete and newest and newest != since:
+            self.state_manager.set_course_high_water_mark(
+                target.course_id, newest, self.file_filter.signature()
+            )
+
+    def _listing_bounds(self, target):
+        """
+        Returns (high-water mark, date to list files from) for a course.
+        """
+        since = None
+        if not self.full_rescan:
+            # Files the rules skipped may be older than the mark, so a mark saved under
+            # other rules would hide them.
+            since = self.state_manager.get_course_high_water_mark(
+                target.course_id, self.file_filter.signature()
+            )
+        # The listing is sorted newest first, so a date filter can end it early too.
+        listing_since = max(filter(None, (since, self.file_filter.updated_after)), default=None)
+        return since, listing_since
+
+    def _start_prefetches(self, targets):
+        """
+        With a Canvas client that lists files in bulk (the GraphQL backend), start one
+        listing per batch of target courses, in the order the courses are synced.
+        Bulk listings have no folder IDs, so folder rules and bundling keep to REST.
+        They have no `updated_at` order either, so only courses listed in full use them;
+        a course with a high-water mark or date filter is listed over REST, which stops
+        at the first file older than that.
+        """
+        if not getattr(self.canvas_client, "bulk_listing", False):
+            return
+        if self.file_filter.uses_folders or self.bundler is not None:
+            return
+        targets = [target for target in targets if self._listing_bounds(target)[1] is None]
+        batch_size = self.canvas_client.listing_batch_size
+        for start in range(0, len(targets), batch_size):
+            course_ids = [target.course.id for target in targets[start : start + batch_size]]
+            task = asyncio.ensure_future(
+                asyncio.to_thread(self.canvas_client.prefetch_course_files, course_ids)
+            )
+            self._prefetches.update(dict.fromkeys(course_ids, task))
+
+    async def _finish_prefetches(self):
+        tasks = set(self._prefetches.values())
+        self._prefetches.clear()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _list_files(self, target, since):
+        """
+        Yield (file, skipped folder IDs) for every Canvas file of a course updated since `since`.
+        """
+        prefetch = self._prefetches.get(target.course.id)
+        if prefetch is not None:
+            await asyncio.shield(prefetch)
+        skipped_folders = frozenset()
+        if self.file_filter.uses_folders:
+            folders = await asyncio.to_thread(
+                self.canvas_client.get_course_folders, target.course.id
+            )
+            skipped_folders = self.file_filter.skipped_folder_ids(folders)
+        async for file in self.canvas_client.stream_course_files(
+            target.course.id, since, self.file_filter.api_params()
+        ):
+            yield file, skipped_folders
+
+    def _load_shards(self, target):
+        notebook_ids = [target.notebook_id] if target.notebook_id else []
+        notebook_ids += [nb for _, nb in self.state_manager.get_course_shards(target.course_id)]
+        return NotebookShards(
+            notebook_ids,
+            self.state_manager.count_notebook_sources(target.course_id, target.notebook_id),
+            self.max_sources_per_notebook,
+        )
+
+    def _load_bundles(self, target):
+        if self.bundler is None:
+            return None
+        return CourseBundles(
+            target.course_id,
+            [
+                Bundle(bundle_id, folder_id, index, size, source_id, notebook_id, content_hash)
+                for (
+                    bundle_id,
+                    folder_id,
+                    index,
+                    size,
+                    source_id,
+                    notebook_id,
+                    content_hash,
+                ) in self.state_manager.get_course_bundles(target.course_id)
+            ],
+            self.state_manager.get_bundle_membership(target.course_id),
+            self.bundler.bundle_bytes,
+        )
+
+    def _route_to_bundle(self, bundles, job, file, bundle_jobs, dry_run=False):
+        """
+        Send a small text file to its bundle (setting `job.bundle_id`). A member that is
+        no longer small enough leaves its bundle, which is then rebuilt without it.
+        """
+        if self.bundler.accepts(job):
+            # A standalone source of an older version stays on the job and is removed
+            # once the bundle holds the file (see _sync_bundle).
+            job.bundle_id = bundles.assign(job, getattr(file, "folder_id", None))
+        elif job.file_id in bundles.members:
+            bundle_id = bundles.members.pop(job.file_id)
+            if not dry_run:
+                self.state_manager.remove_bundle_member(job.file_id)
+            bundle_jobs.setdefault(bundle_id, [])
+
+    async def plan(self, targets):
+        """
+        Work out what syncing the target courses would do, without queueing, downloading
+        or uploading anything: which files would be uploaded in which order and to which
+        notebook, how many bytes that is and roughly how long it would take.
+        Returns a list with one plan dict per course (see planner.plan_course).
+        """
+
+        async def plan_one(target):
+            async with self._listing_slots:
+                return await self.plan_course(target)
+
+        self._start_prefetches(targets)
+        try:
+            return await asyncio.gather(*(plan_one(target) for target in targets))
+        finally:
+            await self._finish_prefetches()
+
+    async def plan_course(self, target):
+        _, listing_since = self._listing_bounds(target)
+        processed = self.state_manager.get_processed_file_versions(target.course_id)
+        files = {"new": 0, "changed": 0, "unchanged": 0, "skipped": 0}
+        bundles = self._load_bundles(target)
+        if bundles is not None:
+            files["bundled"] = 0
+        touched_bundles: dict = {}
+        jobs = []
+        async for file, skipped_folders in self._list_files(target, listing_since):
+            outcome, job, _ = self._classify_file(target, file, processed, skipped_folders)
+            files[outcome] += 1
+            if job and bundles is not None:
+                self._route_to_bundle(bundles, job, file, touched_bundles, dry_run=True)
+            if job and job.bundle_id:
+                files["bundled"] += 1
+                touched_bundles.setdefault(job.bundle_id, []).append(job)
+            elif job:
+                jobs.append(job)
+        plan = plan_course(
+            target,
+            jobs,
+            files,
+            self._load_shards(target),
+            self.upload_order,
+            transfers=min(self.limits.downloads, self.limits.uploads),
+            uploads=self.limits.uploads,
+        )
+        if bundles is not None:
+            plan["rebuilt_bundles"] = sorted(touched_bundles)
+        return plan
+
+    async def _run_pipeline(self, target, jobs, recovered_uploads=()):
+        upload_queue: asyncio.Queue = asyncio.Queue(maxsize=self.limits.queue_depth)
+        processing_queue: asyncio.Queue = asyncio.Queue(maxsize=self.limits.queue_depth)
+        downloaders = self.limits.downloads
+        uploaders = self.limits.uploads
+        # With text extraction, downloads pass through the extraction stage first.
+        extractors = self.extractor.workers if self.extractor is not None else 0
+        extract_queue: asyncio.Queue = asyncio.Queue(maxsize=self.limits.queue_depth)
+        downloaded_queue = extract_queue if extractors else upload_queue
+
+        async def download_stage():
+            await asyncio.gather(
+                *(self._download_worker(target, jobs, downloaded_queue) for _ in range(downloaders))
+            )
+            for _ in range(extractors or uploaders):
+                await downloaded_queue.put(None)
+
+        async def extract_stage():
+            await asyncio.gather(
+                *(self._extract_worker(extract_queue, upload_queue) for _ in range(extractors))
+            )
+            if extractors:
+                for _ in range(uploaders):
+                    await upload_queue.put(None)
+
+        async def upload_stage():
+            # Sources uploaded by an interrupted run only need their processing wait.
+            for job in recovered_uploads:
+                await processing_queue.put(job)
+            await asyncio.gather(
+                *(
+                    self._upload_worker(target, upload_queue, processing_queue)
+                    for _ in range(uploaders)
+                )
+            )
+            await processing_queue.put(None)
+
+        await asyncio.gather(
+            download_stage(),
+            extract_stage(),
+            upload_stage(),
+            self._processing_stage(target, processing_queue),
+        )
+
+    def _plan_file(self, target, file, processed, skipped_folders=frozenset()):
+        """
+        Decide whether a Canvas file needs syncing and build its job.
+        """
+        outcome, job, reason = self._classify_file(target, file, processed, skipped_folders)
+        file_name = getattr(file, "filename", f"file_{file.id}")
+        if outcome == "skipped":
+            if reason:
+                logging.info(f"Skipping file: {file_name} ({reason})")
+                self.summary.skipped += 1
+        elif outcome == "unchanged":
+            logging.debug(f"File already processed: {file_name}")
+            self.summary.unchanged += 1
+        elif outcome == "changed":
+            logging.info(f"Changed file found: {file_name}")
+        else:
+            logging.info(f"New file found: {file_name}")
+        return job
+
+    def _classify_file(self, target, file, processed, skipped_folders=frozenset()):
+        """
+        Sort a Canvas file into "new", "changed", "unchanged" or "skipped".
+        A processed file is synced again when Canvas reports a different `updated_at` or size.
+        Returns (outcome, job for new and changed files, reason a file is skipped).
+        """
+        file_id = str(file.id)
+        file_name = getattr(file, "filename", f"file_{file_id}")
+
+        reason = self.file_filter.rejection(file, skipped_folders)
+        if reason:
+            return "skipped", None, reason
+
+        updated_at = getattr(file, "updated_at", None)
+        size = getattr(file, "size", None)
+        outcome = "new"
+        replaces_source_id = replaces_notebook_id = None
+        if file_id in processed:
+            stored_updated_at, stored_size, stored_source_id, stored_notebook_id = processed[
+                file_id
+            ]
+            # Rows written before metadata was tracked have no version to compare against.
+            if stored_updated_at is None or (
+                stored_updated_at == updated_at and stored_size == size
+            ):
+                return "unchanged", None, None
+            outcome = "changed"
+            replaces_source_id = stored_source_id
+            # Rows written before shards existed belong to the course's own notebook.
+            replaces_notebook_id = stored_notebook_id or target.notebook_id
+
+        download_url = getattr(file, "url", None)
+        if not download_url:
+            # Canvas hides the URL of locked files; there is nothing to download.
+            return "skipped", None, None
+
+        job = FileJob(
+            file_id,
+            file_name,
+            download_url,
+            size=size or 0,
+            updated_at=updated_at,
+            content_type=getattr(file, "content_type", None),
+            replaces_source_id=replaces_source_id,
+            replaces_notebook_id=replaces_notebook_id,
+        )
+        return outcome, job, None
+
+    def _queue_job(self, target, job):
+        """
+        Record a planned job in the durable work queue.
+        Returns True if it was claimed for this run; a failed file still waiting out
+        its retry backoff (or given up) is counted as deferred instead.
+        """
+        claimed = self.state_manager.queue_file_job(
+            job.file_id,
+            target.course_id,
+            job.file_name,
+            job.download_url,
+            size=job.size,
+            updated_at=job.updated_at,
+            content_type=job.content_type,
+            replaces_source_id=job.replaces_source_id,
+            replaces_notebook_id=job.replaces_notebook_id,
+            bundle_id=job.bundle_id,
+        )
+        if not claimed:
+            logging.info(f"Not retrying {job.file_name} yet (failed earlier or in progress)")
+            self.summary.deferred += 1
+        return claimed
+
+    async def _download_worker(self, target, jobs, upload_queue):
+        while (job := await jobs.get()) is not None:
+            in_memory = self._fits_in_memory(job)
+            budget = self._memory if in_memory else self._temp_disk
+            with self.metrics.time("memory_budget_wait" if in_memory else "disk_budget_wait"):
+                await budget.acquire(job.size)
+            job.budget = budget
+            try:
+                async with self._download_slots:
+                    if in_memory:
+                        job.data, job.content_hash = await asyncio.to_thread(
+                            self.canvas_client.download_bytes, job.download_url
+                        )
+                    else:
+                        self._prepare_temp_file(target, job)
+                        job.content_hash = await asyncio.to_thread(
+                            self.canvas_client.download_file,
+                            job.download_url,
+                            job.local_path,
+                            job.progress,
+                        )
+                        if job.progress is not None:
+                            self.state_manager.delete_partial_download(job.file_id)
+                duplicate = self._find_duplicate(target, job.content_hash)
+            except Exception as e:
+                self._record_failure(target, job, e)
+                # Keep the partial file so the next attempt continues where this one stopped.
+                await self._discard_download(job, keep_partial=job.progress is not None)
+                continue
+            if not duplicate and job.content_hash:
+                duplicate = await self._claim_upload(target, job)
+
+            if duplicate:
+                # Identical bytes are already in a notebook of this course (e.g. a
+                # cross-listed syllabus).
+                await self._discard_download(job)
+                job.notebook_id, job.source_id = duplicate
+                logging.info(f"Skipping upload of duplicate content: {job.file_name}")
+                try:
+                    await self._complete_job(target, job, deduplicated=True)
+                except Exception as e:
+                    self._record_failure(target, job, e)
+                continue
+            self.state_manager.set_file_job_status(
+                job.file_id, job.updated_at, job.size, JOB_UPLOADING, content_hash=job.content_hash
+            )
+            # Blocks while the upload stage is behind, which bounds in-flight downloads.
+            await upload_queue.put(job)
+
+    async def _extract_worker(self, extract_queue, upload_queue):
+        while (job := await extract_queue.get()) is not None:
+            if self.extractor.accepts(job):
+                try:
+                    job.extracted = await self._extract(job)
+                except Exception as e:
+                    logging.warning(f"Could not extract text of {job.file_name}, uploading it: {e}")
+            await upload_queue.put(job)
+
+    async def _extract(self, job):
+        """
+        Returns the text to upload instead of a job's content, or None; cached by content hash,
+        so a file moved or re-uploaded to Canvas is not parsed again.
+        """
+        cached = self.state_manager.get_extracted_text(job.content_hash)
+        if cached is not None:
+            self.metrics.count("extraction_cache_hits")
+            return cached[0]
+        with self.metrics.time("text_extraction", job.size):
+            text = await self.extractor.extract(job)
+        self.state_manager.save_extracted_text(job.content_hash, job.size, text)
+        return text
+
+    def _find_duplicate(self, target, content_hash):
+        """
+        Returns (notebook_id, source_id) of a source of the course with this content, or None.
+        """
+        for notebook_id in target.shards.notebook_ids:
+            source_id = self.state_manager.find_source_by_content_hash(notebook_id, content_hash)
+            if source_id:
+                return notebook_id, source_id
+        return None
+
+    async def _claim_upload(self, target, job):
+        """
+        Make `job` the upload of its content for this run, or wait for the job of the
+        course that already is: the state DB only knows a source once it is processed.
+        Returns (notebook_id, source_id) of the other job's source, or None if `job`
+        uploads (including when the other job failed).
+        """
+        key = (target.course_id, job.content_hash)
+        while (pending := self._uploads.get(key)) is not None:
+            # The content stays downloaded meanwhile, in case that upload fails.
+            duplicate = await asyncio.shield(pending)
+            if duplicate is not None:
+                return duplicate
+        job.uploaded = self._uploads[key] = asyncio.get_running_loop().create_future()
+        return None
+
+    def _settle_upload(self, target, job, duplicate=None):
+        """
+        Hand the outcome of a job's upload to the jobs waiting for the same content.
+        """
+        if job.uploaded is None or job.uploaded.done():
+            return
+        # Later duplicates find the processed source in the state DB instead.
+        self._uploads.pop((target.course_id, job.content_hash), None)
+        job.uploaded.set_result(duplicate)
+
+    def _fits_in_memory(self, job):
+        # Canvas reports sizes for every file; an unknown size always goes through disk.
+        return 0 < job.size <= self.limits.memory_threshold_bytes
+
+    def _check_free_space(self, file_name, size):
+        os.makedirs(self.temp_dir, exist_ok=True)
+        free = shutil.disk_usage(self.temp_dir).free
+        if free < size + MIN_FREE_DISK_BYTES:
+            raise OSError(
+                f"Not enough free space in {self.temp_dir} for {file_name} "
+                f"({size} bytes needed, {free} free)"
+            )
+
+    async def _add_source_bytes(self, notebook_id, file_name, data):
+        """
+        Upload in-memory content. notebooklm-py only uploads from a path, so the content
+        is written to a short-lived file under `temp_dir`, which counts against the
+        temp-disk budget meanwhile.
+        """
+        # Charged without waiting: upload workers blocked on the budget could wait forever
+        # for spilled files that only upload workers release.
+        await self._temp_disk.charge(len(data))
+        try:
+            self._check_free_space(file_name, len(data))
+            return await self.notebook_client.add_source_bytes(
+                notebook_id, file_name, data, self.temp_dir
+            )
+        finally:
+            await self._temp_disk.release(len(data))
+
+    def _prepare_temp_file(self, target, job):
+        """
+        Reserve a uniquely named temp location for a large file.
+        The directory keeps the original filename (used as the source title) while
+        staying unique across files with the same name and across concurrent runs.
+        With resumable downloads, the location of an interrupted download of the same
+        file is reused and its resume point is loaded into `job.progress`.
+        """
+        partial = None
+        if self.resume_downloads:
+            partial = self.state_manager.get_partial_download(job.file_id)
+            if partial and not os.path.exists(partial[0]):
+                partial = None
+
+        existing = os.path.getsize(partial[0]) if partial else 0
+        self._check_free_space(job.file_name, job.size - existing)
+
+        if partial:
+            path, bytes_received, etag, last_modified = partial
+            logging.info(f"Resuming download of {job.file_name} ({existing} bytes on disk)")
+            job.temp_dir = os.path.dirname(path)
+            job.local_path = path
+        else:
+            bytes_received, etag, last_modified = 0, None, None
+            job.temp_dir = tempfile.mkdtemp(
+                prefix=f"{target.course_id}-{job.file_id}-", dir=self.temp_dir
+            )
+            job.local_path = os.path.join(job.temp_dir, job.file_name)
+
+        if self.resume_downloads:
+
+            def save_progress(progress, path=job.local_path):
+                self.state_manager.save_partial_download(
+                    job.file_id,
+                    target.course_id,
+                    path,
+                    progress.bytes_received,
+                    progress.etag,
+                    progress.last_modified,
+                )
+
+            job.progress = DownloadProgress(bytes_received, etag, last_modified, save_progress)
+
+    async def _upload_worker(self, target, upload_queue, processing_queue):
+        while (job := await upload_queue.get()) is not None:
+            try:
+                # A new version goes next to the old one, so replacing it frees no room
+                # in one notebook while filling another.
+                job.notebook_id = await self._reserve_notebook(target, job.replaces_notebook_id)
+                async with self._upload_slots:
+                    if job.extracted is not None:
+                        job.source_id = await self._add_source_bytes(
+                            job.notebook_id, extracted_name(job.file_name), job.extracted
+                        )
+                    elif job.data is not None:
+                        job.source_id = await self._add_source_bytes(
+                            job.notebook_id, job.file_name, job.data
+                        )
+                    else:
+                        job.source_id = await self.notebook_client.add_source(
+                            job.notebook_id, job.local_path
+                        )
+            except Exception as e:
+                if job.notebook_id:
+                    target.shards.release(job.notebook_id)
+                    job.notebook_id = None
+                self._record_failure(target, job, e)
+                continue
+            finally:
+                # The content is not needed once the bytes are on NotebookLM's side.
+                await self._discard_download(job)
+            if job.extracted is not None:
+                self.summary.extracted += 1
+                self.summary.extraction_bytes_saved += job.size - len(job.extracted)
+                job.extracted = None
+            # Lets a restart resume at the processing wait instead of uploading again.
+            self.state_manager.set_file_job_status(
+                job.file_id,
+                job.updated_at,
+                job.size,
+                JOB_UPLOADING,
+                source_id=job.source_id,
+                notebook_id=job.notebook_id,
+            )
+            await processing_queue.put(job)
+
+    async def _reserve_notebook(self, target, preferred=None):
+        """
+        Pick the notebook for the next upload of a course, creating a new shard when
+        every notebook of the course is at the source limit.
+        """
+        notebook_id = target.shards.reserve(preferred)
+        if notebook_id is not None:
+            return notebook_id
+        async with target.shard_lock:
+            # Another upload may have added a shard while this one waited for the lock.
+            notebook_id = target.shards.reserve(preferred)
+            if notebook_id is None:
+                shard_index = len(target.shards)
+                title = shard_title(target.course_name, shard_index)
+                notebook_id = await self.notebook_client.create_notebook(title)
+                self.state_manager.add_course_shard(
+                    target.course_id, shard_index, notebook_id, title
+                )
+                logging.info(f"Course {target.course_name} is full, continuing in: {title}")
+                target.shards.add(notebook_id)
+                target.shards.take(notebook_id)
+            return notebook_id
+
+    async def _processing_stage(self, target, processing_queue):
+        """
+        Wait for a course's uploaded sources to finish processing.
+        All pending sources are polled together, and each file is marked as processed as
+        soon as its own source is ready rather than when its whole batch is.
+        """
+        # One batch per notebook; a course only spans several once it outgrew one.
+        batches: dict = {}
+        waiting = {}
+        uploads_done = False
+        while waiting or not uploads_done:
+            # Block only while nothing is pending; otherwise take whatever arrived since
+            # the last poll so it joins the next one.
+            while (
+                not uploads_done
+                and (not waiting or not processing_queue.empty())
+                and len(waiting) < self.limits.wait_batch_size
+            ):
+                job = await processing_queue.get()
+                if job is None:
+                    uploads_done = True
+                elif job.source_id:
+                    job.waiting_since = time.perf_counter()
+                    waiting[job.source_id] = job
+                    notebook_id = job.notebook_id or target.notebook_id
+                    if notebook_id not in batches:
+                        batches[notebook_id] = SourceBatch(self.notebook_client, notebook_id)
+                    batches[notebook_id].add(job.source_id)
+                else:
+                    logging.warning("Could not determine source ID to wait for processing.")
+                    await self._finish_processing(target, job)
+            if not waiting:
+                continue
+
+            results = []
+            for batch in batches.values():
+                results += await batch.poll()
+            for result in results:
+                job = waiting.pop(result.source_id)
+                self.metrics.record(
+                    "processing_wait",
+                    time.perf_counter() - job.waiting_since,
+                    error=result.state == SOURCE_FAILED,
+                )
+                await self._finish_processing(target, job, result)
+            if waiting:
+                await asyncio.gather(*(batch.sleep() for batch in batches.values() if len(batch)))
+
+    async def _finish_processing(self, target, job, result=None):
+        try:
+            if result is not None and result.state == SOURCE_FAILED:
+                # Remove the broken source so the retry on the next run starts clean.
+                notebook_id = job.notebook_id or target.notebook_id
+                try:
+                    await self.notebook_client.delete_source(notebook_id, job.source_id)
+                    target.shards.release(notebook_id)
+                except Exception as e:
+                    logging.warning(f"Could not remove failed source of {job.file_name}: {e}")
+                raise result.error
+            if result is not None and result.state == SOURCE_TIMED_OUT:
+                # The upload itself succeeded; NotebookLM keeps processing in the background.
+                logging.warning(f"Error waiting for source processing: {result.error}")
+            await self._complete_job(target, job)
+        except Exception as e:
+            self._record_failure(target, job, e)
+
+    async def _complete_job(self, target, job, deduplicated=False):
+        """
+        Replace any stale source of the file and record the new version as processed.
+        """
+        if job.replaces_source_id and job.replaces_source_id != job.source_id:
+            await self._remove_stale_source(target, job)
+        self.state_manager.mark_file_processed(
+            job.file_id,
+            target.course_id,
+            job.file_name,
+            updated_at=job.updated_at,
+            size=job.size,
+            content_type=job.content_type,
+            source_id=job.source_id,
+            notebook_id=job.notebook_id or target.notebook_id,
+            content_hash=job.content_hash,
+        )
+        self.state_manager.complete_file_job(job.file_id, job.updated_at, job.size)
+        self._settle_upload(target, job, (job.notebook_id or target.notebook_id, job.source_id))
+        target.synced_files += 1
+        if deduplicated:
+            self.summary.deduplicated += 1
+        else:
+            self.summary.uploaded += 1
+            if job.replaces_source_id:
+                self.summary.replaced += 1
+        logging.info(f"Successfully processed {job.file_name}")
+
+    async def _remove_stale_source(self, target, job):
+        if self.state_manager.is_source_shared(job.replaces_source_id, job.file_id):
+            # A duplicate of the old content still points at this source.
+            return
+        notebook_id = job.replaces_notebook_id or target.notebook_id
+        try:
+            await self.notebook_client.delete_source(notebook_id, job.replaces_source_id)
+        except Exception as e:
+            # The new version is already in the notebook; a leftover old source is harmless.
+            logging.warning(f"Could not remove old source of {job.file_name}: {e}")
+            return
+        target.shards.release(notebook_id)
+
+    async def _sync_bundle(self, target, bundles, bundle_id, jobs):
+        """
+        Rebuild one bundle from its stored members and the new versions in `jobs`, upload
+        it as a single source and remove the source it replaces. Only the changed members
+        are downloaded; the others are rebuilt from the text kept in the state DB.
+        """
+        bundle = bundles.get(bundle_id)
+        members = {
+            file_id: (file_name, updated_at, content)
+            for file_id, file_name, updated_at, content in self.state_manager.get_bundle_members(
+                bundle_id
+            )
+        }
+
+        async def download(job):
+            try:
+                async with self._download_slots:
+                    data, _ = await asyncio.to_thread(
+                        self.canvas_client.download_bytes, job.download_url
+                    )
+            except Exception as e:
+                self._record_failure(target, job, e)
+                return None
+            return job, data
+
+        fetched = [result for result in await asyncio.gather(*map(download, jobs)) if result]
+        for job, data in fetched:
+            members[job.file_id] = (job.file_name, job.updated_at, data)
+        if not members:
+            await self._remove_bundle_source(target, bundle)
+            self.state_manager.delete_bundle(bundle_id)
+            return
+
+        member_rows = [(file_id, *member) for file_id, member in members.items()]
+        document = self.bundler.compose(member_rows)
+        content_hash = hashlib.sha256(document).hexdigest()
+        old_bundle = Bundle(bundle_id, bundle.folder_id, bundle.index)
+        source_id, notebook_id = bundle.source_id, bundle.notebook_id
+        title = None
+        if not source_id or content_hash != bundle.content_hash:
+            folder_name = (await self._folder_names(target)).get(bundle.folder_id)
+            title = self.bundler.title(target.course_name, folder_name, bundle.index)
+            notebook_id = None
+            try:
+                notebook_id = await self._reserve_notebook(target, bundle.notebook_id)
+                async with self._upload_slots:
+                    source_id = await self._add_source_bytes(notebook_id, title, document)
+                await self._wait_for_source(notebook_id, source_id, title)
+            except Exception as e:
+                if notebook_id:
+                    target.shards.release(notebook_id)
+                for job, _ in fetched:
+                    self._record_failure(target, job, e)
+                return
+            old_bundle.source_id, old_bundle.notebook_id = bundle.source_id, bundle.notebook_id
+
+        self.state_manager.save_bundle(
+            bundle_id,
+            target.course_id,
+            bundle.folder_id,
+            bundle.index,
+            title,
+            source_id,
+            notebook_id,
+            content_hash,
+            member_rows,
+        )
+        bundle.source_id, bundle.notebook_id = source_id, notebook_id
+        bundle.content_hash = content_hash
+        # Only now do the members point at the new source, so the old one is unused.
+        await self._remove_bundle_source(target, old_bundle)
+        for job, data in fetched:
+            self.state_manager.mark_file_processed(
+                job.file_id,
+                target.course_id,
+                job.file_name,
+                updated_at=job.updated_at,
+                size=job.size,
+                content_type=job.content_type,
+                source_id=source_id,
+                notebook_id=notebook_id,
+            )
+            self.state_manager.complete_file_job(job.file_id, job.updated_at, job.size)
+            target.synced_files += 1
+            self.summary.bundled += 1
+        for job, _ in fetched:
+            # A file that joined the bundle leaves its standalone source behind; the
+            # bundle's own old source was handled above.
+            if job.replaces_source_id not in (None, source_id, old_bundle.source_id):
+                await self._remove_stale_source(target, job)
+        logging.info(f"Bundled {len(fetched)} changed of {len(members)} small files: {title}")
+
+    async def _wait_for_source(self, notebook_id, source_id, name):
+        """
+        Wait for a single source to finish processing; a failed source is removed and raised.
+        """
+        batch = SourceBatch(self.notebook_client, notebook_id)
+        batch.add(source_id)
+        started = time.perf_counter()
+        async for result in batch.results():
+            failed = result.state == SOURCE_FAILED
+            self.metrics.record("processing_wait", time.perf_counter() - started, error=failed)
+            if failed:
+                try:
+                    await self.notebook_client.delete_source(notebook_id, source_id)
+                except Exception as e:
+                    logging.warning(f"Could not remove failed source of {name}: {e}")
+                raise result.error
+            if result.state == SOURCE_TIMED_OUT:
+                logging.warning(f"Error waiting for source processing: {result.error}")
+
+    async def _remove_bundle_source(self, target, bundle):
+        # Files that left the bundle may still point at the old source until re-uploaded.
+        if not bundle.source_id or self.state_manager.is_source_shared(bundle.source_id):
+            return
+        try:
+            await self.notebook_client.delete_source(bundle.notebook_id, bundle.source_id)
+        except Exception as e:
+            logging.warning(f"Could not remove old bundle source {bundle.source_id}: {e}")
+            return
+        target.shards.release(bundle.notebook_id)
+
+    async def _folder_names(self, target):
+        """
+        Canvas folder paths of a course (str(folder_id) -> path), fetched once per sync.
+        """
+        if target.folder_names is None:
+            try:
+                folders = await asyncio.to_thread(
+                    self.canvas_client.get_course_folders, target.course.id
+                )
+            except Exception as e:
+                logging.warning(f"Could not list folders of {target.course_name}: {e}")
+                folders = {}
+            target.folder_names = {str(folder_id): name for folder_id, name in folders.items()}
+        return target.folder_names
+
+    def _record_failure(self, target, job, error):
+        self._settle_upload(target, job)
+        target.failed_files += 1
+        self.summary.failed += 1
+        logging.error(f"Error processing file {job.file_name}: {error}")
+        next_attempt_at = self.state_manager.fail_file_job(
+            job.file_id,
+            job.updated_at,
+            job.size,
+            error,
+            max_attempts=self.max_attempts,
+            backoff=self.retry_backoff,
+        )
+        if next_attempt_at is None:
+            logging.warning(f"Giving up on {job.file_name} until it changes in Canvas.")
+
+    async def _discard_download(self, job, keep_partial=False):
+        """
+        Free the downloaded content of a job and return its share of the byte budget.
+        :param keep_partial: Leave a spilled file on disk so its download can be resumed.
+        """
+        job.data = None
+        if not keep_partial and job.temp_dir and os.path.exists(job.temp_dir):
+            shutil.rmtree(job.temp_dir, ignore_errors=True)
+        job.temp_dir = None
+        job.local_path = None
+        if job.budget is not None:
+            await job.budget.release(job.size)
+            job.budget = None
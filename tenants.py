@@ -0,0 +1,423 @@
+import asyncio
+import logging
+import os
+import re
+import signal
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+DEFAULT_TENANTS_DB = "tenants.db"
+# Each tenant's state DB goes to <DEFAULT_TENANTS_DIR>/<tenant_id>/state.db unless set.
+DEFAULT_TENANTS_DIR = "tenants"
+DEFAULT_LEASE_SECONDS = 5 * 60
+DEFAULT_TENANT_INTERVAL = 15 * 60
+# How often an idle worker looks for due tenants again.
+DEFAULT_IDLE_SECONDS = 60.0
+DEFAULT_SHUTDOWN_TIMEOUT = 30.0
+# Tenant IDs become directory names, so no separators or dot-only names.
+TENANT_ID_PATTERN = re.compile(r"[A-Za-z0-9_@-][A-Za-z0-9_.@-]*")
+TENANT_LEASE_PREFIX = "tenant:"
+
+
+class Tenant:
+    def __init__(
+        self,
+        tenant_id,
+        canvas_url,
+        canvas_key,
+        notebooklm_storage=None,
+        state_db=None,
+        next_sync_at=0.0,
+        last_synced_at=None,
+        last_error=None,
+    ):
+        """
+        One user of a shared deployment, with their own Canvas token, NotebookLM login
+        and state DB.
+        :param notebooklm_storage: Path of the user's NotebookLM storage state (as written
+            by `notebooklm login`); None uses the library's default location.
+        :param next_sync_at: Unix time at which the tenant is due for its next sync.
+        """
+        self.tenant_id = tenant_id
+        self.canvas_url = canvas_url
+        self.canvas_key = canvas_key
+        self.notebooklm_storage = notebooklm_storage
+        self.state_db = state_db or os.path.join(DEFAULT_TENANTS_DIR, tenant_id, "state.db")
+        self.next_sync_at = next_sync_at
+        self.last_synced_at = last_synced_at
+        self.last_error = last_error
+
+
+TENANT_COLUMNS = (
+    "tenant_id, canvas_url, canvas_key, notebooklm_storage, state_db, next_sync_at, "
+    "last_synced_at, last_error"
+)
+
+
+class TenantRegistry:
+    def __init__(self, db_path=DEFAULT_TENANTS_DB):
+        """
+        The tenants of a shared deployment and the leases workers hold on them, in one
+        SQLite database that every worker opens.
+
+        A lease is claimed and renewed with a single conditional upsert, so two workers can
+        never hold the same one. Lease times are Unix times, so workers on different
+        nodes need roughly synchronized clocks (well within the lease length), and the
+        database must live on a filesystem with working locks.
+        The file holds Canvas tokens; keep it readable only by the workers.
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        # Autocommit: every statement is its own transaction, so no worker holds the
+        # database lock while it syncs.
+        self._conn = sqlite3.connect(
+            db_path, check_same_thread=False, timeout=30, isolation_level=None
+        )
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS tenants (
+                tenant_id TEXT PRIMARY KEY,
+                canvas_url TEXT,
+                canvas_key TEXT,
+                notebooklm_storage TEXT,
+                state_db TEXT,
+                next_sync_at REAL DEFAULT 0,
+                last_synced_at TIMESTAMP,
+                last_error TEXT
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                resource TEXT PRIMARY KEY,
+                owner TEXT,
+                expires_at REAL
+            )
+        """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            return cursor.fetchall(), cursor.rowcount
+
+    def add_tenant(self, tenant):
+        """
+        Register a tenant, or update the token and paths of an existing one.
+        """
+        if not TENANT_ID_PATTERN.fullmatch(tenant.tenant_id):
+            raise ValueError(f"Invalid tenant ID: {tenant.tenant_id!r}")
+        self._execute(
+            """
+            INSERT INTO tenants (tenant_id, canvas_url, canvas_key, notebooklm_storage, state_db)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(tenant_id) DO UPDATE SET
+                canvas_url=excluded.canvas_url,
+                canvas_key=excluded.canvas_key,
+                notebooklm_storage=excluded.notebooklm_storage,
+                state_db=excluded.state_db
+        """,
+            (
+                tenant.tenant_id,
+                tenant.canvas_url,
+                tenant.canvas_key,
+                tenant.notebooklm_storage,
+                tenant.state_db,
+            ),
+        )
+
+    def remove_tenant(self, tenant_id):
+        """
+        Unregister a tenant. Its state DB is kept. Returns True if it existed.
+        """
+        _, removed = self._execute("DELETE FROM tenants WHERE tenant_id = ?", (tenant_id,))
+        return removed == 1
+
+    def get_tenants(self):
+        rows, _ = self._execute(f"SELECT {TENANT_COLUMNS} FROM tenants ORDER BY tenant_id")
+        return [Tenant(*row) for row in rows]
+
+    def due_tenants(self, now=None):
+        """
+        Tenants due for a sync that no worker holds a lease on, most overdue first.
+        """
+        now = time.time() if now is None else now
+        rows, _ = self._execute(
+            f"""
+            SELECT {", ".join(f"t.{column}" for column in TENANT_COLUMNS.split(", "))}
+            FROM tenants t LEFT JOIN leases l ON l.resource = ? || t.tenant_id
+            WHERE t.next_sync_at <= ? AND (l.expires_at IS NULL OR l.expires_at <= ?)
+            ORDER BY t.next_sync_at
+        """,
+            (TENANT_LEASE_PREFIX, now, now),
+        )
+        return [Tenant(*row) for row in rows]
+
+    def seconds_until_due(self, now=None):
+        """
+        Seconds until the next tenant can be claimed (0 if one can now), or None without
+        tenants. A leased tenant counts from the end of its lease.
+        """
+        now = time.time() if now is None else now
+        rows, _ = self._execute(
+            """
+            SELECT MIN(MAX(t.next_sync_at, coalesce(l.expires_at, 0)))
+            FROM tenants t LEFT JOIN leases l ON l.resource = ? || t.tenant_id
+        """,
+            (TENANT_LEASE_PREFIX,),
+        )
+        if rows[0][0] is None:
+            return None
+        return max(0.0, rows[0][0] - now)
+
+    def finish_sync(self, tenant_id, next_sync_at, error=None):
+        """
+        Record the outcome of a tenant's sync and when it is due next.
+        """
+        self._execute(
+            """
+            UPDATE tenants SET next_sync_at = ?, last_synced_at = ?, last_error = ?
+            WHERE tenant_id = ?
+        """,
+            (next_sync_at, _now(), error, tenant_id),
+        )
+
+    def claim(self, resource, owner, seconds, now=None):
+        """
+        Take the lease on `resource` for `seconds` if it is free, expired or already ours.
+        Returns True if `owner` now holds it.
+        """
+        now = time.time() if now is None else now
+        _, claimed = self._execute(
+            """
+            INSERT INTO leases (resource, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(resource) DO UPDATE SET
+                owner=excluded.owner, expires_at=excluded.expires_at
+            WHERE leases.expires_at <= ? OR leases.owner = excluded.owner
+        """,
+            (resource, owner, now + seconds, now),
+        )
+        return claimed == 1
+
+    def renew(self, resource, owner, seconds, now=None):
+        """
+        Extend a lease `owner` still holds. Returns False if it expired and was taken over.
+        """
+        now = time.time() if now is None else now
+        _, renewed = self._execute(
+            "UPDATE leases SET expires_at = ? WHERE resource = ? AND owner = ?",
+            (now + seconds, resource, owner),
+        )
+        return renewed == 1
+
+    def release(self, resource, owner):
+        self._execute("DELETE FROM leases WHERE resource = ? AND owner = ?", (resource, owner))
+
+    def lease_owner(self, resource, now=None):
+        """
+        Returns the owner of an unexpired lease on `resource`, or None.
+        """
+        rows, _ = self._execute(
+            "SELECT owner FROM leases WHERE resource = ? AND expires_at > ?",
+            (resource, time.time() if now is None else now),
+        )
+        return rows[0][0] if rows else None
+
+
+def tenant_resource(tenant_id):
+    return f"{TENANT_LEASE_PREFIX}{tenant_id}"
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class TenantWorker:
+    def __init__(
+        self,
+        registry,
+        sync_tenant,
+        worker_id=None,
+        max_tenants=1,
+        lease_seconds=DEFAULT_LEASE_SECONDS,
+        interval=DEFAULT_TENANT_INTERVAL,
+        idle_seconds=DEFAULT_IDLE_SECONDS,
+        shutdown_timeout=DEFAULT_SHUTDOWN_TIMEOUT,
+    ):
+        """
+        Sync the tenants of a shared registry, together with any number of other workers.
+
+        A worker claims a due tenant through an expiring lease, runs `sync_tenant(tenant)`
+        and renews the lease every third of `lease_seconds` while it runs. If a renewal
+        fails, another worker may take the tenant over once the lease expires, so the
+        sync is cancelled rather than left uploading next to the new owner. A crashed
+        worker's tenants are picked up by the others after `lease_seconds`.
+        :param sync_tenant: Coroutine function running one full sync of a tenant.
+        :param max_tenants: Tenants this worker syncs at the same time.
+        :param interval: Seconds from the end of a tenant's sync to its next one.
+        """
+        self.registry = registry
+        self.sync_tenant = sync_tenant
+        self.worker_id = worker_id or default_worker_id()
+        self.max_tenants = max(1, max_tenants)
+        self.lease_seconds = lease_seconds
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+        self.shutdown_timeout = shutdown_timeout
+        self.syncs = 0
+        self.lost_leases = 0
+
+        self._running = {}
+        self._stop = asyncio.Event()
+
+    def stop(self):
+        """
+        Ask the worker to stop: no new tenants are claimed, running syncs get to finish.
+        """
+        if not self._stop.is_set():
+            logging.info("Stop requested; finishing in-flight tenant syncs.")
+        self._stop.set()
+
+    def install_signal_handlers(self):
+        """
+        Stop gracefully on SIGTERM (`docker stop`) and SIGINT.
+        """
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                # Not supported on this platform (e.g. Windows); Ctrl+C still interrupts.
+                pass
+
+    async def run(self):
+        logging.info(f"Worker {self.worker_id} started.")
+        stop_wait = asyncio.create_task(self._stop.wait())
+        try:
+            while not self._stop.is_set():
+                # Registry calls may wait on another worker's write (busy_timeout), so
+                # they run in threads instead of stalling the syncs on this loop.
+                claimed = await asyncio.to_thread(
+                    self._claim_due_tenants,
+                    self.max_tenants - len(self._running),
+                    set(self._running),
+                )
+                for tenant in claimed:
+                    task = asyncio.create_task(self._run_tenant(tenant))
+                    self._running[tenant.tenant_id] = task
+                    task.add_done_callback(
+                        lambda _, tid=tenant.tenant_id: self._running.pop(tid, None)
+                    )
+                # A finished sync frees a slot, which wakes this loop.
+                timeout = await asyncio.to_thread(self.registry.seconds_until_due)
+                timeout = self.idle_seconds if timeout is None else min(timeout, self.idle_seconds)
+                if len(self._running) >= self.max_tenants:
+                    timeout = None
+                await asyncio.wait(
+                    [stop_wait, *self._running.values()],
+                    timeout=timeout,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+        finally:
+            stop_wait.cancel()
+            await self._drain()
+        logging.info(
+            f"Worker {self.worker_id} stopped after {self.syncs} tenant syncs "
+            f"({self.lost_leases} lost leases)."
+        )
+
+    def _claim_due_tenants(self, slots, running):
+        """
+        Claim up to `slots` due tenants that are not in `running`. Returns the claimed tenants.
+        """
+        claimed = []
+        for tenant in self.registry.due_tenants():
+            if len(claimed) >= slots:
+                break
+            if tenant.tenant_id in running:
+                continue
+            resource = tenant_resource(tenant.tenant_id)
+            if self.registry.claim(resource, self.worker_id, self.lease_seconds):
+                claimed.append(tenant)
+        return claimed
+
+    async def _run_tenant(self, tenant):
+        resource = tenant_resource(tenant.tenant_id)
+        sync = asyncio.create_task(self.sync_tenant(tenant))
+        lost = False
+        next_sync_at = None
+        error = None
+        try:
+            if not await self._hold_lease(resource, sync):
+                lost = True
+                self.lost_leases += 1
+                logging.error(f"Lost the lease on tenant {tenant.tenant_id}; stopping its sync.")
+                return
+            sync.result()
+            self.syncs += 1
+            logging.info(f"Synced tenant {tenant.tenant_id} on worker {self.worker_id}.")
+        except asyncio.CancelledError:
+            # Shutting down: leave the tenant due, so another worker resumes it right away.
+            next_sync_at = time.time()
+            error = "cancelled at shutdown"
+            raise
+        except Exception as e:
+            logging.error(f"Error syncing tenant {tenant.tenant_id}: {e}")
+            error = str(e)
+        finally:
+            if not sync.done():
+                sync.cancel()
+                await asyncio.gather(sync, return_exceptions=True)
+            # After a lost lease, the new owner records the outcome.
+            if not lost:
+                if next_sync_at is None:
+                    next_sync_at = time.time() + self.interval
+                await asyncio.to_thread(self._finish, tenant, next_sync_at, error)
+
+    def _finish(self, tenant, next_sync_at, error):
+        self.registry.finish_sync(tenant.tenant_id, next_sync_at, error)
+        self.registry.release(tenant_resource(tenant.tenant_id), self.worker_id)
+
+    async def _hold_lease(self, resource, sync):
+        """
+        Renew the lease on `resource` until `sync` is done.
+        Returns False as soon as a renewal fails.
+        """
+        while True:
+            done, _ = await asyncio.wait([sync], timeout=self.lease_seconds / 3)
+            if done:
+                return True
+            renewed = await asyncio.to_thread(
+                self.registry.renew, resource, self.worker_id, self.lease_seconds
+            )
+            if not renewed:
+                return False
+
+    async def _drain(self):
+        running = list(self._running.values())
+        if not running:
+            return
+        _, pending = await asyncio.wait(running, timeout=self.shutdown_timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logging.warning(
+                f"Cancelled {len(pending)} tenant syncs at shutdown; their work queues "
+                "resume them on the next claim."
+            )
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
@@ -0,0 +1,32 @@
+from benchmarks.fake_canvas import FakeCanvasConfig
+from benchmarks.run import describe, run_benchmark
+
+
+def test_benchmark_syncs_fake_canvas_end_to_end():
+    config = FakeCanvasConfig(courses=3, files=250, file_size=512)
+
+    report = run_benchmark(config, ["--concurrency", "4"], runs=2)
+
+    first, second = report["runs"]
+    assert first["files_uploaded"] == 250
+    assert first["files_listed"] == 250
+    assert first["db_operations"]["state_db_write"] > 0
+    # Nothing changed, so the second run only lists down to the high-water marks.
+    assert second["files_uploaded"] == 0
+    assert second["files_listed"] < 250
+    assert "run 2:" in describe(report)
+
+
+def test_graphql_listing_costs_less_canvas_api_budget():
+    config = FakeCanvasConfig(courses=30, files=600, file_size=256)
+
+    rest = run_benchmark(config, ["--concurrency", "4"])
+    graphql = run_benchmark(config, ["--concurrency", "4", "--canvas-listing", "graphql"])
+
+    rest_run, graphql_run = rest["runs"][0], graphql["runs"][0]
+    assert graphql_run["files_uploaded"] == rest_run["files_uploaded"] == 600
+    assert graphql_run["graphql_fallbacks"] == 0
+    # One query for the courses and two for the files of 30 courses, against one
+    # request per course plus the course listing over REST.
+    assert graphql_run["canvas_rate_limiter"]["total_request_cost"] == 3
+    assert rest_run["canvas_rate_limiter"]["total_request_cost"] == 32
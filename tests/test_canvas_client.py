@@ -0,0 +1,316 @@
+import asyncio
+import hashlib
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+import requests
+
+from benchmarks.fake_canvas import FakeCanvasConfig, FakeCanvasServer
+from canvas_client import CanvasClient, DownloadProgress, stream_in_thread
+from canvas_graphql import GraphQLError
+
+# The stand-in server is plain HTTP on localhost.
+pytestmark = pytest.mark.filterwarnings("ignore:Canvas may respond unexpectedly")
+
+BODY = b"lecture notes " * 1000
+
+
+class FlakyFileHandler(BaseHTTPRequestHandler):
+    failures_left = 0
+    requests_seen = 0
+
+    def do_GET(self):
+        type(self).requests_seen += 1
+        if type(self).failures_left > 0:
+            type(self).failures_left -= 1
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def file_server():
+    FlakyFileHandler.failures_left = 0
+    FlakyFileHandler.requests_seen = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyFileHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_download_retries_transient_errors_and_hashes_stream(file_server, tmp_path: Path):
+    FlakyFileHandler.failures_left = 2
+    client = CanvasClient(file_server, "token", backoff_factor=0.01, chunk_size=4096)
+    destination = tmp_path / "files" / "notes.pdf"
+
+    digest = client.download_file(f"{file_server}/files/1", str(destination))
+
+    assert destination.read_bytes() == BODY
+    assert digest == hashlib.sha256(BODY).hexdigest()
+    assert FlakyFileHandler.requests_seen == 3
+
+
+def test_download_gives_up_after_max_retries(file_server, tmp_path: Path):
+    FlakyFileHandler.failures_left = 10
+    client = CanvasClient(file_server, "token", max_retries=1, backoff_factor=0.01)
+    destination = tmp_path / "notes.pdf"
+
+    with pytest.raises(Exception):
+        client.download_file(f"{file_server}/files/1", str(destination))
+    assert not destination.exists()
+
+
+def test_canvasapi_shares_the_pooled_session():
+    client = CanvasClient("https://canvas.test", "token")
+    assert client.canvas._Canvas__requester._session is client.session
+
+
+def test_closing_the_client_closes_its_session(monkeypatch):
+    closed = []
+    with CanvasClient("https://canvas.test", "token") as client:
+        monkeypatch.setattr(client.session, "close", lambda: closed.append(True))
+    assert closed == [True]
+
+
+@pytest.fixture(scope="module")
+def fake_canvas():
+    with FakeCanvasServer(FakeCanvasConfig(courses=3, files=450)) as server:
+        yield server.url
+
+
+def _listing(client, since=None):
+    courses = list(client.iter_active_courses())
+    client.prefetch_course_files([course.id for course in courses])
+    return {
+        course.name: [
+            (f.id, f.filename, f.url, f.size, f.updated_at, f.content_type)
+            for f in client.iter_course_files(course.id, since)
+        ]
+        for course in courses
+    }
+
+
+def test_graphql_listing_matches_rest_in_fewer_requests(fake_canvas):
+    rest = CanvasClient(fake_canvas, "token")
+    graphql = CanvasClient(fake_canvas, "token", listing_backend="graphql", graphql_batch_size=2)
+
+    assert _listing(graphql) == _listing(rest)
+    assert _listing(graphql, since="2024-05-31T23:00:00Z") == _listing(
+        rest, since="2024-05-31T23:00:00Z"
+    )
+    # Per listing: courses in one query, files of 150 per course in pages of 100 two
+    # courses at a time: (c1 c2), (c3 c1'), (c2' c3'). REST needs 8 requests, or 5 when
+    # `since` ends every listing on its first page.
+    assert graphql.rate_limit_metrics()["requests"] == 2 * 4
+    assert rest.rate_limit_metrics()["requests"] == 8 + 5
+    assert graphql.listing_backend == "graphql"
+
+
+def test_graphql_errors_fall_back_to_rest(fake_canvas, monkeypatch):
+    client = CanvasClient(fake_canvas, "token", listing_backend="graphql")
+    expected = _listing(CanvasClient(fake_canvas, "token"))
+
+    def unsupported(query, variables=None):
+        if "filesConnection" in query:
+            raise GraphQLError("Field 'filesConnection' doesn't exist on type 'Course'")
+        return type(client.graphql).query(client.graphql, query, variables)
+
+    monkeypatch.setattr(client.graphql, "query", unsupported)
+
+    assert _listing(client) == expected
+    assert client.listing_backend == "rest"
+    assert client.metrics.snapshot()["counters"]["graphql_fallbacks"] == 1
+
+
+def test_download_bytes_keeps_content_in_memory(file_server):
+    FlakyFileHandler.failures_left = 1
+    client = CanvasClient(file_server, "token", backoff_factor=0.01)
+
+    data, digest = client.download_bytes(f"{file_server}/files/1")
+
+    assert data == BODY
+    assert digest == hashlib.sha256(BODY).hexdigest()
+
+
+def test_stream_in_thread_prefetches_and_stops_early():
+    produced = []
+
+    def numbers():
+        for i in range(1000):
+            produced.append(i)
+            yield i
+
+    async def first_five():
+        seen = []
+        stream = stream_in_thread(numbers, prefetch=10)
+        async for i in stream:
+            seen.append(i)
+            if len(seen) == 5:
+                break
+        await stream.aclose()
+        return seen
+
+    assert asyncio.run(first_five()) == [0, 1, 2, 3, 4]
+    # The producer ran ahead by about the prefetch buffer, not to the end.
+    assert 5 <= len(produced) <= 20
+
+
+def test_stream_in_thread_raises_listing_errors():
+    def broken():
+        yield "a"
+        raise RuntimeError("page 2 failed")
+
+    async def consume():
+        seen = []
+        try:
+            async for item in stream_in_thread(broken):
+                seen.append(item)
+        except RuntimeError as e:
+            return seen, str(e)
+
+    assert asyncio.run(consume()) == (["a"], "page 2 failed")
+
+
+class RangeFileHandler(BaseHTTPRequestHandler):
+    body = BODY
+    etag = '"v1"'
+    cut_after = None
+    # Bytes the server starts a 206 body earlier than the requested range.
+    range_skew = 0
+    ranges_seen: list = []
+
+    def do_GET(self):
+        range_header = self.headers.get("Range")
+        type(self).ranges_seen.append(range_header)
+        start = 0
+        if range_header and self.headers.get("If-Range") == self.etag:
+            start = int(range_header[len("bytes=") :].rstrip("-")) - self.range_skew
+        payload = self.body[start:]
+
+        self.send_response(206 if start else 200)
+        self.send_header("ETag", self.etag)
+        self.send_header("Content-Length", str(len(payload)))
+        if start:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(self.body) - 1}/{len(self.body)}"
+            )
+        self.end_headers()
+        if type(self).cut_after is not None:
+            # Drop the connection mid-body, once.
+            self.wfile.write(payload[: type(self).cut_after])
+            type(self).cut_after = None
+            self.close_connection = True
+            return
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def range_server():
+    RangeFileHandler.body = BODY
+    RangeFileHandler.etag = '"v1"'
+    RangeFileHandler.cut_after = None
+    RangeFileHandler.range_skew = 0
+    RangeFileHandler.ranges_seen = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeFileHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_interrupted_download_resumes_with_range_request(range_server, tmp_path: Path):
+    RangeFileHandler.cut_after = 5000
+    saved = []
+    progress = DownloadProgress(on_progress=lambda p: saved.append(p.bytes_received))
+    destination = tmp_path / "notes.pdf"
+
+    # The first run gives up after the dropped connection and keeps the partial file.
+    client = CanvasClient(range_server, "token", max_retries=0, chunk_size=1000)
+    with pytest.raises(Exception):
+        client.download_file(f"{range_server}/files/1", str(destination), progress)
+    assert destination.stat().st_size == 5000
+    assert progress.etag == '"v1"' and saved[-1] == 5000
+
+    # A later run continues from byte 5000 instead of starting over.
+    resumed = DownloadProgress(progress.bytes_received, progress.etag)
+    digest = client.download_file(f"{range_server}/files/1", str(destination), resumed)
+
+    assert destination.read_bytes() == BODY
+    assert digest == hashlib.sha256(BODY).hexdigest()
+    assert RangeFileHandler.ranges_seen == [None, "bytes=5000-"]
+    assert resumed.bytes_received == len(BODY)
+
+
+def test_each_download_failure_is_retried_by_one_layer(range_server, tmp_path: Path):
+    # A refused connection is retried by the session adapter only.
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        closed_port = sock.getsockname()[1]
+    client = CanvasClient(range_server, "token", max_retries=2, backoff_factor=0.01)
+    with pytest.raises(requests.ConnectionError):
+        client.download_bytes(f"http://127.0.0.1:{closed_port}/files/1")
+    assert client.metrics.snapshot()["counters"].get("download_retries", 0) == 0
+
+    # A connection dropped mid-body is retried by the download itself.
+    RangeFileHandler.cut_after = 5000
+    data, _ = client.download_bytes(f"{range_server}/files/1")
+    assert data == BODY
+    assert client.metrics.snapshot()["counters"]["download_retries"] == 1
+
+
+def test_download_progress_is_saved_in_intervals(range_server, tmp_path: Path):
+    saved = []
+    progress = DownloadProgress(on_progress=lambda p: saved.append(p.bytes_received))
+    client = CanvasClient(range_server, "token", chunk_size=100)
+
+    client.download_file(f"{range_server}/files/1", str(tmp_path / "notes.pdf"), progress)
+
+    # 140 chunks, but only the start and the end are saved.
+    assert saved == [0, len(BODY)]
+
+
+def test_changed_file_restarts_download(range_server, tmp_path: Path):
+    destination = tmp_path / "notes.pdf"
+    destination.write_bytes(BODY[:5000])
+    RangeFileHandler.body = b"new version " * 500
+    RangeFileHandler.etag = '"v2"'
+    client = CanvasClient(range_server, "token")
+
+    digest = client.download_file(
+        f"{range_server}/files/1", str(destination), DownloadProgress(5000, '"v1"')
+    )
+
+    assert destination.read_bytes() == RangeFileHandler.body
+    assert digest == hashlib.sha256(RangeFileHandler.body).hexdigest()
+
+
+def test_mismatched_partial_content_restarts_download(range_server, tmp_path: Path):
+    destination = tmp_path / "notes.pdf"
+    destination.write_bytes(BODY[:5000])
+    RangeFileHandler.range_skew = 1000
+    client = CanvasClient(range_server, "token")
+    progress = DownloadProgress(5000, '"v1"')
+
+    digest = client.download_file(f"{range_server}/files/1", str(destination), progress)
+
+    # The 206 starts at byte 4000, so it is not appended; the full file is fetched instead.
+    assert destination.read_bytes() == BODY
+    assert digest == hashlib.sha256(BODY).hexdigest()
+    assert RangeFileHandler.ranges_seen == ["bytes=5000-", None]
+    assert progress.bytes_received == len(BODY)
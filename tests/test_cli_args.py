@@ -1,3 +1,5 @@
+import pytest
+
 from main import setup_args
 
 
@@ -20,3 +22,25 @@ def test_list_managed_aliases_are_equivalent():
 def test_delete_target_parses_value():
     args = setup_args(["--delete", "1618718"])
     assert args.delete_target == "1618718"
+
+
+def test_concurrency_flags_default_to_serial():
+    args = setup_args([])
+    assert args.concurrency == 1
+    assert args.download_concurrency is None
+
+    args = setup_args(["--concurrency", "8", "--upload-concurrency", "2"])
+    assert args.concurrency == 8
+    assert args.upload_concurrency == 2
+
+
+def test_daemon_flags_parse_poll_bounds():
+    args = setup_args(["--daemon", "--poll-minutes", "10", "--max-poll-minutes", "60"])
+    assert args.daemon is True
+    assert (args.poll_minutes, args.min_poll_minutes, args.max_poll_minutes) == (10, None, 60)
+
+
+def test_http_retries_must_not_be_negative():
+    assert setup_args(["--http-retries", "0"]).http_retries == 0
+    with pytest.raises(SystemExit):
+        setup_args(["--http-retries", "-1"])
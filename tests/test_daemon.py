@@ -0,0 +1,146 @@
+import asyncio
+import random
+from pathlib import Path
+from types import SimpleNamespace
+
+from daemon import PollScheduler, SyncDaemon
+from state_manager import StateManager
+from sync_engine import SyncLimits, SyncSummary
+
+
+class FakeCanvasClient:
+    def get_course(self, course_id):
+        return SimpleNamespace(id=int(course_id), name=f"Course {course_id}")
+
+    def course_metadata(self, course):
+        return {"id": course.id, "name": course.name}
+
+    def course_from_metadata(self, metadata):
+        return SimpleNamespace(**metadata)
+
+    def is_course_active(self, course):
+        return True
+
+
+class FakeEngine:
+    def __init__(self, changes=None, delay=0.0, failures=None, errors=()):
+        self.limits = SyncLimits()
+        self.summary = SyncSummary()
+        self.changes = changes or {}
+        self.failures = failures or {}
+        self.errors = set(errors)
+        self.delay = delay
+        self.polled = []
+
+    async def run(self, targets):
+        for target in targets:
+            self.polled.append(target.course_id)
+            await asyncio.sleep(self.delay)
+            target.synced_files = self.changes.get(target.course_id, 0)
+            target.failed_files = self.failures.get(target.course_id, 0)
+            if target.course_id in self.errors:
+                # Like SyncEngine, which logs course errors instead of raising them.
+                target.error = RuntimeError("listing failed")
+
+
+def test_interval_shrinks_for_active_and_grows_for_dormant_courses():
+    scheduler = PollScheduler(
+        interval=600, min_interval=300, max_interval=3600, jitter=0, rng=random.Random(1)
+    )
+    scheduler.add("1", now=0)
+    scheduler.add("2", now=0)
+    assert scheduler.due(0) == ["1", "2"]
+
+    assert scheduler.record("1", changed=True, now=0) == 300
+    assert scheduler.record("1", changed=True, now=0) == 300
+    for _ in range(10):
+        scheduler.record("2", changed=False, now=0)
+    assert scheduler.interval_of("2") == 3600
+
+    assert scheduler.due(299) == []
+    assert scheduler.due(300) == ["1"]
+    assert scheduler.seconds_until_next(100) == 200
+
+
+def test_jitter_spreads_delays():
+    scheduler = PollScheduler(interval=600, min_interval=60, jitter=0.1, rng=random.Random(7))
+    delays = set()
+    for course_id in range(20):
+        scheduler.add(str(course_id), now=0)
+        delay = scheduler.record(str(course_id), changed=False, now=0)
+        assert 810 <= delay <= 990
+        delays.add(delay)
+    assert len(delays) == 20
+
+
+def test_daemon_polls_managed_courses_until_stopped(tmp_path: Path):
+    sm = StateManager(str(tmp_path / "state.db"))
+    sm.set_course_notebook_id("1", "nb-1", "Course 1")
+    sm.set_course_notebook_id("2", "nb-2", "Course 2")
+    sm.set_course_notebook_id("3", None, "Course 3")
+    engine = FakeEngine(changes={"1": 2})
+    scheduler = PollScheduler(interval=60, min_interval=60, max_interval=600, jitter=0)
+    daemon = SyncDaemon(engine, FakeCanvasClient(), sm, scheduler=scheduler, course_cache_ttl=0)
+
+    async def main():
+        task = asyncio.create_task(daemon.run())
+        await asyncio.sleep(0.05)
+        daemon.stop()
+        await task
+
+    asyncio.run(main())
+
+    # Courses without a notebook are not polled.
+    assert sorted(engine.polled) == ["1", "2"]
+    assert daemon.polls == 2
+    assert scheduler.interval_of("1") == 60
+    assert scheduler.interval_of("2") == 90
+
+
+def test_failing_courses_are_polled_less_often(tmp_path: Path):
+    sm = StateManager(str(tmp_path / "state.db"))
+    sm.set_course_notebook_id("1", "nb-1", "Course 1")
+    sm.set_course_notebook_id("2", "nb-2", "Course 2")
+    engine = FakeEngine(failures={"1": 3}, errors={"2"})
+    scheduler = PollScheduler(interval=60, min_interval=30, max_interval=600, jitter=0)
+    daemon = SyncDaemon(engine, FakeCanvasClient(), sm, scheduler=scheduler, course_cache_ttl=0)
+
+    async def main():
+        task = asyncio.create_task(daemon.run())
+        await asyncio.sleep(0.05)
+        daemon.stop()
+        await task
+
+    asyncio.run(main())
+
+    # Files that failed again are no activity, and a failed course backs off.
+    assert scheduler.interval_of("1") == 90
+    assert scheduler.interval_of("2") == 90
+    assert daemon.polls == 1
+
+
+def test_stop_waits_for_in_flight_polls_then_cancels(tmp_path: Path):
+    sm = StateManager(str(tmp_path / "state.db"))
+    sm.set_course_notebook_id("1", "nb-1", "Course 1")
+    engine = FakeEngine(delay=10)
+    daemon = SyncDaemon(engine, FakeCanvasClient(), sm, course_cache_ttl=0, shutdown_timeout=0.05)
+
+    async def main():
+        task = asyncio.create_task(daemon.run())
+        await asyncio.sleep(0.02)
+        daemon.stop()
+        await asyncio.wait_for(task, timeout=1)
+
+    asyncio.run(main())
+
+    assert engine.polled == ["1"]
+    assert daemon.polls == 0
+
+
+def test_running_course_does_not_make_next_poll_due():
+    scheduler = PollScheduler(interval=600, min_interval=60, jitter=0)
+    scheduler.add("1", now=0)
+    scheduler.add("2", now=0)
+    scheduler.record("2", changed=False, now=0)
+    assert scheduler.seconds_until_next(10, exclude={"1"}) == 890
+    assert scheduler.seconds_until_next(10, exclude={"1", "2"}) is None
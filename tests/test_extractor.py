@@ -0,0 +1,89 @@
+import asyncio
+import io
+import os
+import zipfile
+from pathlib import Path
+from types import SimpleNamespace
+
+from extractor import TextExtractor, extract_text
+from main import build_extractor, setup_args
+
+WORD = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+DRAWING = "http://schemas.openxmlformats.org/drawingml/2006/main"
+
+
+def _ooxml(parts, padding=0):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, xml in parts.items():
+            archive.writestr(name, xml)
+        if padding:
+            # Stands in for embedded images, which make up most of a real deck's size.
+            archive.writestr("ppt/media/image1.png", os.urandom(padding))
+    return buffer.getvalue()
+
+
+def _docx(*paragraphs):
+    body = "".join(f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>" for text in paragraphs)
+    return _ooxml(
+        {"word/document.xml": f'<w:document xmlns:w="{WORD}"><w:body>{body}</w:body></w:document>'}
+    )
+
+
+def _slide(*paragraphs):
+    body = "".join(f"<a:p><a:r><a:t>{text}</a:t></a:r></a:p>" for text in paragraphs)
+    return f'<p:sld xmlns:p="urn:p" xmlns:a="{DRAWING}"><a:txBody>{body}</a:txBody></p:sld>'
+
+
+def _pptx(padding=0):
+    return _ooxml(
+        {
+            "ppt/slides/slide10.xml": _slide("Summary"),
+            "ppt/slides/slide2.xml": _slide("Sorting", "Merge sort is O(n log n)"),
+            "ppt/notesSlides/notesSlide2.xml": _slide("Mention stability", "2"),
+        },
+        padding,
+    )
+
+
+def test_docx_paragraphs_are_extracted():
+    assert extract_text("essay.DOCX", _docx("Intro", "", "Conclusion")) == b"Intro\n\nConclusion"
+
+
+def test_pptx_slides_are_extracted_in_order_with_notes(tmp_path: Path):
+    path = tmp_path / "deck.pptx"
+    path.write_bytes(_pptx())
+
+    assert extract_text("deck.pptx", path=str(path)).decode() == (
+        "## Slide 2\n\nSorting\n\nMerge sort is O(n log n)\n\nNotes: Mention stability"
+        "\n\n## Slide 10\n\nSummary"
+    )
+
+
+def test_other_formats_and_empty_documents_are_not_extracted():
+    assert extract_text("notes.txt", b"plain text") is None
+    assert extract_text("blank.docx", _docx()) is None
+
+
+def test_extraction_runs_in_worker_processes_and_must_shrink_the_file():
+    data = _pptx(padding=50_000)
+    extractor = TextExtractor(workers=1, min_bytes=1000)
+    job = SimpleNamespace(file_name="deck.pptx", size=len(data), data=data, local_path=None)
+    small = SimpleNamespace(file_name="deck.pptx", size=10, data=data, local_path=None)
+
+    try:
+        assert extractor.accepts(job) and not extractor.accepts(small)
+        assert asyncio.run(extractor.extract(job)).startswith(b"## Slide 2")
+        # Text that is not smaller than the original is not worth uploading instead.
+        small.size = 20
+        assert asyncio.run(extractor.extract(small)) is None
+    finally:
+        extractor.shutdown()
+
+
+def test_extraction_is_off_by_default():
+    assert build_extractor(setup_args([])) is None
+    extractor = build_extractor(
+        setup_args(["--extract-text", "--extract-workers", "2", "--extract-min-kb", "0"])
+    )
+    assert (extractor.workers, extractor.min_bytes) == (2, 0)
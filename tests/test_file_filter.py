@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+from file_filter import FileFilter
+from main import setup_args
+
+
+def _file(name, content_type=None, size=1, folder_id=1, updated_at="2024-05-01T00:00:00Z"):
+    return SimpleNamespace(
+        filename=name,
+        content_type=content_type,
+        size=size,
+        folder_id=folder_id,
+        updated_at=updated_at,
+    )
+
+
+def test_media_is_skipped_by_default():
+    file_filter = FileFilter()
+    assert file_filter.rejection(_file("Lecture.MP4")) == "excluded extension .mp4"
+    assert file_filter.rejection(_file("clip", content_type="video/quicktime")) is not None
+    assert file_filter.rejection(_file("notes.pdf", content_type="application/pdf")) is None
+    assert file_filter.api_params() == {"exclude_content_types": ["audio", "video"]}
+
+
+def test_include_rules_and_size_limits():
+    file_filter = FileFilter(
+        include_extensions=["pdf", ".docx"],
+        include_content_types=["application"],
+        max_size=100,
+    )
+    assert file_filter.rejection(_file("a.pdf", content_type="application/pdf")) is None
+    assert file_filter.rejection(_file("a.png", content_type="image/png")) is not None
+    assert file_filter.rejection(_file("b.docx", content_type="text/plain")) is not None
+    assert file_filter.rejection(_file("big.pdf", size=101)) == "larger than 100 bytes"
+    assert file_filter.api_params()["content_types"] == ["application"]
+
+
+def test_folder_rules_resolve_to_folder_ids():
+    file_filter = FileFilter(include_folders=["Lectures"], exclude_folders=["lectures/old"])
+    skipped = file_filter.skipped_folder_ids(
+        {
+            1: "course files",
+            2: "course files/Lectures",
+            3: "course files/Lectures/Week 1",
+            4: "course files/Lectures/Old",
+            5: "course files/Lectures Extra",
+        }
+    )
+    assert skipped == {1, 4, 5}
+    assert file_filter.rejection(_file("a.pdf", folder_id=4), skipped) == "excluded folder"
+    assert file_filter.rejection(_file("a.pdf", folder_id=3), skipped) is None
+
+
+def test_date_window():
+    file_filter = FileFilter(updated_after="2024-02-01", updated_before="2024-06-01")
+    assert file_filter.rejection(_file("a.pdf", updated_at="2024-01-15T00:00:00Z")) is not None
+    assert file_filter.rejection(_file("a.pdf", updated_at="2024-03-01T00:00:00Z")) is None
+    assert file_filter.rejection(_file("a.pdf", updated_at="2024-07-01T00:00:00Z")) is not None
+
+
+def test_signature_changes_with_the_rules():
+    assert FileFilter().signature() == FileFilter().signature()
+    assert FileFilter(include_extensions=["pdf"]).signature() != FileFilter().signature()
+    assert FileFilter(updated_before="2024-06-01").signature() != FileFilter().signature()
+
+
+def test_filter_from_cli_args():
+    args = setup_args(
+        ["--exclude-extensions", "zip,.RAR", "--exclude-extensions", "iso", "--max-size-mb", "2"]
+    )
+    file_filter = FileFilter.from_args(args)
+    assert {".zip", ".rar", ".iso", ".mp4"} <= file_filter.exclude_extensions
+    assert file_filter.max_size == 2 * 1024 * 1024
+
+    media = FileFilter.from_args(setup_args(["--include-media"]))
+    assert media.rejection(_file("talk.mp4", content_type="video/mp4")) is None
+    assert media.api_params() == {}
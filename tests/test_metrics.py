@@ -0,0 +1,68 @@
+import json
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+from metrics import Metrics, MetricsReporter, to_prometheus
+
+
+def test_timer_counts_calls_errors_and_bytes():
+    metrics = Metrics()
+    with metrics.time("download", nbytes=100):
+        pass
+    with pytest.raises(RuntimeError):
+        with metrics.time("download"):
+            raise RuntimeError("boom")
+    metrics.add_bytes("download", 50)
+
+    stats = metrics.snapshot()["stages"]["download"]
+    assert (stats["calls"], stats["errors"], stats["bytes"]) == (2, 1, 150)
+    assert stats["seconds"] >= stats["max_seconds"] >= 0
+
+
+def test_timed_iter_records_one_call_and_counts_items():
+    metrics = Metrics()
+    for _ in metrics.timed_iter("file_listing", range(3)):
+        pass
+
+    snapshot = metrics.snapshot()
+    assert snapshot["stages"]["file_listing"]["calls"] == 1
+    assert snapshot["counters"]["file_listing_items"] == 3
+
+
+def test_prometheus_rendering():
+    metrics = Metrics()
+    metrics.record("upload", 1.5, nbytes=10)
+    reporter = MetricsReporter(metrics)
+    reporter.add_section("summary", lambda: {"uploaded": 2, "failed": 0})
+    reporter.add_section("canvas_rate_limiter", lambda: {"rate_limit_remaining": None})
+
+    text = to_prometheus(reporter.report())
+
+    assert 'canvas_sync_stage_seconds_total{stage="upload"} 1.5' in text
+    assert 'canvas_sync_stage_bytes_total{stage="upload"} 10' in text
+    assert "canvas_sync_summary_uploaded 2" in text
+    assert "rate_limit_remaining" not in text
+
+
+def test_reporter_writes_files_and_serves_http(tmp_path: Path):
+    metrics = Metrics()
+    metrics.record("course_sync", 2.0)
+    reporter = MetricsReporter(
+        metrics, json_path=tmp_path / "report.json", textfile_path=tmp_path / "sync.prom"
+    )
+    reporter.write()
+
+    report = json.loads((tmp_path / "report.json").read_text())
+    assert report["stages"]["course_sync"]["calls"] == 1
+    assert "canvas_sync_stage_calls_total" in (tmp_path / "sync.prom").read_text()
+    # Readable by a node_exporter running as another user.
+    assert (tmp_path / "sync.prom").stat().st_mode & 0o777 == 0o644
+
+    port = reporter.serve(0, host="127.0.0.1")
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert b'stage="course_sync"' in response.read()
+    finally:
+        reporter.close()
@@ -0,0 +1,145 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+import notebook_client
+from notebook_client import SOURCE_FAILED, SOURCE_READY, NotebookLMClientWrapper
+
+
+class FakeLibraryClient:
+    def __init__(self, drop_next_call=None):
+        self.is_connected = False
+        self.opens = 0
+        # An error the next call fails with, as if the connection dropped.
+        self.drop_next_call = drop_next_call
+        self.created = []
+        self.notebooks = SimpleNamespace(create=self._create)
+        self.sources = SimpleNamespace(add_file=self._add_file, list=self._list_sources)
+        self.source_statuses = {}
+        self.listings = 0
+
+    async def __aenter__(self):
+        self.opens += 1
+        self.is_connected = True
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.is_connected = False
+
+    async def refresh_auth(self):
+        pass
+
+    async def _create(self, title):
+        if self.drop_next_call:
+            error, self.drop_next_call = self.drop_next_call, None
+            raise error
+        self.created.append(title)
+        return SimpleNamespace(id=f"nb-{len(self.created)}")
+
+    async def _add_file(self, notebook_id, file_path):
+        if file_path.endswith(".bad"):
+            raise RuntimeError("upload rejected")
+        source_id = f"src-{len(self.source_statuses) + 1}"
+        self.source_statuses[source_id] = "error" if "broken" in file_path else "ready"
+        return SimpleNamespace(id=source_id)
+
+    async def _list_sources(self, notebook_id):
+        self.listings += 1
+        return [
+            SimpleNamespace(id=source_id, is_ready=status == "ready", is_error=status == "error")
+            for source_id, status in self.source_statuses.items()
+        ]
+
+
+def _wrapper(monkeypatch, library_client, storage_path=None):
+    async def from_storage(path=None):
+        library_client.storage_path = path
+        return library_client
+
+    monkeypatch.setattr(notebook_client.NotebookLMClient, "from_storage", from_storage)
+    return NotebookLMClientWrapper(auth_refresh_interval=0, storage_path=storage_path)
+
+
+def test_session_is_opened_once_and_reused(monkeypatch):
+    library_client = FakeLibraryClient()
+    wrapper = _wrapper(monkeypatch, library_client)
+
+    async def scenario():
+        async with wrapper:
+            for i in range(5):
+                await wrapper.create_notebook(f"Course {i}")
+        assert library_client.is_connected is False
+
+    asyncio.run(scenario())
+
+    assert library_client.opens == 1
+    metrics = wrapper.session_metrics()
+    assert metrics["calls"] == 5
+    assert metrics["reused_calls"] == 4
+
+
+def test_dropped_session_reconnects_transparently(monkeypatch):
+    library_client = FakeLibraryClient(drop_next_call=httpx.ConnectError("Connection refused"))
+    wrapper = _wrapper(monkeypatch, library_client)
+
+    async def scenario():
+        async with wrapper:
+            return await wrapper.create_notebook("Physics")
+
+    assert asyncio.run(scenario()) == "nb-1"
+    assert library_client.opens == 2
+    assert wrapper.session_metrics()["reconnects"] == 1
+
+
+def test_create_is_not_repeated_after_the_request_was_sent(monkeypatch):
+    library_client = FakeLibraryClient(drop_next_call=httpx.ReadTimeout("timed out"))
+    wrapper = _wrapper(monkeypatch, library_client)
+
+    async def scenario():
+        async with wrapper:
+            with pytest.raises(httpx.ReadTimeout):
+                await wrapper.create_notebook("Physics")
+            # The session was reopened for the calls that follow.
+            return await wrapper.create_notebook("Chemistry")
+
+    assert asyncio.run(scenario()) == "nb-1"
+    assert library_client.created == ["Chemistry"]
+    assert library_client.opens == 2
+
+
+def test_batch_upload_reports_each_file(monkeypatch):
+    library_client = FakeLibraryClient()
+    wrapper = _wrapper(monkeypatch, library_client)
+    paths = ["a.pdf", "broken.pdf", "c.bad", "d.pdf"]
+
+    async def scenario():
+        async with wrapper:
+            return await wrapper.upload_sources("nb-1", paths)
+
+    results = asyncio.run(scenario())
+
+    assert [result.file_path for result in results] == paths
+    assert [result.state for result in results] == [
+        SOURCE_READY,
+        SOURCE_FAILED,
+        SOURCE_FAILED,
+        SOURCE_READY,
+    ]
+    assert results[2].source_id is None
+    # All three uploaded sources were checked with a single notebook listing.
+    assert library_client.listings == 1
+
+
+def test_login_state_is_loaded_from_the_storage_path(monkeypatch):
+    library_client = FakeLibraryClient()
+    wrapper = _wrapper(monkeypatch, library_client, storage_path="alice/storage_state.json")
+
+    async def scenario():
+        async with wrapper:
+            await wrapper.create_notebook("Course")
+
+    asyncio.run(scenario())
+
+    assert library_client.storage_path == "alice/storage_state.json"
@@ -0,0 +1,60 @@
+import threading
+from types import SimpleNamespace
+
+from rate_limiter import AdaptiveConcurrencyLimiter
+
+
+def _response(status=200, remaining=None, cost=None, text=""):
+    headers = {}
+    if remaining is not None:
+        headers["X-Rate-Limit-Remaining"] = str(remaining)
+    if cost is not None:
+        headers["X-Request-Cost"] = str(cost)
+    return SimpleNamespace(status_code=status, headers=headers, text=text)
+
+
+def test_limit_grows_while_bucket_is_full():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=4)
+    for _ in range(50):
+        limiter.observe(_response(remaining=700, cost=0.5))
+
+    metrics = limiter.snapshot()
+    assert metrics["limit"] == 4
+    assert metrics["rate_limit_remaining"] == 700
+    assert metrics["last_request_cost"] == 0.5
+    assert metrics["requests"] == 50
+
+
+def test_limit_halves_on_low_bucket_and_throttling():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=8, max_limit=16, cooldown=0)
+    limiter.observe(_response(remaining=50))
+    assert limiter.snapshot()["limit"] == 4
+
+    throttled = limiter.observe(_response(status=403, text="403 Forbidden (Rate Limit Exceeded)"))
+    assert throttled is True
+    metrics = limiter.snapshot()
+    assert metrics["limit"] == 2
+    assert metrics["throttled"] == 1
+
+
+def test_plain_forbidden_is_not_throttling():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=4)
+    assert limiter.observe(_response(status=403, remaining=600, text="unauthorized")) is False
+    assert limiter.snapshot()["limit"] == 4
+
+
+def test_acquire_blocks_at_the_limit():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1, max_limit=1)
+    limiter.acquire()
+    acquired = threading.Event()
+
+    def second_request():
+        limiter.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=second_request)
+    thread.start()
+    assert not acquired.wait(0.05)
+    limiter.release()
+    assert acquired.wait(1)
+    thread.join()
@@ -0,0 +1,61 @@
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ("canvasapi", "notebooklm", "playwright", "requests", "httpx")
+# `import main` took about a second while it loaded the client libraries and ~0.1s after.
+IMPORT_BUDGET_SECONDS = 0.5
+
+
+def _run_python(code, cwd, *options):
+    env = dict(os.environ, PYTHONPATH=str(REPO_ROOT), CANVAS_KEY="")
+    return subprocess.run(
+        [sys.executable, *options, "-c", code],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+        timeout=60,
+    )
+
+
+def _loaded_heavy_modules(output):
+    return [name for name in output.split() if name in HEAVY_MODULES]
+
+
+def test_import_main_skips_client_libraries_and_side_effects(tmp_path: Path):
+    result = _run_python(
+        f"import sys, main; print(*[m for m in {HEAVY_MODULES!r} if m in sys.modules])",
+        tmp_path,
+    )
+    assert _loaded_heavy_modules(result.stdout) == []
+    # Logging is configured by cli(), not as an import side effect.
+    assert not (tmp_path / "canvas_sync.log").exists()
+
+
+def test_list_managed_courses_does_not_load_client_libraries(tmp_path: Path):
+    result = _run_python(
+        "import sys, main\n"
+        "sys.argv = ['canvas-to-notebooklm', '--list-managed-courses']\n"
+        "main.cli()\n"
+        f"print(*[m for m in {HEAVY_MODULES!r} if m in sys.modules])",
+        tmp_path,
+    )
+    assert "No managed courses found" in result.stdout
+    assert _loaded_heavy_modules(result.stdout.splitlines()[-1]) == []
+    assert (tmp_path / "canvas_sync.log").exists()
+
+
+def test_import_time_budget(tmp_path: Path):
+    result = _run_python("import main", tmp_path, "-X", "importtime")
+    # Lines look like "import time: self [us] | cumulative | name".
+    cumulative = next(
+        int(match.group(1))
+        for line in result.stderr.splitlines()
+        if (match := re.match(r"import time:\s+\d+ \|\s+(\d+) \| main$", line))
+    )
+    assert cumulative / 1e6 < IMPORT_BUDGET_SECONDS
@@ -1,3 +1,6 @@
+import sqlite3
+import threading
+import time
 from pathlib import Path
 
 from state_manager import StateManager
@@ -36,3 +39,131 @@ def test_delete_course_removes_related_files(tmp_path: Path):
     assert sm.delete_course("course-1") is True
     assert sm.get_course_notebook_id("course-1") is None
     assert sm.is_file_processed("file-1") is False
+
+
+def test_batched_writes_are_visible_and_committed_on_close(tmp_path: Path):
+    db_path = tmp_path / "state_test.db"
+
+    with StateManager(str(db_path), flush_interval=60) as sm:
+        sm.mark_file_processed("file-1", "course-1", "lecture1.pdf")
+        # Same manager sees its own pending writes before they are committed.
+        assert sm.is_file_processed("file-1") is True
+
+        conn = sqlite3.connect(db_path)
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("SELECT COUNT(*) FROM files").fetchone()[0] == 0
+        conn.close()
+
+    with StateManager(str(db_path)) as reopened:
+        assert reopened.is_file_processed("file-1") is True
+
+
+def test_concurrent_writers_share_one_connection(tmp_path: Path):
+    db_path = tmp_path / "state_test.db"
+
+    with StateManager(str(db_path), flush_interval=0.01, max_pending_writes=7) as sm:
+
+        def mark_range(start):
+            for i in range(start, start + 50):
+                sm.mark_file_processed(f"file-{i}", "course-1", f"{i}.pdf")
+
+        threads = [threading.Thread(target=mark_range, args=(n * 50,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    with StateManager(str(db_path)) as reopened:
+        assert all(reopened.is_file_processed(f"file-{i}") for i in range(200))
+
+
+def test_processed_file_versions_are_loaded_per_course(tmp_path: Path):
+    with StateManager(str(tmp_path / "state_test.db")) as sm:
+        sm.mark_file_processed("file-1", "course-1", "a.pdf", "2024-01-01T00:00:00Z", 10)
+        sm.mark_file_processed("file-2", "course-1", "b.pdf", source_id="src-2", notebook_id="nb")
+        sm.mark_file_processed("file-3", "course-2", "c.pdf")
+
+        assert sm.get_processed_file_versions("course-1") == {
+            "file-1": ("2024-01-01T00:00:00Z", 10, None, None),
+            "file-2": (None, None, "src-2", "nb"),
+        }
+        assert sm.get_processed_file_versions("course-3") == {}
+
+
+def test_course_metadata_cache_expires(tmp_path: Path, monkeypatch):
+    with StateManager(str(tmp_path / "state_test.db")) as sm:
+        sm.set_course_notebook_id("course-1", "nb-1", "Physics")
+        assert sm.get_cached_course_metadata("course-1", 3600) is None
+
+        sm.set_cached_course_metadata("course-1", {"id": 1, "name": "Physics"})
+        assert sm.get_cached_course_metadata("course-1", 3600) == {"id": 1, "name": "Physics"}
+
+        now = time.time()
+        monkeypatch.setattr(time, "time", lambda: now + 7200)
+        assert sm.get_cached_course_metadata("course-1", 3600) is None
+
+
+def test_failed_job_backs_off_exponentially_until_given_up(tmp_path: Path, monkeypatch):
+    with StateManager(str(tmp_path / "state_test.db")) as sm:
+        now = 1_000_000.0
+        monkeypatch.setattr(time, "time", lambda: now)
+        assert sm.queue_file_job("file-1", "course-1", "a.pdf", "https://x/1", size=10)
+
+        assert sm.fail_file_job("file-1", None, 10, "boom", max_attempts=3, backoff=60) == now + 60
+        assert sm.fail_file_job("file-1", None, 10, "boom", max_attempts=3, backoff=60) == now + 120
+        assert sm.fail_file_job("file-1", None, 10, "boom", max_attempts=3, backoff=60) is None
+        assert sm.get_file_job("file-1") == ("failed", 3, None, "boom")
+
+        # Given up: the same version is not claimed again, but a new version is.
+        assert not sm.queue_file_job("file-1", "course-1", "a.pdf", "https://x/1", size=10)
+        assert sm.claim_due_jobs("course-1") == []
+        assert sm.queue_file_job("file-1", "course-1", "a.pdf", "https://x/1", size=11)
+        assert sm.get_file_job("file-1")[:2] == ("downloading", 0)
+
+
+def test_saving_an_unchanged_bundle_keeps_its_title(tmp_path: Path):
+    db_path = str(tmp_path / "state.db")
+    members = [("10", "a.txt", "2024-01-01T00:00:00Z", b"a")]
+    with StateManager(db_path) as sm:
+        sm.save_bundle("1/5/1", "1", "5", 1, "Week 1.md", "src-1", "nb-1", "h1", members)
+        sm.save_bundle("1/5/1", "1", "5", 1, None, "src-1", "nb-1", "h1", members)
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT title FROM bundles").fetchall() == [("Week 1.md",)]
+    conn.close()
+
+
+def test_close_checkpoints_the_wal_into_the_database_file(tmp_path: Path):
+    db_path = tmp_path / "state.db"
+    reader = None
+    with StateManager(str(db_path)) as sm:
+        sm.set_course_notebook_id("1", "nb-1", "Physics")
+        # A second connection keeps SQLite from removing the WAL on close by itself.
+        reader = sqlite3.connect(db_path)
+        reader.execute("SELECT count(*) FROM sqlite_master").fetchall()
+
+    wal = Path(f"{db_path}-wal")
+    assert not wal.exists() or wal.stat().st_size == 0
+    # The database file alone has the data, as a copy without the WAL would.
+    copy = tmp_path / "copy.db"
+    copy.write_bytes(db_path.read_bytes())
+    conn = sqlite3.connect(copy)
+    assert conn.execute("SELECT notebook_lm_id FROM courses").fetchall() == [("nb-1",)]
+    conn.close()
+    reader.close()
+
+
+def test_source_lookups_use_an_index(tmp_path: Path):
+    db_path = tmp_path / "state.db"
+    with StateManager(str(db_path)) as sm:
+        sm.mark_file_processed("file-1", "course-1", "a.pdf", source_id="src-1")
+        assert sm.is_source_shared("src-1") is True
+        assert sm.is_source_shared("src-1", file_id="file-1") is False
+
+    conn = sqlite3.connect(db_path)
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT 1 FROM files WHERE source_id = ? AND file_id != ? LIMIT 1",
+        ("src-1", "file-1"),
+    ).fetchall()
+    conn.close()
+    assert "idx_files_source" in " ".join(row[-1] for row in plan)
@@ -0,0 +1,854 @@
+import asyncio
+import hashlib
+import os
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from bundler import SmallFileBundler
+from canvas_client import stream_in_thread
+from file_filter import FileFilter
+from state_manager import StateManager
+from sync_engine import ByteBudget, CourseTarget, SyncEngine, SyncLimits, resolve_courses
+
+
+class FakeCanvasClient:
+    def __init__(self, files_by_course, fail_downloads=(), contents=None, fail_listing_after=None):
+        self.files_by_course = files_by_course
+        self.fail_downloads = set(fail_downloads)
+        self.contents = contents or {}
+        self.fail_listing_after = fail_listing_after
+        self.listed_since = []
+
+    def iter_course_files(self, course_id, since=None):
+        self.listed_since.append(since)
+        files = self.files_by_course[course_id]
+        for i, f in enumerate(f for f in files if since is None or f.updated_at >= since):
+            if i == self.fail_listing_after:
+                raise RuntimeError("listing failed")
+            yield f
+
+    def stream_course_files(self, course_id, since=None, params=None):
+        self.listing_params = params
+        return stream_in_thread(lambda: self.iter_course_files(course_id, since), prefetch=2)
+
+    def download_file(self, file_url, destination_path, progress=None):
+        if file_url in self.fail_downloads:
+            raise RuntimeError(f"download failed: {file_url}")
+        content = self.contents.get(file_url, file_url.encode())
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+        with open(destination_path, "wb") as f:
+            f.write(content)
+        return hashlib.sha256(content).hexdigest()
+
+    def download_bytes(self, file_url):
+        if file_url in self.fail_downloads:
+            raise RuntimeError(f"download failed: {file_url}")
+        content = self.contents.get(file_url, file_url.encode())
+        return content, hashlib.sha256(content).hexdigest()
+
+
+class FakeNotebookClient:
+    def __init__(self, fail_uploads=(), fail_processing=()):
+        self.fail_uploads = set(fail_uploads)
+        self.fail_processing = set(fail_processing)
+        self.uploaded = []
+        self.polls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.processed = []
+        self.deleted = []
+        self.uploaded_from_memory = []
+        self.uploaded_data = {}
+        self.created = []
+
+    async def create_notebook(self, title):
+        self.created.append(title)
+        return f"nb-new-{len(self.created)}"
+
+    async def add_source(self, notebook_id, file_path):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            assert os.path.exists(file_path)
+            if os.path.basename(file_path) in self.fail_uploads:
+                raise RuntimeError("upload failed")
+            self.uploaded.append((notebook_id, os.path.basename(file_path)))
+            return f"src-{len(self.uploaded)}"
+        finally:
+            self.in_flight -= 1
+
+    async def add_source_bytes(self, notebook_id, file_name, data, temp_dir=None):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if file_name in self.fail_uploads:
+                raise RuntimeError("upload failed")
+            self.uploaded.append((notebook_id, file_name))
+            self.uploaded_from_memory.append(file_name)
+            self.uploaded_data[file_name] = data
+            return f"src-{len(self.uploaded)}"
+        finally:
+            self.in_flight -= 1
+
+    async def get_source_states(self, notebook_id):
+        await asyncio.sleep(0.01)
+        self.polls += 1
+        states = {}
+        for i, (nb, name) in enumerate(self.uploaded, start=1):
+            if nb != notebook_id:
+                continue
+            source_id = f"src-{i}"
+            states[source_id] = "failed" if name in self.fail_processing else "ready"
+            if source_id not in self.processed:
+                self.processed.append(source_id)
+        return states
+
+    async def delete_source(self, notebook_id, source_id):
+        self.deleted.append((notebook_id, source_id))
+
+
+def _file(file_id, name, size=1, updated_at="2024-01-01T00:00:00Z"):
+    return SimpleNamespace(
+        id=file_id,
+        filename=name,
+        url=f"https://canvas.test/files/{file_id}",
+        size=size,
+        updated_at=updated_at,
+    )
+
+
+def _target(course_id):
+    return CourseTarget(SimpleNamespace(id=course_id), f"Course {course_id}", f"nb-{course_id}")
+
+
+def test_limits_fall_back_to_concurrency():
+    args = SimpleNamespace(
+        concurrency=4, listing_concurrency=None, download_concurrency=2, upload_concurrency=None
+    )
+    limits = SyncLimits.from_args(args)
+    assert (limits.courses, limits.listing, limits.downloads, limits.uploads) == (4, 4, 2, 4)
+
+
+def test_engine_marks_only_uploaded_files_and_cleans_up(tmp_path: Path):
+    files = {
+        1: [_file(10, "a.pdf"), _file(11, "b.pdf"), _file(12, "talk.mp4")],
+        2: [_file(20, "c.pdf"), _file(21, "d.pdf")],
+    }
+    canvas = FakeCanvasClient(files, fail_downloads={"https://canvas.test/files/21"})
+    notebook = FakeNotebookClient(fail_uploads={"b.pdf"})
+    sm = StateManager(str(tmp_path / "state.db"))
+    download_root = tmp_path / "downloads"
+
+    engine = SyncEngine(
+        canvas, sm, notebook, limits=SyncLimits(courses=2, uploads=2), temp_dir=download_root
+    )
+    asyncio.run(engine.run([_target(1), _target(2)]))
+
+    assert sorted(notebook.uploaded) == [("nb-1", "a.pdf"), ("nb-2", "c.pdf")]
+    assert sm.is_file_processed("10") is True
+    assert sm.is_file_processed("11") is False
+    assert sm.is_file_processed("12") is False
+    assert sm.is_file_processed("20") is True
+    assert sm.is_file_processed("21") is False
+    assert not any(p.is_file() for p in download_root.rglob("*"))
+
+
+def test_engine_respects_upload_limit(tmp_path: Path):
+    files = {course: [_file(course * 100 + i, f"{i}.pdf") for i in range(6)] for course in (1, 2)}
+    notebook = FakeNotebookClient()
+    sm = StateManager(str(tmp_path / "state.db"))
+
+    engine = SyncEngine(
+        FakeCanvasClient(files),
+        sm,
+        notebook,
+        limits=SyncLimits(courses=2, downloads=4, uploads=3),
+        temp_dir=tmp_path / "downloads",
+    )
+    asyncio.run(engine.run([_target(1), _target(2)]))
+
+    assert len(notebook.uploaded) == 12
+    assert notebook.max_in_flight <= 3
+
+
+def test_byte_budget_blocks_until_released():
+    async def scenario():
+        budget = ByteBudget(10)
+        await budget.acquire(6)
+        waiter = asyncio.create_task(budget.acquire(6))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        await budget.release(6)
+        await asyncio.wait_for(waiter, timeout=1)
+        assert budget.used == 6
+
+    asyncio.run(scenario())
+
+
+def test_pipeline_keeps_temp_disk_within_budget(tmp_path: Path):
+    download_root = tmp_path / "downloads"
+    peak = {"bytes": 0}
+
+    class MeasuringCanvasClient(FakeCanvasClient):
+        def download_file(self, file_url, destination_path, progress=None):
+            super().download_file(file_url, destination_path, progress)
+            on_disk = sum(p.stat().st_size for p in download_root.rglob("*") if p.is_file())
+            peak["bytes"] = max(peak["bytes"], on_disk)
+
+    files = {1: [_file(i, f"{i}.pdf", size=30) for i in range(10)]}
+    notebook = FakeNotebookClient()
+    engine = SyncEngine(
+        MeasuringCanvasClient(files),
+        StateManager(str(tmp_path / "state.db")),
+        notebook,
+        limits=SyncLimits(
+            downloads=4, uploads=1, queue_depth=2, temp_disk_bytes=100, memory_threshold_bytes=0
+        ),
+        temp_dir=download_root,
+    )
+    asyncio.run(engine.run([_target(1)]))
+
+    assert len(notebook.processed) == 10
+    assert peak["bytes"] <= 100
+
+
+def test_changed_file_replaces_stale_source(tmp_path: Path):
+    files = {1: [_file(10, "a.pdf", updated_at="2024-01-01T00:00:00Z")]}
+    canvas = FakeCanvasClient(files)
+    notebook = FakeNotebookClient()
+    sm = StateManager(str(tmp_path / "state.db"))
+    sm.set_course_notebook_id("1", "nb-1", "Course 1")
+
+    def run():
+        engine = SyncEngine(canvas, sm, notebook, temp_dir=tmp_path / "downloads")
+        asyncio.run(engine.run([_target(1)]))
+
+    run()
+    assert sm.get_course_high_water_mark("1") == "2024-01-01T00:00:00Z"
+
+    # Unchanged: listed from the high-water mark and skipped.
+    run()
+    assert canvas.listed_since[-1] == "2024-01-01T00:00:00Z"
+    assert len(notebook.uploaded) == 1
+
+    files[1] = [_file(10, "a.pdf", size=2, updated_at="2024-02-01T00:00:00Z")]
+    canvas.contents["https://canvas.test/files/10"] = b"v2"
+    run()
+    assert len(notebook.uploaded) == 2
+    assert notebook.deleted == [("nb-1", "src-1")]
+    assert sm.get_processed_file_versions("1")["10"][:2] == ("2024-02-01T00:00:00Z", 2)
+    assert sm.get_course_high_water_mark("1") == "2024-02-01T00:00:00Z"
+
+
+def test_high_water_mark_of_a_filtered_run_does_not_hide_skipped_files(tmp_path: Path):
+    files = {
+        1: [
+            _file(10, "new.pdf", updated_at="2025-01-01T00:00:00Z"),
+            _file(11, "mid.docx", updated_at="2024-06-01T00:00:00Z"),
+        ]
+    }
+    canvas = FakeCanvasClient(files)
+    notebook = FakeNotebookClient()
+    sm = StateManager(str(tmp_path / "state.db"))
+    sm.set_course_notebook_id("1", "nb-1", "Course 1")
+
+    for file_filter in (FileFilter(include_extensions=["pdf"]), FileFilter()):
+        engine = SyncEngine(
+            canvas, sm, notebook, file_filter=file_filter, temp_dir=tmp_path / "downloads"
+        )
+        asyncio.run(engine.run([_target(1)]))
+
+    # The unfiltered run lists the course in full instead of from the pdf-only mark.
+    assert canvas.listed_since == [None, None]
+    assert [name for _, name in notebook.uploaded] == ["new.pdf", "mid.docx"]
+
+
+def test_failed_file_is_queued_for_retry_with_backoff(tmp_path: Path):
+    files = {1: [_file(10, "a.pdf", updated_at="2024-03-01T00:00:00Z")]}
+    canvas = FakeCanvasClient(files, fail_downloads={"https://canvas.test/files/10"})
+    notebook = FakeNotebookClient()
+    sm = StateManager(str(tmp_path / "state.db"))
+    sm.set_course_notebook_id("1", "nb-1", "Course 1")
+
+    def run(**kwargs):
+        engine = SyncEngine(canvas, sm, notebook, temp_dir=tmp_path / "downloads", **kwargs)
+        asyncio.run(engine.run([_target(1)]))
+        return engine.summary
+
+    run(retry_backoff=3600)
+    status, attempts, next_attempt_at, last_error = sm.get_file_job("10")
+    assert (status, attempts) == ("failed", 1)
+    assert next_attempt_at > time.time() + 3000
+    assert "download failed" in last_error
+    # The failure is remembered in the queue, so the listing can move on.
+    assert sm.get_course_high_water_mark("1") == "2024-03-01T00:00:00Z"
+
+    # Not due yet: the next run leaves it alone.
+    assert run().deferred == 1
+    assert sm.get_file_job("10")[1] == 1
+
+    # Once due, it is retried from the queue even though it is no longer listed.
+    canvas.fail_downloads.clear()
+    sm.retry_failed_jobs("1")
+    summary = run()
+    assert (summary.recovered, summary.uploaded) == (1, 1)
+    assert sm.get_file_job("10")[0] == "uploaded"
+    assert set(sm.get_processed_file_versions("1")) == {"10"}
+
+
+def test_broken_file_is_given_up_after_max_attempts(tmp_path: Path):
+    files = {1: [_file(10, "a.pdf")]}
+    canvas = FakeCanvasClient(files, fail_downloads={"https://canvas.test/files/10"})
+    sm = StateManager(str(tmp_path / "state.db"))
+    sm.set_course_notebook_id("1", "nb-1", "Course 1")
+
+    for _ in range(4):
+        engine = SyncEngine(
+            canvas,
+            sm,
+            FakeNotebookClient(),
+            temp_dir=tmp_path / "downloads",
+            max_attempts=2,
+            retry_backoff=0,
+        )
+        asyncio.run(engine.run([_target(1)]))
+
+    status, attempts, next_attempt_at, _ = sm.get_file_job("10")
+    assert (status, attempts, next_attempt_at) == ("failed", 2, None)
+
+
+def test_crash_after_upload_resumes_at_processing_wait(tmp_path: Path):
+    sm = StateManager(str(tmp_path / "state.db"))
+    sm.set_course_notebook_id("1", "nb-1", "Course 1")
+    # A previous run uploaded the file and then died while waiting for processing.
+    sm.queue_file_job("10", "1", "a.pdf", "https://canvas.test/files/10", size=1)
+    sm.set_file_job_status("10", None, 1, "uploading", source_id="src-1")
+
+    canvas = FakeCanvasClient({1: []})
+    notebook = FakeNotebookClient()
+    notebook.uploaded.append(("nb-1", "a.pdf"))
+    engine = SyncEngine(canvas, sm, notebook, temp_dir=tmp_path / "downloads")
+    asyncio.run(engine.run([_target(1)]))
+
+    assert notebook.uploaded == [("nb-1", "a.pdf")]
+    assert sm.get_processed_file_versions("1")["10"][2] == "src-1"
+    assert sm.get_file_job("10")[0] == "uploaded"
+
+
+def test_identical_content_is_not_uploaded_twice(tmp_path: Path):
+    files = {1: [_file(10, "syllabus.pdf")]}
+    canvas = FakeCanvasClient(
+        files,
+        contents={
+            "https://canvas.test/files/10": b"same bytes",
+            "https://canvas.test/files/11": b"same bytes",
+        },
+    )
+    notebook = FakeNotebookClient()
+    sm = StateManager(str(tmp_path / "state.db"))
+
+    engine = SyncEngine(canvas, sm, notebook, temp_dir=tmp_path / "downloads")
+    asyncio.run(engine.run([_target(1)]))
+
+    files[1].append(_file(11, "syllabus-copy.pdf", updated_at="2024-01-02T00:00:00Z"))
+    engine = SyncEngine(canvas, sm, notebook, temp_dir=tmp_path / "downloads")
+    asyncio.run(engine.run([_target(1)]))
+
+    assert notebook.uploaded == [("nb-1", "syllabus.pdf")]
+    assert engine.summary.deduplicated == 1
+    assert sm.get_processed_file_versions("1")["11"][2] == "src-1"
+
+
+def test_identical_files_listed_together_are_uploaded_once(tmp_path: Path):
+    files = {1: [_file(10, "syllabus.pdf"), _file(11, "syllabus-copy.pdf"), _file(12, "b.pdf")]}
+    contents = {f"https://canvas.test/files/{i}": b"same bytes" for i in (10, 11, 12)}
+    canvas = FakeCanvasClient(files, contents=contents)
+    notebook = FakeNotebookClient(fail_uploads={"syllabus.pdf"})
+    sm = StateManager(str(tmp_path / "state.db"))
+
+    engine = SyncEngine(
+        canvas,
+        sm,
+        notebook,
+        temp_dir=tmp_path / "downloads",
+        limits=SyncLimits(courses=1, downloads=3),
+    )
+    asyncio.run(engine.run([_target(1)]))
+
+    # The first upload fails; one of the waiting duplicates uploads in its place.
+    assert len(notebook.uploaded) == 1
+    assert (engine.summary.uploaded, engine.summary.deduplicated) == (1, 1)
+    versions = sm.get_processed_file_versions("1")
+    assert versions["11"][2] == versions["12"][2] == "src-1"
+    assert engine._uploads == {}
+
+
+def test_small_files_stay_in_memory_and_large_files_spill(tmp_path: Path):
+    files = {1: [_file(10, "small.pdf", size=100), _file(11, "large.pdf", size=10_000)]}
+    notebook = FakeNotebookClient()
+    engine = SyncEngine(
+        FakeCanvasClient(files),
+        StateManager(str(tmp_path / "state.db")),
+        notebook,
+        limits=SyncLimits(memory_threshold_bytes=1000),
+        temp_dir=tmp_path / "spill",
+    )
+    asyncio.run(engine.run([_target(1)]))
+
+    assert notebook.uploaded_from_memory == ["small.pdf"]
+    assert sorted(name for _, name in notebook.uploaded) == ["large.pdf", "small.pdf"]
+    assert list((tmp_path / "spill").iterdir()) == []
+
+
+def test_spill_requires_free_space(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(
+        "sync_engine.shutil.disk_usage", lambda path: SimpleNamespace(free=1024, total=0, used=0)
+    )
+    files = {1: [_file(10, "large.pdf", size=10_000)]}
+    notebook = FakeNotebookClient()
+    engine = SyncEngine(
+        FakeCanvasClient(files),
+        StateManager(str(tmp_path / "state.db")),
+        notebook,
+        limits=SyncLimits(memory_threshold_bytes=0),
+        temp_dir=tmp_path / "spill",
+    )
+    asyncio.run(engine.run([_target(1)]))
+
+    assert notebook.uploaded == []
+    assert engine.summary.failed == 1
+
+
+def test_in_memory_uploads_are_staged_under_temp_dir_within_the_disk_budget(
+    tmp_path: Path, monkeypatch
+):
+    class StagingNotebookClient(FakeNotebookClient):
+        async def add_source_bytes(self, notebook_id, file_name, data, temp_dir=None):
+            self.staged.append((temp_dir, self.engine._temp_disk.used))
+            return await super().add_source_bytes(notebook_id, file_name, data, temp_dir)
+
+    def sync(file_id):
+        notebook = StagingNotebookClient()
+        notebook.staged = []
+        notebook.engine = SyncEngine(
+            FakeCanvasClient({1: [_file(file_id, "small.pdf", size=100)]}),
+            StateManager(str(tmp_path / f"{file_id}.db")),
+            notebook,
+            temp_dir=tmp_path / "spill",
+        )
+        asyncio.run(notebook.engine.run([_target(1)]))
+        return notebook
+
+    notebook = sync(10)
+    assert notebook.staged == [(tmp_path / "spill", len(b"https://canvas.test/files/10"))]
+    assert notebook.engine._temp_disk.used == 0
+
+    monkeypatch.setattr(
+        "sync_engine.shutil.disk_usage", lambda path: SimpleNamespace(free=1024, total=0, used=0)
+    )
+    notebook = sync(11)
+    assert notebook.staged == []
+    assert notebook.engine.summary.failed == 1
+
+
+def test_sources_are_polled_together_and_failed_processing_is_retried(tmp_path: Path):
+    files = {1: [_file(i, f"{i}.pdf") for i in range(8)]}
+    notebook = FakeNotebookClient(fail_processing={"3.pdf"})
+    sm = StateManager(str(tmp_path / "state.db"))
+    engine = SyncEngine(
+        FakeCanvasClient(files),
+        sm,
+        notebook,
+        limits=SyncLimits(uploads=4, queue_depth=8),
+        temp_dir=tmp_path / "downloads",
+    )
+    asyncio.run(engine.run([_target(1)]))
+
+    assert notebook.polls < 8
+    assert engine.summary.uploaded == 7
+    assert engine.summary.failed == 1
+    failed_source = f"src-{notebook.uploaded.index(('nb-1', '3.pdf')) + 1}"
+    assert notebook.deleted == [("nb-1", failed_source)]
+    assert "3" not in set(sm.get_processed_file_versions("1"))
+
+
+def test_managed_courses_are_resolved_by_id_and_cached(tmp_path: Path):
+    class CourseLookupClient:
+        def __init__(self):
+            self.lookups = []
+
+        def get_course(self, course_id):
+            self.lookups.append(course_id)
+            if course_id == "404":
+                return None
+            return SimpleNamespace(
+                id=int(course_id), name=f"Course {course_id}", concluded=course_id == "3"
+            )
+
+        def course_from_metadata(self, metadata):
+            return SimpleNamespace(**metadata)
+
+        def course_metadata(self, course):
+            return vars(course)
+
+        def is_course_active(self, course):
+            return not course.concluded
+
+    sm = StateManager(str(tmp_path / "state.db"))
+    for course_id in ("1", "2", "3", "404"):
+        sm.set_course_notebook_id(course_id, f"nb-{course_id}", f"Course {course_id}")
+    canvas = CourseLookupClient()
+
+    def resolve():
+        courses = asyncio.run(
+            resolve_courses(canvas, sm, ["1", "2", "3", "404"], concurrency=4, cache_ttl=3600)
+        )
+        return [course.id for course in courses]
+
+    assert resolve() == [1, 2]
+    assert sorted(canvas.lookups) == ["1", "2", "3", "404"]
+
+    # Second run: everything but the missing course comes from the cache.
+    assert resolve() == [1, 2]
+    assert sorted(canvas.lookups) == ["1", "2", "3", "404", "404"]
+
+
+def test_interrupted_listing_syncs_seen_files_but_keeps_high_water_mark(tmp_path: Path):
+    files = {1: [_file(i, f"{i}.pdf", updated_at=f"2024-01-0{9 - i}T00:00:00Z") for i in range(5)]}
+    canvas = FakeCanvasClient(files, fail_listing_after=3)
+    sm = StateManager(str(tmp_path / "state.db"))
+    sm.set_course_notebook_id("1", "nb-1", "Course 1")
+
+    engine = SyncEngine(canvas, sm, FakeNotebookClient(), temp_dir=tmp_path / "downloads")
+    target = _target(1)
+    asyncio.run(engine.run([target]))
+
+    assert set(sm.get_processed_file_versions("1")) == {"0", "1", "2"}
+    assert sm.get_course_high_water_mark("1") is None
+    assert isinstance(target.error, RuntimeError)
+
+
+def test_bulk_listing_only_prefetches_courses_listed_in_full(tmp_path: Path):
+    class BulkCanvasClient(FakeCanvasClient):
+        bulk_listing = True
+        listing_batch_size = 20
+
+        def __init__(self, files_by_course):
+            super().__init__(files_by_course)
+            self.prefetched = []
+
+        def prefetch_course_files(self, course_ids):
+            self.prefetched.append(course_ids)
+
+    files = {course: [_file(course * 10, f"{course}.pdf")] for course in (1, 2, 3)}
+    canvas = BulkCanvasClient(files)
+    sm = StateManager(str(tmp_path / "state.db"))
+    for course in files:
+        sm.set_course_notebook_id(str(course), f"nb-{course}", f"Course {course}")
+    for targets in ([_target(1), _target(2)], [_target(1), _target(2), _target(3)]):
+        engine = SyncEngine(canvas, sm, FakeNotebookClient(), temp_dir=tmp_path / "downloads")
+        asyncio.run(engine.run(targets))
+
+    # The second run lists courses with a high-water mark incrementally, not in bulk.
+    assert canvas.prefetched == [[1, 2], [3]]
+
+
+def test_interrupted_spill_download_resumes_on_next_run(tmp_path: Path):
+    content = b"x" * 64
+
+    class InterruptingCanvasClient(FakeCanvasClient):
+        def __init__(self, files_by_course):
+            super().__init__(files_by_course)
+            self.resumed_from = []
+
+        def download_file(self, file_url, destination_path, progress=None):
+            existing = os.path.getsize(destination_path) if os.path.exists(destination_path) else 0
+            self.resumed_from.append((existing, progress.bytes_received, progress.etag))
+            with open(destination_path, "ab") as f:
+                if not existing:
+                    f.write(content[:40])
+                    progress.bytes_received, progress.etag = 40, '"v1"'
+                    progress.report()
+                    raise ConnectionError("connection dropped")
+                f.write(content[existing:])
+            return hashlib.sha256(content).hexdigest()
+
+    files = {1: [_file(10, "big.pdf", size=len(content))]}
+    canvas = InterruptingCanvasClient(files)
+    sm = StateManager(str(tmp_path / "state.db"))
+    sm.set_course_notebook_id("1", "nb-1", "Course 1")
+    limits = SyncLimits(memory_threshold_bytes=0)
+
+    for _ in range(2):
+        engine = SyncEngine(
+            canvas, sm, FakeNotebookClient(), limits=limits, temp_dir=tmp_path, retry_backoff=0
+        )
+        asyncio.run(engine.run([_target(1)]))
+
+    assert canvas.resumed_from == [(0, 0, None), (40, 40, '"v1"')]
+    assert set(sm.get_processed_file_versions("1")) == {"10"}
+    assert sm.get_partial_download("10") is None
+    assert not any(p.is_dir() for p in tmp_path.iterdir())
+
+
+def test_full_notebook_continues_in_a_new_shard(tmp_path: Path):
+    files = {1: [_file(10, "a.pdf"), _file(11, "b.pdf"), _file(12, "c.pdf")]}
+    notebook = FakeNotebookClient()
+    sm = StateManager(str(tmp_path / "state.db"))
+    sm.set_course_notebook_id("1", "nb-1", "Course 1")
+
+    def run():
+        engine = SyncEngine(
+            FakeCanvasClient(files),
+            sm,
+            notebook,
+            temp_dir=tmp_path / "downloads",
+            max_sources_per_notebook=2,
+        )
+        asyncio.run(engine.run([_target(1)]))
+
+    run()
+    files[1].append(_file(13, "d.pdf", updated_at="2024-01-02T00:00:00Z"))
+    run()
+
+    assert notebook.uploaded == [
+        ("nb-1", "a.pdf"),
+        ("nb-1", "b.pdf"),
+        ("nb-new-1", "c.pdf"),
+        ("nb-new-1", "d.pdf"),
+    ]
+    assert notebook.created == ["Course 1 (part 2)"]
+    assert sm.get_course_shards("1") == [(1, "nb-new-1")]
+    assert sm.count_notebook_sources("1", "nb-1") == {"nb-1": 2, "nb-new-1": 2}
+    # Shards are not courses of their own.
+    assert [c[0] for c in sm.get_all_managed_courses()] == ["1"]
+
+
+def test_smallest_upload_order_waits_for_the_listing(tmp_path: Path):
+    files = {
+        1: [
+            _file(10, "big.pdf", size=30, updated_at="2024-01-03T00:00:00Z"),
+            _file(11, "old.pdf", size=10, updated_at="2024-01-01T00:00:00Z"),
+            _file(12, "new.pdf", size=10, updated_at="2024-01-02T00:00:00Z"),
+        ]
+    }
+    notebook = FakeNotebookClient()
+    engine = SyncEngine(
+        FakeCanvasClient(files),
+        StateManager(str(tmp_path / "state.db")),
+        notebook,
+        temp_dir=tmp_path / "downloads",
+        upload_order="smallest",
+    )
+    asyncio.run(engine.run([_target(1)]))
+
+    assert [name for _, name in notebook.uploaded] == ["new.pdf", "old.pdf", "big.pdf"]
+
+
+def test_plan_orders_shards_and_estimates_without_side_effects(tmp_path: Path):
+    files = {
+        1: [
+            _file(10, "a.pdf", size=100, updated_at="2024-02-01T00:00:00Z"),
+            _file(11, "b.pdf", size=200),
+            _file(12, "c.pdf", size=300),
+            _file(13, "talk.mp4"),
+        ]
+    }
+    sm = StateManager(str(tmp_path / "state.db"))
+    sm.set_course_notebook_id("1", "nb-1", "Course 1")
+    for file_id, name, size in (("10", "a.pdf", 100), ("11", "b.pdf", 200)):
+        sm.mark_file_processed(
+            file_id, "1", name, updated_at="2024-01-01T00:00:00Z", size=size, source_id=name
+        )
+    notebook = FakeNotebookClient()
+    engine = SyncEngine(
+        FakeCanvasClient(files), sm, notebook, max_sources_per_notebook=2, upload_order="smallest"
+    )
+
+    [plan] = asyncio.run(engine.plan([_target(1)]))
+
+    assert plan["files"] == {"new": 1, "changed": 1, "unchanged": 1, "skipped": 1}
+    assert plan["notebooks"] == [{"notebook_id": "nb-1", "sources": 2}]
+    # The full notebook has no room for a new version next to the old one, so the changed
+    # file moves to a new notebook and its old source frees a slot for the new file.
+    assert [(u["file_name"], u["notebook"]) for u in plan["uploads"]] == [
+        ("a.pdf", "new notebook 1"),
+        ("c.pdf", "nb-1"),
+    ]
+    assert (plan["upload_files"], plan["upload_bytes"], plan["new_notebooks"]) == (2, 400, 1)
+    assert plan["estimated_seconds"] > 0
+    assert notebook.uploaded == [] and notebook.created == []
+    assert sm.get_file_job("12") is None
+
+
+def _text_file(file_id, name, folder_id, updated_at="2024-01-01T00:00:00Z"):
+    file = _file(file_id, name, size=20, updated_at=updated_at)
+    file.folder_id, file.content_type = folder_id, "text/plain"
+    return file
+
+
+def test_small_text_files_are_bundled_per_folder(tmp_path: Path):
+    files = {
+        1: [
+            _text_file(10, "notes.txt", 5),
+            _text_file(11, "data.csv", 5),
+            _text_file(12, "readme.md", 6),
+            _file(13, "slides.pdf", size=20),
+        ]
+    }
+    contents = {f.url: f"text of {f.filename}".encode() for f in files[1]}
+    canvas = FakeCanvasClient(files, contents=contents)
+    canvas.get_course_folders = lambda course_id: {
+        5: "course files/Week 1",
+        6: "course files/Week 2",
+    }
+    notebook = FakeNotebookClient()
+    sm = StateManager(str(tmp_path / "state.db"))
+    engine = SyncEngine(
+        canvas,
+        sm,
+        notebook,
+        temp_dir=tmp_path / "downloads",
+        bundler=SmallFileBundler(max_file_bytes=100),
+    )
+
+    asyncio.run(engine.run([_target(1)]))
+
+    week_1 = "Course 1 - course files - Week 1 (small files 1).md"
+    assert sorted(name for _, name in notebook.uploaded) == [
+        week_1,
+        "Course 1 - course files - Week 2 (small files 1).md",
+        "slides.pdf",
+    ]
+    assert engine.summary.bundled == 3
+    assert sm.get_bundle_membership("1") == {"10": "1/5/1", "11": "1/5/1", "12": "1/6/1"}
+    document = notebook.uploaded_data[week_1].decode()
+    # Members are sorted by name.
+    assert document.index("text of data.csv") < document.index("text of notes.txt")
+    assert "readme.md" not in document
+    # Every member points at its bundle's source.
+    versions = sm.get_processed_file_versions("1")
+    assert versions["10"][2] == versions["11"][2] != versions["12"][2]
+
+
+def test_changed_member_rebuilds_only_its_bundle(tmp_path: Path):
+    files = {
+        1: [_text_file(10, "a.txt", 5), _text_file(11, "b.txt", 5), _text_file(12, "c.txt", 6)]
+    }
+    contents = {f.url: f"first {f.filename}".encode() for f in files[1]}
+    canvas = FakeCanvasClient(files, contents=contents)
+    notebook = FakeNotebookClient()
+    sm = StateManager(str(tmp_path / "state.db"))
+
+    def run():
+        engine = SyncEngine(
+            canvas,
+            sm,
+            notebook,
+            temp_dir=tmp_path / "downloads",
+            bundler=SmallFileBundler(max_file_bytes=100),
+        )
+        asyncio.run(engine.run([_target(1)]))
+        return engine
+
+    run()
+    old_sources = {k: v[2] for k, v in sm.get_processed_file_versions("1").items()}
+    files[1][0] = _text_file(10, "a.txt", 5, updated_at="2024-01-02T00:00:00Z")
+    contents[files[1][0].url] = b"second a.txt"
+    canvas.fail_downloads.add(files[1][1].url)
+    engine = run()
+
+    assert engine.summary.bundled == 1
+    assert len(notebook.uploaded) == 3
+    document = notebook.uploaded_data[notebook.uploaded[-1][1]]
+    # b.txt was not downloaded again; its text comes from the state DB.
+    assert b"second a.txt" in document and b"first b.txt" in document
+    assert b"first a.txt" not in document
+    assert notebook.deleted == [("nb-1", old_sources["10"])]
+    sources = {k: v[2] for k, v in sm.get_processed_file_versions("1").items()}
+    assert sources["10"] == sources["11"] != old_sources["10"]
+    assert sources["12"] == old_sources["12"]
+
+
+def test_file_that_joins_a_bundle_loses_its_standalone_source(tmp_path: Path):
+    files = {1: [_file(10, "notes.txt", size=500)]}
+    files[1][0].folder_id, files[1][0].content_type = 5, "text/plain"
+    canvas = FakeCanvasClient(files, contents={files[1][0].url: b"long notes"})
+    notebook = FakeNotebookClient()
+    sm = StateManager(str(tmp_path / "state.db"))
+
+    def run():
+        engine = SyncEngine(
+            canvas,
+            sm,
+            notebook,
+            temp_dir=tmp_path / "downloads",
+            bundler=SmallFileBundler(max_file_bytes=100),
+        )
+        asyncio.run(engine.run([_target(1)]))
+
+    run()
+    # Trimmed below the bundling threshold.
+    files[1][0] = _text_file(10, "notes.txt", 5, updated_at="2024-01-02T00:00:00Z")
+    canvas.contents[files[1][0].url] = b"notes"
+    run()
+
+    assert [name for _, name in notebook.uploaded] == [
+        "notes.txt",
+        "Course 1 - files (small files 1).md",
+    ]
+    assert notebook.deleted == [("nb-1", "src-1")]
+    assert sm.get_processed_file_versions("1")["10"][2] == "src-2"
+
+
+class FakeExtractor:
+    workers = 2
+
+    def __init__(self):
+        self.extracted = []
+
+    def accepts(self, job):
+        return job.file_name.endswith(".pptx")
+
+    async def extract(self, job):
+        self.extracted.append(job.file_name)
+        return b"slide text"
+
+
+def test_extracted_text_is_uploaded_and_cached_by_content(tmp_path: Path):
+    files = {1: [_file(10, "deck.pptx", size=1000), _file(11, "notes.pdf", size=1000)]}
+    contents = {files[1][0].url: b"x" * 1000, files[1][1].url: b"y" * 1000}
+    notebook = FakeNotebookClient()
+    sm = StateManager(str(tmp_path / "state.db"))
+    extractor = FakeExtractor()
+
+    def run(course_id):
+        engine = SyncEngine(
+            FakeCanvasClient(files, contents=contents),
+            sm,
+            notebook,
+            temp_dir=tmp_path / "downloads",
+            extractor=extractor,
+        )
+        asyncio.run(engine.run([_target(course_id)]))
+        return engine
+
+    engine = run(1)
+    # The same deck in another course is uploaded there, but not extracted again.
+    files[2] = [_file(20, "deck.pptx", size=1000)]
+    contents[files[2][0].url] = b"x" * 1000
+    second = run(2)
+
+    assert sorted(notebook.uploaded) == [
+        ("nb-1", "deck.pptx.md"),
+        ("nb-1", "notes.pdf"),
+        ("nb-2", "deck.pptx.md"),
+    ]
+    assert notebook.uploaded_data["deck.pptx.md"] == b"slide text"
+    assert (engine.summary.extracted, engine.summary.extraction_bytes_saved) == (1, 990)
+    assert extractor.extracted == ["deck.pptx"]
+    assert second.summary.extracted == 1
+    assert second.metrics.snapshot()["counters"]["extraction_cache_hits"] == 1
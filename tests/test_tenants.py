@@ -0,0 +1,162 @@
+import asyncio
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from main import setup_args
+from tenants import Tenant, TenantRegistry, TenantWorker, tenant_resource
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def _registry(tmp_path, *tenant_ids):
+    registry = TenantRegistry(str(tmp_path / "tenants.db"))
+    for tenant_id in tenant_ids:
+        registry.add_tenant(Tenant(tenant_id, "https://canvas.test", f"token-{tenant_id}"))
+    return registry
+
+
+def test_tenants_are_registered_with_their_own_state_db(tmp_path: Path):
+    registry = _registry(tmp_path, "alice", "bob")
+    registry.add_tenant(Tenant("bob", "https://other.test", "new-token", "bob/storage.json"))
+
+    alice, bob = registry.get_tenants()
+    assert alice.state_db == os.path.join("tenants", "alice", "state.db")
+    assert (bob.canvas_url, bob.canvas_key, bob.notebooklm_storage) == (
+        "https://other.test",
+        "new-token",
+        "bob/storage.json",
+    )
+    assert registry.remove_tenant("alice") and not registry.remove_tenant("alice")
+    with pytest.raises(ValueError):
+        registry.add_tenant(Tenant("../etc", "https://canvas.test", "token"))
+
+
+def test_a_lease_has_one_owner_until_it_expires(tmp_path: Path):
+    registry = _registry(tmp_path)
+    # A second connection, as another worker process would have.
+    other = TenantRegistry(registry.db_path)
+    resource = tenant_resource("alice")
+
+    assert registry.claim(resource, "w1", 60, now=0)
+    assert not other.claim(resource, "w2", 60, now=30)
+    assert registry.renew(resource, "w1", 60, now=30)
+    assert not other.claim(resource, "w2", 60, now=89)
+    assert other.claim(resource, "w2", 60, now=90)
+    assert not registry.renew(resource, "w1", 60, now=91)
+    assert registry.lease_owner(resource, now=91) == "w2"
+    other.release(resource, "w2")
+    assert registry.lease_owner(resource, now=91) is None
+
+
+def test_leased_tenants_are_not_due_for_other_workers(tmp_path: Path):
+    registry = _registry(tmp_path, "alice", "bob")
+    registry.claim(tenant_resource("alice"), "w1", 60, now=100)
+
+    assert [t.tenant_id for t in registry.due_tenants(now=100)] == ["bob"]
+    registry.finish_sync("bob", next_sync_at=500)
+    assert registry.due_tenants(now=100) == []
+    # Alice can be claimed again once her lease runs out.
+    assert registry.seconds_until_due(now=100) == 60
+
+
+def test_workers_share_tenants_without_syncing_one_twice(tmp_path: Path):
+    tenant_ids = [f"user{i}" for i in range(6)]
+    registry = _registry(tmp_path, *tenant_ids)
+    synced = []
+
+    async def scenario():
+        workers = []
+
+        async def sync(tenant, worker_id):
+            synced.append((tenant.tenant_id, worker_id))
+            await asyncio.sleep(0.05)
+            if len(synced) == len(tenant_ids):
+                for worker in workers:
+                    worker.stop()
+
+        for worker_id in ("w1", "w2"):
+            workers.append(
+                TenantWorker(
+                    TenantRegistry(registry.db_path),
+                    lambda tenant, worker_id=worker_id: sync(tenant, worker_id),
+                    worker_id=worker_id,
+                    max_tenants=2,
+                    interval=3600,
+                )
+            )
+        await asyncio.wait_for(asyncio.gather(*(w.run() for w in workers)), timeout=10)
+        return workers
+
+    workers = asyncio.run(scenario())
+
+    assert sorted(tenant_id for tenant_id, _ in synced) == tenant_ids
+    assert {worker_id for _, worker_id in synced} == {"w1", "w2"}
+    assert sum(worker.syncs for worker in workers) == len(tenant_ids)
+    # Every tenant is scheduled an interval ahead and no lease is left behind.
+    assert registry.due_tenants() == []
+    assert all(registry.lease_owner(tenant_resource(t)) is None for t in tenant_ids)
+
+
+def test_sync_is_cancelled_when_its_lease_is_taken_over(tmp_path: Path):
+    registry = _registry(tmp_path, "alice")
+    outcome = []
+
+    async def scenario():
+        async def sync(tenant):
+            # Another worker takes the tenant over, e.g. after this one stalled.
+            registry.release(tenant_resource("alice"), "w1")
+            registry.claim(tenant_resource("alice"), "w2", 60)
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                outcome.append("cancelled")
+                worker.stop()
+                raise
+
+        worker = TenantWorker(registry, sync, worker_id="w1", lease_seconds=0.15)
+        await asyncio.wait_for(worker.run(), timeout=5)
+        return worker
+
+    worker = asyncio.run(scenario())
+
+    assert outcome == ["cancelled"]
+    assert (worker.syncs, worker.lost_leases) == (0, 1)
+    # The new owner's lease is left alone.
+    assert registry.lease_owner(tenant_resource("alice")) == "w2"
+
+
+def test_add_and_list_tenants_from_the_command_line(tmp_path: Path):
+    env = dict(
+        os.environ,
+        PYTHONPATH=str(REPO_ROOT),
+        CANVAS_URL="https://canvas.test",
+        CANVAS_KEY="secret-token",
+    )
+
+    def run(*argv):
+        return subprocess.run(
+            [sys.executable, "-c", "import main; main.cli()", *argv],
+            cwd=tmp_path,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=60,
+        ).stdout
+
+    run("--add-tenant", "alice", "--notebooklm-storage", "alice.json")
+    listing = run("--list-tenants")
+
+    assert "alice: https://canvas.test" in listing and "alice.json" in listing
+    assert "secret-token" not in listing
+    # The single-user state DB is not touched.
+    assert not (tmp_path / "state.db").exists()
+
+
+def test_worker_flags():
+    args = setup_args(["--worker", "--worker-tenants", "4", "--lease-minutes", "2"])
+    assert (args.worker, args.worker_tenants, args.lease_minutes) == (True, 4, 2.0)